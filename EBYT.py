@@ -1,28 +1,60 @@
-
+import startup # First, startup times are from here
 import os
 os.environ['QT_API'] = 'PySide6' # For qasync to know which binding is being used
 os.environ['QT_LOGGING_RULES'] = 'qt.pointer.dispatch=false' # Disable pointer logging
 
 import sys
-import asyncio
-from PySide6.QtWidgets import QApplication
-from qasync import QEventLoop
-from View import View
+import argparse
 import logging
+import multiprocessing
 
 logger = logging.getLogger(__name__)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # In a frozen app, runs the analysis worker when this is its process, instead of the app
     logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="Every Breath You Take")
+    parser.add_argument('--record', metavar='DIR', help="record each session to a new directory in DIR")
+    parser.add_argument('--decimation', choices=['minmax', 'lttb', 'off'], default='minmax', help="decimation of long chart series to the chart width")
+    parser.add_argument('--instrument', metavar='JSON', nargs='?', const='instrumentation.json',
+                        help="time the hot paths, show the statistics in an overlay and write them to JSON on exit")
+    parser.add_argument('--profile-startup', metavar='JSON', nargs='?', const='startup.json',
+                        help="log the import time of each module and the time to first paint, and write them to JSON")
+    parser.add_argument('--simulate', metavar='BREATHING_RATE', nargs='?', type=float, const=6.0,
+                        help="list a simulated sensor, breathing at BREATHING_RATE breaths per minute, for running without hardware")
+    parser.add_argument('--quit-after-startup', action='store_true', help="quit once the charts are created, for timing startup")
+    args, qt_args = parser.parse_known_args()
+    if args.profile_startup:
+        startup.install_import_timer()
+    if args.instrument:
+        os.environ['EBYT_INSTRUMENT'] = '1' # Read when the instrumented modules are imported, and by the analysis worker
+        os.environ['EBYT_INSTRUMENT_OUTPUT'] = args.instrument
+
+    # Imported after the arguments, so they can be timed and see the environment
+    import asyncio
+    from PySide6.QtWidgets import QApplication
+    from qasync import QEventLoop
+    from View import View
+    startup.mark('imported')
+
+    app = QApplication(sys.argv[:1] + qt_args)
     loop = QEventLoop(app)
     asyncio.set_event_loop(loop)
-    
-    plot = View()
+
+    simulated_options = None if args.simulate is None else {'breathing_rate': args.simulate}
+    plot = View(record_dir=args.record, decimation=None if args.decimation == 'off' else args.decimation, simulated_options=simulated_options)
     plot.setWindowTitle("Rolling Plot")
     plot.resize(1200, 600)
+    startup.mark('window created')
+    plot.first_painted.connect(lambda: startup.mark('first paint'))
+    plot.charts_created.connect(lambda: startup.mark('charts created'))
+    if args.profile_startup:
+        plot.charts_created.connect(lambda: startup.report(args.profile_startup))
+    if args.quit_after_startup:
+        plot.charts_created.connect(plot.close)
+        plot.charts_created.connect(loop.stop)
     plot.show()
 
     loop.create_task(plot.main())
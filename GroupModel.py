@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import functools
+import numpy as np
+from PySide6.QtCore import QObject, Signal
+from blehrm.interface import BlehrmClientInterface
+from analysis.AnalysisPipeline import AnalysisPipeline
+
+class GroupModel(QObject):
+
+    sensor_connected = Signal(str)
+    sensor_disconnected = Signal(str)
+
+    PIPELINE_SCHEDULE = {name: None for name in AnalysisPipeline.DEFAULT_SCHEDULE}
+
+    def __init__(self):
+        '''
+        Model for group sessions, with many sensors connected at once on the asyncio loop
+        Each sensor has its own AnalysisPipeline, and callbacks only touch the pipeline of their sensor,
+        so the cost per sample does not grow with the size of the group
+        Group metrics are calculated on demand with get_group_metrics, in O(number of sensors)
+        The pipelines have no scheduled analyses (see AnalysisPipeline.run_scheduled), as get_group_metrics
+        runs the only one it uses, coherence, when it is asked for
+        '''
+        super().__init__()
+        self.logger = logging.getLogger(__name__)
+        self.sensor_clients = {} # name: sensor client
+        self.pipelines = {} # name: AnalysisPipeline
+        self.coherence_t_last = {} # name: time of the last beat used for coherence
+
+        self.BREATH_STALE_PERIODS = 2 # Breaths older than this many periods are left out of synchrony
+
+    def get_sensor_names(self):
+        return list(self.sensor_clients.keys())
+
+    def _get_unique_name(self, sensor):
+        device = sensor.ble_device
+        name = str(getattr(device, 'name', device))
+        unique_name = name
+        i = 2
+        while unique_name in self.sensor_clients:
+            unique_name = f"{name} ({i})"
+            i += 1
+        return unique_name
+
+    async def add_sensor(self, sensor: BlehrmClientInterface):
+        '''
+        Connects a sensor and starts its streams into a new pipeline, returns the name of the sensor in the group
+        '''
+        name = self._get_unique_name(sensor)
+        self.sensor_clients[name] = sensor
+        self.pipelines[name] = AnalysisPipeline(schedule=self.PIPELINE_SCHEDULE)
+        try:
+            await sensor.connect()
+            await sensor.start_ibi_stream(callback=functools.partial(self.handle_ibi_callback, name))
+            await sensor.start_acc_stream(callback=functools.partial(self.handle_acc_callback, name))
+        except Exception:
+            del self.sensor_clients[name]
+            del self.pipelines[name]
+            raise
+
+        self.logger.info(f"Added {name} to the group, {len(self.sensor_clients)} sensors")
+        self.sensor_connected.emit(name)
+        return name
+
+    async def add_sensors(self, sensors):
+        '''
+        Connects sensors concurrently, returns the names of those that connected
+        '''
+        results = await asyncio.gather(*(self.add_sensor(sensor) for sensor in sensors), return_exceptions=True)
+        names = []
+        for sensor, result in zip(sensors, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Failed to connect {sensor.ble_device}: {result}")
+            else:
+                names.append(result)
+        return names
+
+    async def remove_sensor(self, name):
+        sensor = self.sensor_clients.pop(name)
+        self.pipelines.pop(name)
+        self.coherence_t_last.pop(name, None)
+        await sensor.disconnect()
+        self.sensor_disconnected.emit(name)
+
+    async def disconnect_all(self):
+        await asyncio.gather(*(self.remove_sensor(name) for name in self.get_sensor_names()))
+
+    def handle_ibi_callback(self, name, data):
+        self.pipelines[name].update_ibi(data)
+
+    def handle_acc_callback(self, name, data):
+        self.pipelines[name].update_acc(data)
+
+    def update_coherence(self, name):
+        '''
+        Updates the coherence of a sensor if it has new beats, returns the latest coherence, nan until 30 s of beats
+        Only the streaming spectrum is used, so the cost is bounded per sensor
+        '''
+        hrv_analyser = self.pipelines[name].hrv_analyser
+        if not hrv_analyser.hrv_spectrum.is_full():
+            return np.nan
+        t_last_beat = hrv_analyser.ibi_history.times[-1]
+        if self.coherence_t_last.get(name) != t_last_beat:
+            hrv_analyser.update_coherence()
+            self.coherence_t_last[name] = t_last_beat
+        return hrv_analyser.hr_coherence
+
+    def get_breathing_phase(self, name, t):
+        '''
+        Returns the breathing phase of a sensor at time t in radians, 0 at the end of a breath
+        Extrapolated from the last breath at the last breathing rate, nan if there is no recent breath
+        '''
+        br_history = self.pipelines[name].breath_analyser.br_history
+        if br_history.is_empty():
+            return np.nan
+        t_breath = br_history.times[-1]
+        breathing_rate = br_history.values[-1]
+        n_breaths = (t - t_breath)*breathing_rate/60
+        if n_breaths > self.BREATH_STALE_PERIODS:
+            return np.nan
+        return 2*np.pi*n_breaths
+
+    def get_last_sample_time(self):
+        '''
+        Returns the time of the latest chest acc sample across the group, in epoch seconds
+        '''
+        times = [pipeline.breath_analyser.chest_acc_history.times[-1] for pipeline in self.pipelines.values()]
+        times = [t for t in times if not np.isnan(t)]
+        return max(times) if times else np.nan
+
+    def get_group_metrics(self, t=None):
+        '''
+        Returns a dict of group metrics at time t (epoch s), by default the latest sample time:
+            n_sensors: number of sensors in the group
+            coherence: per sensor heart rate coherence, and mean_coherence over the sensors with a score
+            breathing_rate: per sensor latest breathing rate, and mean_breathing_rate
+            breathing_synchrony: Kuramoto order parameter of the breathing phases, 1 when the group breathes
+                in phase and near 0 when phases are spread, nan with fewer than 2 breathing sensors
+        '''
+        if t is None:
+            t = self.get_last_sample_time()
+        names = self.get_sensor_names()
+        coherence = {name: self.update_coherence(name) for name in names}
+        breathing_rate = {name: self.pipelines[name].breath_analyser.br_history.values[-1] for name in names}
+        phases = np.array([self.get_breathing_phase(name, t) for name in names])
+        phases = phases[~np.isnan(phases)]
+
+        return {
+            'n_sensors': len(names),
+            'coherence': coherence,
+            'mean_coherence': self._nanmean(list(coherence.values())),
+            'breathing_rate': breathing_rate,
+            'mean_breathing_rate': self._nanmean(list(breathing_rate.values())),
+            'breathing_synchrony': np.abs(np.mean(np.exp(1j*phases))) if len(phases) >= 2 else np.nan
+        }
+
+    @staticmethod
+    def _nanmean(values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        return np.mean(values) if len(values) else np.nan
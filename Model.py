@@ -1,56 +1,299 @@
 import numpy as np
+import os
+import time
+import asyncio
 from Pacer import Pacer
-from blehrm.interface import BlehrmClientInterface
 import logging
 from PySide6.QtCore import QObject, Signal
-from analysis.HrvAnalyser import HrvAnalyser
-from analysis.BreathAnalyser import BreathAnalyser
+from analysis.AnalysisPipeline import AnalysisPipeline
+from analysis.AnalysisWorker import AnalysisWorker
+from analysis.ClockAligner import ClockAligner
+from analysis.AnalysisScheduler import format_stats
+from recording import SessionRecorder
+from analysis.instrumentation import timed
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from blehrm.interface import BlehrmClientInterface # Imported by sensor.py when scanning
 
 class Model(QObject):
     
     sensor_connected = Signal()
+    sensor_disconnected = Signal() # The link dropped, and is being reconnected
+    sensor_reconnected = Signal()
+
+    WATCHDOG_INTERVAL = 1.0 # s between checks of the sensor link
+    STREAM_TIMEOUT = 5.0 # s without samples before a connected sensor is treated as dropped
+    RECONNECT_DELAY = 0.5 # s after the first failed attempt to reconnect, doubling after each failure
+    RECONNECT_MAX_DELAY = 10.0 # s
     
-    def __init__(self):
+    def __init__(self, use_worker=False, align_clocks=False, pipeline_options=None, reconnect=False, record_dir=None):
+        '''
+        use_worker: runs the analysis in a worker process, read back with get_snapshot
+        Otherwise the analysers run in the callbacks, and are available as hrv_analyser and breath_analyser
+        align_clocks: replaces sample times by host times estimated from the sensor clock and the arrival times,
+        before recording and analysis, see ClockAligner. Off for replays, whose times are already aligned
+        pipeline_options: keyword arguments of the AnalysisPipeline, its schedule, budget and windows
+        The scheduled analyses run before each snapshot is published by the worker, or in get_snapshot without one
+        reconnect: watches the sensor once connected, and when its link drops or its samples stop for STREAM_TIMEOUT s,
+        reconnects with backoff and restarts the streams into the same analysis, with a gap marked (see AnalysisPipeline.mark_gap)
+        record_dir: records each sensor set with set_and_connect_sensor to a new session directory in record_dir,
+        started before its streams so the recording has every sample, and continued across reconnects
+        '''
         super().__init__()  
         self.logger = logging.getLogger(__name__)
         self.sensor_client = None
+        self.record_dir = record_dir
+        self.recorder = None
         self.pacer = Pacer()
+        self.ibi_aligner = ClockAligner() if align_clocks else None
+        self.acc_aligner = ClockAligner() if align_clocks else None
+        self.ibi_sensor_time = 0.0 # s, sum of the ibis so far, which is the sensor clock of the beats
 
-        self.hrv_analyser = HrvAnalyser()
-        self.breath_analyser = BreathAnalyser()
+        self.reconnect = reconnect
+        self.watchdog_task = None
+        self.t_last_sample = None # time.monotonic() of the last sample
+        self.t_link_lost = None # time.monotonic() of the last sample before a drop, until samples arrive again
+        self.n_drops = 0
+        self.n_reconnect_attempts = 0
+        self.reconnect_latencies = [] # s from a drop being detected to the streams restarting
+        self.gap_durations = [] # s from the last sample before a drop to the first after
+
+        if use_worker:
+            self.analysis = AnalysisWorker(pipeline_options)
+            self.analysis.start()
+            self.hrv_analyser = None # Live in the worker process
+            self.breath_analyser = None
+        else:
+            self.analysis = AnalysisPipeline(**(pipeline_options or {}))
+            self.hrv_analyser = self.analysis.hrv_analyser
+            self.breath_analyser = self.analysis.breath_analyser
         
-    async def set_and_connect_sensor(self, sensor: BlehrmClientInterface):
+    async def set_and_connect_sensor(self, sensor: 'BlehrmClientInterface'):
         self.sensor_client = sensor
+        self.stop_recording() # Of the previous sensor, a new session starts with the streams
+        await self.start_sensor()
+        self.sensor_connected.emit()
+        if self.reconnect and self.watchdog_task is None:
+            self.watchdog_task = asyncio.create_task(self.watch_sensor())
+
+    async def start_sensor(self):
+        '''
+        Connects the sensor client and starts its streams, and the recording in record_dir first if there is none
+        '''
         await self.sensor_client.connect()    
         await self.sensor_client.get_device_info()
         await self.sensor_client.print_device_info()
         
+        if self.record_dir is not None and self.recorder is None:
+            self.start_recording_in(self.record_dir)
         await self.sensor_client.start_ibi_stream(callback=self.handle_ibi_callback)
         await self.sensor_client.start_acc_stream(callback=self.handle_acc_callback)
-        
-        self.sensor_connected.emit()
+        self.t_last_sample = time.monotonic()
 
     async def disconnect_sensor(self):
+        self.stop_watchdog()
         await self.sensor_client.disconnect()
 
+    def is_sensor_connected(self):
+        '''
+        Returns whether the link is up, from the bleak client of a BLE sensor, or is_connected of other clients if they have it
+        '''
+        client = getattr(self.sensor_client, 'bleak_client', self.sensor_client) # Set by connect on BLE sensors
+        return bool(getattr(client, 'is_connected', True))
+
+    async def watch_sensor(self):
+        '''
+        Checks the sensor every WATCHDOG_INTERVAL s, and reconnects it when its link drops or its samples stop
+        '''
+        while True:
+            await asyncio.sleep(self.WATCHDOG_INTERVAL)
+            is_stalled = time.monotonic() - self.t_last_sample > self.STREAM_TIMEOUT
+            if self.is_sensor_connected() and not is_stalled:
+                continue
+            self.logger.warning(f"Sensor {'stopped streaming' if is_stalled else 'disconnected'}, reconnecting")
+            await self.reconnect_sensor()
+
+    async def reconnect_sensor(self):
+        '''
+        Reconnects the sensor and restarts its streams, retrying with exponential backoff until it succeeds
+        The analysis keeps its state, with a gap marked so that no metric spans the samples missed
+        '''
+        t_detected = time.monotonic()
+        self.n_drops += 1
+        self.t_link_lost = self.t_last_sample
+        self.mark_gap()
+        self.sensor_disconnected.emit()
+
+        delay = self.RECONNECT_DELAY
+        while True:
+            self.n_reconnect_attempts += 1
+            try:
+                await self.sensor_client.disconnect()
+                await self.start_sensor()
+                if self.is_sensor_connected():
+                    break
+            except Exception as e:
+                self.logger.warning(f"Failed to reconnect: {e}")
+            await asyncio.sleep(delay)
+            delay = min(2*delay, self.RECONNECT_MAX_DELAY)
+
+        self.reconnect_latencies.append(time.monotonic() - t_detected)
+        self.logger.info(f"Sensor reconnected in {self.reconnect_latencies[-1]:.2f} s")
+        self.sensor_reconnected.emit()
+
+    def mark_gap(self):
+        '''
+        Marks a gap in the streams, in the analysis and in the recording, see AnalysisPipeline.mark_gap
+        '''
+        self.analysis.mark_gap()
+        if self.ibi_aligner is not None: # The missed beats are not in the sum of the ibis, so their sensor clock starts again
+            self.ibi_aligner = ClockAligner()
+            self.ibi_sensor_time = 0.0
+        if self.recorder is not None:
+            self.recorder.write_gap()
+
+    def stop_watchdog(self):
+        if self.watchdog_task is not None:
+            self.watchdog_task.cancel()
+            self.watchdog_task = None
+
+    def get_connection_stats(self):
+        '''
+        Returns the drops of the sensor link, the attempts to reconnect, and the reconnect latencies and gaps in s
+        '''
+        return {
+            'n_drops': self.n_drops,
+            'n_reconnect_attempts': self.n_reconnect_attempts,
+            'reconnect_latencies': list(self.reconnect_latencies),
+            'gap_durations': list(self.gap_durations)
+        }
+
+    def note_sample(self):
+        '''
+        Records the arrival of a sample, for the watchdog, and the end of a gap
+        '''
+        self.t_last_sample = time.monotonic()
+        if self.t_link_lost is not None:
+            self.gap_durations.append(self.t_last_sample - self.t_link_lost)
+            self.t_link_lost = None
+
+    def start_recording(self, path):
+        '''
+        Starts recording the raw ibi and acc streams to the session directory path
+        '''
+        self.stop_recording()
+        header = {
+            'sensor_class': type(self.sensor_client).__name__ if self.sensor_client else None,
+            'align_clocks': self.acc_aligner is not None,
+            'analysis_params': self.analysis.get_analysis_params()
+        }
+        self.recorder = SessionRecorder(path, header)
+        self.logger.info(f"Recording session to {path}")
+
+    def start_recording_in(self, directory):
+        '''
+        Starts recording to a new session directory in directory, named by the current time
+        '''
+        self.start_recording(os.path.join(directory, time.strftime("%Y%m%d-%H%M%S")))
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def get_snapshot(self):
+        '''
+        Returns the latest analysis histories, as a dict of name: HistoryBuffer (see AnalysisPipeline.SNAPSHOT_HISTORIES)
+        '''
+        self.run_scheduled() # Once for the samples since the last call
+        return self.analysis.get_snapshot()
+
+    def run_scheduled(self):
+        '''
+        Runs the scheduled analyses requested since the last call, see AnalysisPipeline.run_scheduled
+        A worker runs its own before each snapshot it publishes
+        '''
+        if isinstance(self.analysis, AnalysisPipeline):
+            self.analysis.run_scheduled()
+
+    def get_latest(self, history_name):
+        '''
+        Returns (t, value) of the latest sample of an analysis history, without copying the rest of the snapshot
+        '''
+        return self.analysis.get_latest(history_name)
+
+    def get_scheduler_stats(self):
+        '''
+        Returns how often each scheduled analysis was requested, run, degraded or skipped, see AnalysisScheduler.get_stats
+        '''
+        return self.analysis.get_scheduler_stats()
+
+    def get_worker_instrumentation_stats(self):
+        '''
+        Returns the latest instrumentation statistics of the analysis worker, see instrumentation.get_stats,
+        or None without a worker, whose analysis is timed in this process
+        '''
+        if isinstance(self.analysis, AnalysisWorker):
+            return self.analysis.get_instrumentation_stats()
+        return None
+
+    def close(self):
+        '''
+        Stops recording, reconnecting and the analysis worker
+        '''
+        self.stop_watchdog()
+        self.stop_recording()
+        if isinstance(self.analysis, AnalysisWorker):
+            self.analysis.stop()
+        self.logger.info(f"Scheduled analysis:\n{format_stats(self.get_scheduler_stats())}")
+        if self.n_drops:
+            stats = self.get_connection_stats()
+            self.logger.info(f"Sensor dropped {stats['n_drops']} times, {stats['n_reconnect_attempts']} attempts to reconnect, "
+                             f"reconnected in max {max(stats['reconnect_latencies'], default=np.nan):.2f} s, "
+                             f"gaps of max {max(stats['gap_durations'], default=np.nan):.2f} s")
+
+    @timed('Model.handle_ibi_callback')
     def handle_ibi_callback(self, data):
+        self.note_sample()
 
-        t, ibi = data
-        self.hrv_analyser.update(t, ibi)
+        if self.ibi_aligner is not None:
+            data = self.align_ibi(data, time.time())
 
+        if self.recorder is not None:
+            self.recorder.write_ibi(data)
+
+        self.analysis.update_ibi(data)
+
+    @timed('Model.handle_acc_callback')
     def handle_acc_callback(self, data):
         '''
-        Handles reading accelerometer for the sensor
-        Updates the breath_analyser which calculates breathing rate
-        One each breath, hrv_analyser calculates metrics
+        Handles reading accelerometer for the sensor, data is a single sample (t, x, y, z)
+        or a frame of samples with one sample per row
         '''
-        t = data[0]
-        acc = data[1:]
-        self.breath_analyser.update_chest_acc(t, acc)
-        
-        # Breath-by-breath analysis
-        if self.breath_analyser.is_end_of_breath and not self.breath_analyser.br_history.is_empty():
-            
-            t_range = self.breath_analyser.get_last_breath_t_range()                    
-            self.hrv_analyser.update_breath_by_breath_metrics(t_range)
-    
\ No newline at end of file
+        self.note_sample()
+        if self.acc_aligner is not None:
+            data = self.align_acc(data, time.time())
+
+        if self.recorder is not None:
+            self.recorder.write_acc(data)
+
+        self.analysis.update_acc(data)
+
+    def align_ibi(self, data, t_arrival):
+        '''
+        Returns an ibi sample (t, ibi) with t replaced by the host time of the beat
+        The beat times come from the sum of the ibis rather than the arrival times, so beats that arrive
+        together in one packet keep their spacing
+        '''
+        t, ibi = data
+        self.ibi_sensor_time += ibi/1000
+        return np.array([self.ibi_aligner.align(self.ibi_sensor_time, t_arrival), ibi])
+
+    def align_acc(self, data, t_arrival):
+        '''
+        Returns acc data, a sample (t, x, y, z) or a frame of samples, with t replaced by host times
+        '''
+        data = np.array(data, dtype=float)
+        samples = data.reshape(-1, 4)
+        samples[:, 0] = self.acc_aligner.align(samples[:, 0] if data.ndim == 2 else samples[0, 0], t_arrival)
+        return data
@@ -13,6 +13,11 @@ class Pacer(QObject):
         self.last_breathing_rate = 1
         self.phase = 0
 
+        # Rate change segments, the pacer follows breathing_rates[i] with phases[i] from segment_starts[i]
+        self.segment_starts = []
+        self.breathing_rates = []
+        self.phases = []
+
     def breathing_pattern(self, breathing_rate, time):
         """Returns radius of pacer disk.
 
@@ -22,6 +27,9 @@ class Pacer(QObject):
         if breathing_rate != self.last_breathing_rate: # Maintaining continuity by adjusting phase when breathing rate is changes
             self.phase = time - self.last_breathing_rate*(time - self.phase)/breathing_rate
             self.last_breathing_rate = breathing_rate
+            self.segment_starts.append(time)
+            self.breathing_rates.append(breathing_rate)
+            self.phases.append(self.phase)
 
         radius = 0.5 + 0.5 * np.sin(2 * np.pi * breathing_rate / 60 * (time - self.phase))
         return radius
@@ -37,3 +45,20 @@ class Pacer(QObject):
         x = radius * self.cos_theta
         y = radius * self.sin_theta
         return (x, y)
+
+    def trace(self, t_start, t_end, n_points):
+        """Returns (times, radii) of n_points equally spaced from t_start to t_end.
+
+        Radii are recomputed from the rate change segments, so the trace
+        matches the disk at any past time without keeping a history of it.
+        Times before the first update are left out.
+        """
+        times = np.linspace(t_start, t_end, n_points)
+        if not self.segment_starts:
+            return (times[:0], times[:0])
+        times = times[times >= self.segment_starts[0]]
+        segment_ids = np.searchsorted(self.segment_starts, times, side='right') - 1
+        breathing_rates = np.asarray(self.breathing_rates)[segment_ids]
+        phases = np.asarray(self.phases)[segment_ids]
+        radii = 0.5 + 0.5 * np.sin(2 * np.pi * breathing_rates / 60 * (times - phases))
+        return (times, radii)
@@ -1,5 +1,4 @@
-import sys
-from PySide6.QtCore import QTimer, Qt, QPointF, Slot
+from PySide6.QtCore import QTimer, Qt, Slot, QEvent, Signal
 from PySide6.QtWidgets import QVBoxLayout, QHBoxLayout, QSlider, QLabel, QWidget, QComboBox, QPushButton, QGraphicsDropShadowEffect
 from PySide6.QtCharts import QChartView, QLineSeries, QScatterSeries, QAreaSeries
 from PySide6.QtGui import QPen, QPainter, QColor
@@ -7,24 +6,38 @@ import time
 import numpy as np
 import logging
 import asyncio
+from analysis import instrumentation
 from Model import Model
 from sensor import SensorHandler
-from views.widgets import CirclesWidget, SquareWidget
-from views.charts import create_chart, create_scatter_series, create_line_series, create_spline_series, create_axis
+from views.widgets import CirclesWidget, SquareWidget, StatsOverlay
+from views.charts import create_chart, create_scatter_series, create_line_series, create_spline_series, create_axis, replace_series_np
+from views.decimation import decimate
 from styles.colours import RED, YELLOW, GREEN, BLUE, GRAY, GOLD, LINEWIDTH, DOTSIZE_SMALL
 from styles.utils import get_stylesheet
 
 class View(QChartView):
-    
 
-    def __init__(self, parent=None):
+    first_painted = Signal() # The window painted, without its charts
+    charts_created = Signal()
+
+    def __init__(self, parent=None, record_dir=None, decimation='minmax', simulated_options=None):
+        '''
+        The window shows the circles and controls first, and creates the charts once it has painted,
+        so it appears without waiting for them. Scanning for sensors, and the BLE imports, wait for the charts
+        simulated_options: keyword arguments of SimulatedClient, listed as a sensor if not None
+        '''
         super().__init__(parent)
         self.logger = logging.getLogger(__name__)
-        self.model = Model()
+        self.decimation = decimation # Method to decimate long series to the chart width, None draws every point
+        self.model = Model(use_worker=True, align_clocks=True, reconnect=True, record_dir=record_dir) # Sessions are recorded in record_dir when set
         self.model.sensor_connected.connect(self._on_sensor_connected)
+        self.model.sensor_disconnected.connect(self._on_sensor_disconnected)
+        self.model.sensor_reconnected.connect(self._on_sensor_reconnected)
 
-        self.sensor_handler = SensorHandler()
+        self.sensor_handler = SensorHandler(simulated_options=simulated_options)
+        self.sensor_handler.device_found.connect(self._on_device_found)
         self.sensor_handler.scan_complete.connect(self._on_scan_complete)
+        self.connecting_device_name = None
 
         self.setStyleSheet(get_stylesheet("styles/style.qss"))
 
@@ -32,23 +45,37 @@ class View(QChartView):
         self.UPDATE_SERIES_PERIOD = 100 # ms
         self.UPDATE_BREATHING_SERIES_PERIOD = 50 # ms
         self.UPDATE_PACER_PERIOD = 10 # 20 # ms
-        self.PACER_HIST_SIZE = 6000
         self.BREATH_ACC_TIME_RANGE = 60 # s
         self.HR_SERIES_TIME_RANGE = 300 # s
         self.HRV_SERIES_TIME_RANGE = 300 # s
+        self.STATS_OVERLAY_PERIOD = 1000 # ms, when instrumentation is enabled
 
         # Initialisation
         self.pacer_rate = 6
+        self.t_ref = time.time() # Series x values are seconds since t_ref, so points stay put and only the time axes scroll
+        self.drawn_versions = {} # Version of the data last drawn in each series, to skip redrawing unchanged series
+        self.breathing_circle_radius = -0.5
+        self.painted_sample_times = {} # Chart viewport: {name: time of newest sample drawn}, when instrumentation is enabled
+        self.is_charts_created = asyncio.Event()
 
-        self.create_breath_chart()
-        self.create_hrv_chart()
         self.create_circles_layout()
         self.set_view_layout()
-        self.start_view_update()
+        self.start_pacer_update()
+        self.viewport().installEventFilter(self) # Creates the charts on the first paint
 
-        self.pacer_values_hist = np.full((self.PACER_HIST_SIZE, 1), np.nan)
-        self.pacer_times_hist = np.full((self.PACER_HIST_SIZE, 1), np.nan)
-        self.pacer_times_hist_rel_s = np.full(self.PACER_HIST_SIZE, np.nan) # relative seconds
+    def create_charts(self):
+        '''
+        Creates the charts into the chart views of the layout, and starts updating them
+        '''
+        self.create_breath_chart()
+        self.create_hrv_chart()
+        self.acc_widget.setChart(self.chart_breath)
+        self.hrv_widget.setChart(self.chart_hrv)
+        self.start_view_update()
+        if instrumentation.ENABLED:
+            self.start_instrumentation()
+        self.is_charts_created.set()
+        self.charts_created.emit()
 
     def create_breath_chart(self):
         '''
@@ -60,6 +87,8 @@ class View(QChartView):
         self.series_breath_acc = create_line_series(BLUE, LINEWIDTH)
         self.series_breath_cycle_marker = create_scatter_series(GRAY, DOTSIZE_SMALL)
         self.axis_acc_x = create_axis(title=None, tickCount=10, rangeMin=-self.BREATH_ACC_TIME_RANGE, rangeMax=0, labelSize=10, flip=False)
+        self.axis_acc_t = create_axis(title=None) # Hidden, seconds since t_ref, scrolled as time passes
+        self.axis_acc_t.setVisible(False)
         # self.axis_y_pacer = create_axis(title="Pacer", color=GOLD, rangeMin=-1, rangeMax=1)
         self.axis_y_breath_acc = create_axis("Chest expansion (m/s2)", BLUE, rangeMin=-1, rangeMax=1, labelSize=10)
 
@@ -72,15 +101,16 @@ class View(QChartView):
         self.chart_breath.addSeries(self.series_breath_cycle_marker)
         self.chart_breath.addSeries(self.series_hr)
         self.chart_breath.addAxis(self.axis_acc_x, Qt.AlignBottom)
+        self.chart_breath.addAxis(self.axis_acc_t, Qt.AlignBottom)
         self.chart_breath.addAxis(self.axis_y_breath_acc, Qt.AlignRight)
         self.chart_breath.addAxis(self.axis_hr_y, Qt.AlignLeft)
-        self.series_pacer.attachAxis(self.axis_acc_x)
+        self.series_pacer.attachAxis(self.axis_acc_t)
         self.series_pacer.attachAxis(self.axis_y_breath_acc)
-        self.series_breath_acc.attachAxis(self.axis_acc_x)
+        self.series_breath_acc.attachAxis(self.axis_acc_t)
         self.series_breath_acc.attachAxis(self.axis_y_breath_acc)
-        self.series_breath_cycle_marker.attachAxis(self.axis_acc_x)
+        self.series_breath_cycle_marker.attachAxis(self.axis_acc_t)
         self.series_breath_cycle_marker.attachAxis(self.axis_y_breath_acc)
-        self.series_hr.attachAxis(self.axis_acc_x)
+        self.series_hr.attachAxis(self.axis_acc_t)
         self.series_hr.attachAxis(self.axis_hr_y)
 
     def create_hrv_chart(self):
@@ -100,6 +130,8 @@ class View(QChartView):
         self.series_maxmin = create_spline_series(RED, LINEWIDTH)
         self.series_maxmin_marker = create_scatter_series(RED, DOTSIZE_SMALL)
         self.axis_hrv_x = create_axis(title=None, tickCount=10, rangeMin=-self.HRV_SERIES_TIME_RANGE, rangeMax=0, labelSize=10)
+        self.axis_hrv_t = create_axis(title=None) # Hidden, seconds since t_ref, scrolled as time passes
+        self.axis_hrv_t.setVisible(False)
         self.axis_hrv_y = create_axis(title="HRV (ms)", color=RED, rangeMin=0, rangeMax=250, labelSize=10)
 
         self.hrv_band_line_0 = QLineSeries()
@@ -135,10 +167,11 @@ class View(QChartView):
         self.chart_hrv.addSeries(self.series_maxmin)
         self.chart_hrv.addSeries(self.series_maxmin_marker)
         self.chart_hrv.addAxis(self.axis_hrv_x, Qt.AlignBottom)
+        self.chart_hrv.addAxis(self.axis_hrv_t, Qt.AlignBottom)
         self.chart_hrv.addAxis(self.axis_hrv_y, Qt.AlignLeft)
-        self.series_maxmin.attachAxis(self.axis_hrv_x)
+        self.series_maxmin.attachAxis(self.axis_hrv_t)
         self.series_maxmin.attachAxis(self.axis_hrv_y)
-        self.series_maxmin_marker.attachAxis(self.axis_hrv_x)
+        self.series_maxmin_marker.attachAxis(self.axis_hrv_t)
         self.series_maxmin_marker.attachAxis(self.axis_hrv_y)
         self.hrv_band_0.attachAxis(self.axis_hrv_x)
         self.hrv_band_0.attachAxis(self.axis_hrv_y)
@@ -153,13 +186,12 @@ class View(QChartView):
         self.chart_hrv.addAxis(self.axis_br_y, Qt.AlignRight)
         # self.series_br.attachAxis(self.axis_hrv_x)
         # self.series_br.attachAxis(self.axis_br_y)
-        self.series_br_marker.attachAxis(self.axis_hrv_x)
+        self.series_br_marker.attachAxis(self.axis_hrv_t)
         self.series_br_marker.attachAxis(self.axis_br_y)
 
     def create_circles_layout(self):
 
         self.circles_widget = CirclesWidget(*self.model.pacer.update(self.pacer_rate), GOLD, BLUE, RED)
-        self.circles_widget.setRenderHint(QPainter.Antialiasing)
         
         self.pacer_slider = QSlider(Qt.Horizontal)
         self.pacer_slider.setRange(3*2,10*2)
@@ -189,16 +221,16 @@ class View(QChartView):
         layout = QVBoxLayout()
         graphLayout = QVBoxLayout()
 
-        acc_widget = QChartView(self.chart_breath)
-        acc_widget.setStyleSheet("background-color: transparent;")
-        hrv_widget = QChartView(self.chart_hrv)
-        hrv_widget.setStyleSheet("background-color: transparent;")
-        acc_widget.setRenderHint(QPainter.Antialiasing)
-        hrv_widget.setRenderHint(QPainter.Antialiasing)
+        self.acc_widget = QChartView() # Charts are set by create_charts
+        self.acc_widget.setStyleSheet("background-color: transparent;")
+        self.hrv_widget = QChartView()
+        self.hrv_widget.setStyleSheet("background-color: transparent;")
+        self.acc_widget.setRenderHint(QPainter.Antialiasing)
+        self.hrv_widget.setRenderHint(QPainter.Antialiasing)
 
         topRowLayout = QHBoxLayout()
         topRowLayout.addWidget(self.circles_layout, stretch=1)
-        topRowLayout.addWidget(acc_widget, stretch=3)
+        topRowLayout.addWidget(self.acc_widget, stretch=3)
         
         self.message_box = QLabel("Scanning...")
         self.message_box.setFixedWidth(150)
@@ -231,7 +263,7 @@ class View(QChartView):
         controlWidget.setLayout(controlLayout)
 
         graphLayout.addLayout(topRowLayout, stretch=1)
-        graphLayout.addWidget(hrv_widget, stretch=1)
+        graphLayout.addWidget(self.hrv_widget, stretch=1)
         graphLayout.setContentsMargins(0, 0, 0, 0)
 
         layout.addLayout(graphLayout, stretch=10)
@@ -242,71 +274,166 @@ class View(QChartView):
     def start_view_update(self):
 
         self.update_series_timer = QTimer()
-        self.update_series_timer.timeout.connect(self.update_series)
+        self.update_series_timer.timeout.connect(instrumentation.timer_slot('View.update_series', self.update_series, self.UPDATE_SERIES_PERIOD))
         self.update_series_timer.setInterval(self.UPDATE_SERIES_PERIOD)
 
         self.update_acc_series_timer = QTimer()
-        self.update_acc_series_timer.timeout.connect(self.update_acc_series)
+        self.update_acc_series_timer.timeout.connect(instrumentation.timer_slot('View.update_acc_series', self.update_acc_series, self.UPDATE_BREATHING_SERIES_PERIOD))
         self.update_acc_series_timer.setInterval(self.UPDATE_BREATHING_SERIES_PERIOD)
-        
-        self.pacer_timer = QTimer()
-        self.pacer_timer.setInterval(self.UPDATE_PACER_PERIOD)  # ms (20 Hz)
-        self.pacer_timer.timeout.connect(self.plot_circles)
 
         self.update_acc_series_timer.start()
         self.update_series_timer.start()
+
+    def start_pacer_update(self):
+
+        self.pacer_timer = QTimer()
+        self.pacer_timer.setInterval(self.UPDATE_PACER_PERIOD)  # ms (20 Hz)
+        self.pacer_timer.timeout.connect(instrumentation.timer_slot('View.plot_circles', self.plot_circles, self.UPDATE_PACER_PERIOD))
         self.pacer_timer.start()
 
+    def start_instrumentation(self):
+        '''
+        Shows the instrumentation statistics in an overlay, and measures the latency from sample to paint
+        The time of the newest sample drawn in a chart is kept until the chart's next paint event
+        '''
+        self.painted_sample_times[self.acc_widget.viewport()] = {}
+        self.acc_widget.viewport().installEventFilter(self)
+
+        self.stats_overlay = StatsOverlay(self)
+        self.stats_timer = QTimer()
+        self.stats_timer.timeout.connect(self.update_stats_overlay)
+        self.stats_timer.start(self.STATS_OVERLAY_PERIOD)
+
+    def update_stats_overlay(self):
+        '''
+        Shows the statistics of this process, and of the analysis worker once it has sent them
+        '''
+        text = instrumentation.format_stats()
+        worker_stats = self.model.get_worker_instrumentation_stats()
+        if worker_stats is not None:
+            text += f"\n\n{worker_stats['process']}\n{instrumentation.format_stats(worker_stats)}"
+        self.stats_overlay.set_stats(text)
+
+    def mark_drawn(self, chart_view, name, t_sample):
+        if instrumentation.ENABLED:
+            self.painted_sample_times[chart_view.viewport()][name] = t_sample
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint and watched is self.viewport():
+            watched.removeEventFilter(self)
+            self.first_painted.emit()
+            QTimer.singleShot(0, self.create_charts) # After the rest of the window has painted
+        elif event.type() == QEvent.Paint and watched in self.painted_sample_times:
+            t_paint = time.time()
+            for name, t_sample in self.painted_sample_times[watched].items():
+                instrumentation.record(f'latency.{name}_to_paint', 1e3*(t_paint - t_sample))
+            self.painted_sample_times[watched].clear()
+        return super().eventFilter(watched, event)
+
     def update_pacer_rate(self):
         self.pacer_rate = self.pacer_slider.value()/2
         self.pacer_label.setText(f"{self.pacer_slider.value()/2}")
 
     def plot_circles(self):
         # Pacer
-        coordinates = self.model.pacer.update(self.pacer_rate)
-        self.circles_widget.update_pacer_series(*coordinates)
-
-        self.pacer_values_hist = np.roll(self.pacer_values_hist, -1)
-        self.pacer_values_hist[-1] = np.linalg.norm([coordinates[0][0],coordinates[1][0]]) - 0.5
-        self.pacer_times_hist = np.roll(self.pacer_times_hist, -1)
-        self.pacer_times_hist[-1] = time.time_ns()/1.0e9
+        self.circles_widget.set_pacer_radius(self.model.pacer.breathing_pattern(self.pacer_rate, time.time()))
 
         # Breathing
-        breath_coordinates = self.model.breath_analyser.get_breath_circle_coords()
-        self.circles_widget.update_breath_series(*breath_coordinates)
+        _, chest_acc = self.model.get_latest('chest_acc_history') # Only the latest sample, not a copy of the history
+        self.circles_widget.set_breath_radius(self.get_breath_circle_radius(chest_acc))
+
+    def get_breath_circle_radius(self, chest_acc):
+        '''
+        Returns the radius of a circle which tracks chest acc, the latest value, nan before the first
+        '''
+        if not np.isnan(chest_acc):
+            self.breathing_circle_radius = 0.7*chest_acc + (1-0.7)*self.breathing_circle_radius
+        else: 
+            self.breathing_circle_radius = -0.5
+        self.breathing_circle_radius = np.min([np.max([self.breathing_circle_radius + 0.5, 0]), 1])
+        return self.breathing_circle_radius
 
     def update_acc_series(self):
         
-        self.pacer_times_hist_rel_s = self.pacer_times_hist - time.time_ns()/1.0e9
-            
-        series_breath_acc_new = self.model.breath_analyser.chest_acc_history.get_qpoint_list()
-        self.series_breath_acc.replace(series_breath_acc_new)
-        
-        series_breath_cycle_marker_new = self.model.breath_analyser.chest_acc_history.get_qpoint_marker_list()
-        self.series_breath_cycle_marker.replace(series_breath_cycle_marker_new)
+        snapshot = self.model.get_snapshot()
+        chest_acc_history = snapshot['chest_acc_history']
+        is_acc_changed = self.is_history_changed(snapshot, 'chest_acc_history')
+        t_now = self.scroll_time_axis(self.chart_breath, self.axis_acc_t, self.BREATH_ACC_TIME_RANGE)
+        if is_acc_changed:
+            breath_acc_x, breath_acc_y = self.get_chart_arrays(chest_acc_history)
+            marker_x, marker_y = chest_acc_history.get_marker_arrays(use_relative_time=False)
+            marker_x -= self.t_ref
+            replace_series_np(self.series_breath_acc, *self.decimate_series(self.chart_breath, breath_acc_x, breath_acc_y, t_now - self.BREATH_ACC_TIME_RANGE, t_now, keep_x=marker_x))
+            replace_series_np(self.series_breath_cycle_marker, marker_x, marker_y)
+            self.mark_drawn(self.acc_widget, 'chest_acc', chest_acc_history.times[-1])
+
+        if self.is_changed('pacer', self.axis_acc_t.max()): # The pacer trace is computed for the visible time range
+            n_points = 2*max(int(self.chart_breath.plotArea().width()), 1)
+            pacer_times, pacer_radii = self.model.pacer.trace(self.axis_acc_t.min() + self.t_ref, self.axis_acc_t.max() + self.t_ref, n_points)
+            replace_series_np(self.series_pacer, pacer_times - self.t_ref, pacer_radii - 0.5)
+
+    def scroll_time_axis(self, chart, axis, time_range):
+        '''
+        Moves a hidden time axis of chart to the last time_range seconds, which scrolls its series without touching their points
+        Moves only by whole pixels, as each move repaints the chart
+        Returns the current time in seconds since t_ref
+        '''
+        t_now = time.time() - self.t_ref
+        if (t_now - axis.max())*chart.plotArea().width() >= time_range:
+            axis.setRange(t_now - time_range, t_now)
+        return t_now
+
+    def is_changed(self, name, version):
+        '''
+        Returns True if version differs from the one last drawn for name, and records it as drawn
+        '''
+        if self.drawn_versions.get(name) == version:
+            return False
+        self.drawn_versions[name] = version
+        return True
 
-        series_pacer_new = []
-        for i, value in enumerate(self.pacer_times_hist_rel_s):
-            if not np.isnan(value):
-                series_pacer_new.append(QPointF(value, self.pacer_values_hist[i]))
-                
-        if series_pacer_new:
-            self.series_pacer.replace(series_pacer_new)
+    def is_history_changed(self, snapshot, name):
+        '''
+        Returns True if the history name of snapshot changed since it was last drawn
+        '''
+        return self.is_changed(name, snapshot[name].version)
+
+    def get_chart_arrays(self, history):
+        '''
+        Returns (x, y) arrays of a history for the charts, with x in seconds since t_ref
+        '''
+        x, y = history.get_series_arrays(use_relative_time=False)
+        return (x - self.t_ref, y)
+
+    def decimate_series(self, chart, x, y, x_min, x_max, keep_x=None):
+        '''
+        Returns the points of a series to draw in chart, showing x_min to x_max
+        Decimated to the width of the plot area in pixels, unless decimation is None
+        '''
+        if self.decimation is None:
+            return (x, y)
+        return decimate(x, y, x_min, x_max, int(chart.plotArea().width()), self.decimation, keep_x)
 
     def update_series(self):
 
-        series_hr_new = self.model.hrv_analyser.hr_history.get_qpoint_list()
-        self.series_hr.replace(series_hr_new)
+        snapshot = self.model.get_snapshot()
+        if self.is_history_changed(snapshot, 'hr_history'):
+            replace_series_np(self.series_hr, *self.get_chart_arrays(snapshot['hr_history']))
+            self.mark_drawn(self.acc_widget, 'ibi', snapshot['hr_history'].times[-1])
 
         # Breathing rate plot
-        series_br_new = self.model.breath_analyser.br_history.get_qpoint_list()
-        self.series_br.replace(series_br_new)
-        self.series_br_marker.replace(series_br_new)
+        if self.is_history_changed(snapshot, 'br_history'):
+            series_br_new = self.get_chart_arrays(snapshot['br_history'])
+            replace_series_np(self.series_br, *series_br_new)
+            replace_series_np(self.series_br_marker, *series_br_new)
 
         # RMSSD Series
-        series_maxmin_new = self.model.hrv_analyser.maxmin_history.get_qpoint_list()
-        self.series_maxmin.replace(series_maxmin_new)
-        self.series_maxmin_marker.replace(series_maxmin_new)
+        if self.is_history_changed(snapshot, 'maxmin_history'):
+            series_maxmin_new = self.get_chart_arrays(snapshot['maxmin_history'])
+            replace_series_np(self.series_maxmin, *series_maxmin_new)
+            replace_series_np(self.series_maxmin_marker, *series_maxmin_new)
+
+        self.scroll_time_axis(self.chart_hrv, self.axis_hrv_t, self.HRV_SERIES_TIME_RANGE)
 
     async def set_first_sensor_found(self):
         ''' List valid devices and connect to first one'''
@@ -315,6 +442,7 @@ class View(QChartView):
         
         selected_device_name = str(valid_devices[0]) # Select first device
         self.logger.info(f"Connecting to {selected_device_name}")
+        self.connecting_device_name = selected_device_name
         sensor = self.sensor_handler.create_sensor_client(selected_device_name)
         await self.set_sensor(sensor)
 
@@ -323,21 +451,28 @@ class View(QChartView):
             await self.model.set_and_connect_sensor(sensor)
         except Exception as e:
             self.logger.error(f"Error: Failed to connect – {e}")
-            sys.exit(1)
+            self.message_box.setText("Failed to connect, select a sensor") # The device menu is kept for another try
 
     async def main(self):
+        await self.is_charts_created.wait()
         await self.sensor_handler.scan()
 
     @Slot()
     def _on_scan_button_press(self):
         self.message_box.setText("Scanning...")
+        self.device_menu.clear()
         asyncio.create_task(self.sensor_handler.scan())
 
+    @Slot(str)
+    def _on_device_found(self, device_name):
+        if self.device_menu.findText(device_name) < 0:
+            self.device_menu.addItem(device_name)
+        self.message_box.setText("Select a sensor")
+
     @Slot()
     def _on_scan_complete(self):
-        self.message_box.setText("Select a sensor")
-        self.device_menu.clear()
-        self.device_menu.addItems(self.sensor_handler.get_valid_device_names())
+        if self.device_menu.count() == 0:
+            self.message_box.setText("No sensors found")
 
     @Slot()
     def _on_connect_button_press(self):
@@ -348,9 +483,27 @@ class View(QChartView):
         self.logger.info(f"Conencting to sensor: {selected_device_name}")
         if not selected_device_name:
             return
+        self.sensor_handler.stop_scan() # Scanning slows connecting on some adapters
+        self.connecting_device_name = selected_device_name
         sensor = self.sensor_handler.create_sensor_client(selected_device_name)
         asyncio.create_task(self.set_sensor(sensor))
     
     @Slot()
     def _on_sensor_connected(self):
-        self.message_box.setText("Connected")
\ No newline at end of file
+        self.message_box.setText("Connected")
+        self.sensor_handler.remember_device(self.connecting_device_name)
+
+    @Slot()
+    def _on_sensor_disconnected(self):
+        self.message_box.setText("Reconnecting...")
+
+    @Slot()
+    def _on_sensor_reconnected(self):
+        self.message_box.setText("Connected")
+
+    def closeEvent(self, event):
+        for name in ('pacer_timer', 'update_series_timer', 'update_acc_series_timer', 'stats_timer'):
+            if hasattr(self, name): # Series timers start with the charts, after the first paint
+                getattr(self, name).stop()
+        self.model.close()
+        super().closeEvent(event)
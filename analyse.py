@@ -0,0 +1,140 @@
+'''
+Batch analysis of recorded sessions, without Qt
+Runs every session of a directory through the same AnalysisPipeline as the live app, one session per worker process
+Writes one CSV per session with a row per breath, and summary.csv with a row per session
+
+    python analyse.py SESSIONS_DIR --output OUTPUT_DIR --jobs 8
+'''
+import os
+import csv
+import math
+import time
+import argparse
+import logging
+import warnings
+import contextlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from recording import SessionRecording
+from analysis.AnalysisPipeline import AnalysisPipeline
+
+logger = logging.getLogger(__name__)
+
+BREATH_COLUMNS = ['t_start', 't_end', 'breathing_rate', 'rmssd', 'maxmin', 'sdnn', 'nn50', 'pnn50', 'coherence']
+SUMMARY_METRICS = ['breathing_rate', 'rmssd', 'maxmin', 'sdnn', 'pnn50', 'coherence']
+MIN_WINDOW_BEATS = 3 # Beats needed for the windowed metrics
+
+def find_sessions(directory):
+    '''
+    Returns the session directories in directory, or directory itself if it is a session
+    '''
+    if os.path.isfile(os.path.join(directory, 'ibi.bin')):
+        return [directory]
+    return sorted(entry.path for entry in os.scandir(directory)
+                  if entry.is_dir() and os.path.isfile(os.path.join(entry.path, 'ibi.bin')))
+
+def get_breath_rows(pipeline, breath_t_ranges):
+    '''
+    Returns a row of metrics for each breath that ended in the last pipeline update, after its scheduled analyses ran
+    Windowed metrics are over the trailing 30 s of beats, which do not change between the breaths of one update
+    A breath without beats, e.g. during an ibi dropout, has nan breath-by-breath metrics
+    '''
+    hrv_analyser = pipeline.hrv_analyser
+    breath_histories = (hrv_analyser.rmssd_history, hrv_analyser.maxmin_history, hrv_analyser.sdnn_history)
+    rows = []
+    for i, t_range in enumerate(breath_t_ranges):
+        k = i - len(breath_t_ranges) # Breath-by-breath histories have one entry per breath, at its end
+        breath_metrics = [history.values[k] if history.times[k] == t_range[1] else np.nan for history in breath_histories]
+        if hrv_analyser.ibi_history.n_values() >= MIN_WINDOW_BEATS:
+            window_metrics = [hrv_analyser.nn50_history.values[-1], hrv_analyser.pnn50_history.values[-1], hrv_analyser.hr_coherence]
+        else:
+            window_metrics = [np.nan]*3
+        rows.append([t_range[0], t_range[1], pipeline.breath_analyser.br_history.values[k]] + breath_metrics + window_metrics)
+    return rows
+
+def analyse_session(session_path, output_dir):
+    '''
+    Replays a session through an AnalysisPipeline in its recorded arrival order, and writes its breath CSV
+    The scheduled analyses run after every update, as often as their cadences ask for
+    Returns the summary row of the session
+    '''
+    t_start_analysis = time.perf_counter()
+    recording = SessionRecording(session_path)
+    pipeline = AnalysisPipeline(budget=math.inf) # No frame to keep to, so no scheduled analysis is degraded or skipped
+    if recording.header.get('analysis_params'):
+        pipeline.set_analysis_params(recording.header['analysis_params'])
+
+    rows = []
+    with open(os.devnull, 'w') as devnull, warnings.catch_warnings(), contextlib.redirect_stdout(devnull): # HrvAnalyser prints rejected values
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for stream, data in recording.iter_sample_blocks():
+            if stream == 'ibi':
+                pipeline.update_ibi(data)
+                pipeline.run_scheduled()
+            elif stream == 'gap':
+                pipeline.mark_gap()
+            else:
+                breath_t_ranges = pipeline.update_acc_block(data)
+                pipeline.run_scheduled()
+                rows.extend(get_breath_rows(pipeline, breath_t_ranges))
+    rows = np.array(rows, dtype=float).reshape(-1, len(BREATH_COLUMNS))
+
+    session_name = os.path.basename(os.path.normpath(session_path))
+    np.savetxt(os.path.join(output_dir, f"{session_name}.csv"), rows, fmt='%.17g', delimiter=',',
+               header=','.join(BREATH_COLUMNS), comments='')
+
+    t_range = recording.get_time_range()
+    summary = {
+        'session': session_name,
+        't_start': t_range[0],
+        'duration': t_range[1] - t_range[0],
+        'n_ibi': len(recording.ibi),
+        'n_acc': len(recording.acc),
+        'n_breaths': len(rows)
+    }
+    for metric in SUMMARY_METRICS:
+        values = rows[:, BREATH_COLUMNS.index(metric)]
+        values = values[~np.isnan(values)]
+        summary[f'mean_{metric}'] = np.mean(values) if len(values) else np.nan
+    summary['analysis_time'] = time.perf_counter() - t_start_analysis
+    return summary
+
+def analyse_sessions(session_paths, output_dir, jobs=None):
+    '''
+    Analyses sessions in a process pool, one session per task, and writes summary.csv
+    Returns the summary rows in the order of session_paths
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(analyse_session, path, output_dir): path for path in session_paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summaries[path] = future.result()
+                logger.info(f"Analysed {path}")
+            except Exception as e:
+                logger.error(f"Failed to analyse {path}: {e}")
+
+    summaries = [summaries[path] for path in session_paths if path in summaries]
+    if summaries:
+        with open(os.path.join(output_dir, 'summary.csv'), 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(summaries[0].keys()))
+            writer.writeheader()
+            writer.writerows(summaries)
+    return summaries
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Batch analysis of recorded sessions")
+    parser.add_argument('sessions', help="directory of sessions recorded with EBYT.py --record, or a single session")
+    parser.add_argument('--output', default='analysis_output', help="directory for the per-session CSVs and summary.csv")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes, default one per core")
+    args = parser.parse_args()
+
+    session_paths = find_sessions(args.sessions)
+    t_start = time.perf_counter()
+    summaries = analyse_sessions(session_paths, args.output, args.jobs)
+    logger.info(f"Analysed {len(summaries)} of {len(session_paths)} sessions in {time.perf_counter() - t_start:.1f} s")
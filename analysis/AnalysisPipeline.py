@@ -0,0 +1,169 @@
+import functools
+import numpy as np
+from .HrvAnalyser import HrvAnalyser
+from .BreathAnalyser import BreathAnalyser
+from .HistoryBuffer import HistoryBuffer
+from .AnalysisScheduler import AnalysisScheduler, BEAT, BREATH
+
+class AnalysisPipeline:
+
+    # Histories published in snapshots, as name: (analyser attribute, or None for the pipeline, history attribute)
+    SNAPSHOT_HISTORIES = {
+        'chest_acc_history': ('breath_analyser', 'chest_acc_history'),
+        'br_history': ('breath_analyser', 'br_history'),
+        'hr_history': ('hrv_analyser', 'hr_history'),
+        'maxmin_history': ('hrv_analyser', 'maxmin_history'),
+        'coherence_history': ('hrv_analyser', 'coherence_history'),
+        'pnn50_history': ('hrv_analyser', 'pnn50_history'),
+        'br_coherence_history': ('breath_analyser', 'br_coherence_history'),
+        'gap_history': (None, 'gap_history'),
+    }
+
+    # Cadences of the windowed analyses run by run_scheduled: 'beat', 'breath', a period in s of sample time, or None for never
+    DEFAULT_SCHEDULE = {
+        'hrv_coherence': BEAT,
+        'nn50_metrics': BREATH,
+        'breathing_spectrum': 1.0,
+    }
+    DEFAULT_BUDGET = 0.005 # s of scheduled analysis per tick
+    GAP_HIST_SIZE = 100
+
+    def __init__(self, schedule=None, budget=DEFAULT_BUDGET, spectrum_window=30, time_domain_window=30, spill_dir=None):
+        '''
+        Runs the analysers on the sensor streams, without any Qt dependency
+        so it can run in the GUI process, a worker process, or a headless script
+        schedule: cadences replacing those of DEFAULT_SCHEDULE, by job name
+        budget: s of scheduled analysis per tick, see AnalysisScheduler
+        spectrum_window, time_domain_window: s of samples for the coherence spectra and for nn50 and pnn50
+        spill_dir: directory for the history samples of the whole session that are no longer in memory,
+        the system temporary directory if None, see TieredHistoryBuffer
+        '''
+        self.hrv_analyser = HrvAnalyser(time_domain_window=time_domain_window, spectrum_window=spectrum_window, spill_dir=spill_dir)
+        self.breath_analyser = BreathAnalyser(spectrum_window=spectrum_window, spill_dir=spill_dir)
+        self.gap_history = HistoryBuffer(self.GAP_HIST_SIZE) # Time of the first sample after each gap: s of samples missing
+        self.t_gap_start = None # Time of the last sample before a gap, until the first sample after it
+
+        # Job name: (function, degraded function run when over budget)
+        jobs = {
+            'hrv_coherence': (self.hrv_analyser.update_coherence, functools.partial(self.hrv_analyser.update_coherence, use_periodogram=False)),
+            'nn50_metrics': (self.hrv_analyser.update_nn50_metrics, None),
+            'breathing_spectrum': (self.breath_analyser.update_breathing_spectrum, functools.partial(self.breath_analyser.update_breathing_spectrum, use_periodogram=False)),
+        }
+        schedule = {**self.DEFAULT_SCHEDULE, **(schedule or {})}
+        self.scheduler = AnalysisScheduler(budget)
+        for name, cadence in schedule.items():
+            if name not in jobs:
+                raise ValueError(f"Unknown analysis job {name}, expected one of {list(jobs)}")
+            function, degraded_function = jobs[name]
+            self.scheduler.add_job(name, function, cadence, degraded_function)
+
+    def update_ibi(self, data):
+        '''
+        Handles an ibi sample (t, ibi)
+        '''
+        t, ibi = data
+        if self.t_gap_start is not None:
+            self.end_gap(t)
+        self.hrv_analyser.update(t, ibi)
+        self.scheduler.on_beat(t)
+
+    def update_acc(self, data):
+        '''
+        Updates the breath_analyser which calculates breathing rate
+        On each breath, hrv_analyser calculates metrics
+        data is a single sample (t, x, y, z), or a frame of samples with one sample per row
+        Returns the start and end times of each breath that ended
+        '''
+        if np.ndim(data) == 2:
+            return self.update_acc_block(data)
+
+        t = data[0]
+        acc = data[1:]
+        if self.t_gap_start is not None:
+            self.end_gap(t)
+        self.breath_analyser.update_chest_acc(t, acc)
+
+        # Breath-by-breath analysis
+        if self.breath_analyser.is_end_of_breath and not self.breath_analyser.br_history.is_empty():
+
+            t_range = self.breath_analyser.get_last_breath_t_range()
+            self.hrv_analyser.update_breath_by_breath_metrics(t_range)
+            self.scheduler.on_breath(t)
+            return [t_range]
+        self.scheduler.on_time(t)
+        return []
+
+    def update_acc_block(self, data):
+        '''
+        Handles a frame of accelerometer samples, one (t, x, y, z) per row
+        hrv_analyser calculates metrics for every breath that ends in the frame
+        Returns the start and end times of each breath that ended
+        '''
+        if self.t_gap_start is not None and len(data):
+            self.end_gap(data[0, 0])
+        breath_t_ranges = self.breath_analyser.update_chest_acc_block(data[:, 0], data[:, 1:])
+        for t_range in breath_t_ranges:
+            self.hrv_analyser.update_breath_by_breath_metrics(t_range)
+            self.scheduler.on_breath(t_range[1])
+        if len(data):
+            self.scheduler.on_time(data[-1, 0])
+        return breath_t_ranges
+
+    def mark_gap(self):
+        '''
+        Marks a gap in the streams, e.g. while the sensor reconnects, so that no breath, successive difference
+        or spectrum spans it. Histories keep their samples, and the gap is added to gap_history with the next sample
+        '''
+        self.hrv_analyser.mark_gap()
+        self.breath_analyser.mark_gap()
+        t_lasts = [history.times[-1] for history in (self.hrv_analyser.ibi_history, self.breath_analyser.chest_acc_history)
+                   if not history.is_empty()]
+        if self.t_gap_start is None and t_lasts: # A gap before any sample is not one
+            self.t_gap_start = max(t_lasts)
+
+    def end_gap(self, t):
+        self.gap_history.update(t, t - self.t_gap_start)
+        self.t_gap_start = None
+
+    def run_scheduled(self):
+        '''
+        Runs the scheduled analyses requested since the last call, once each, within the budget
+        Called by the owner of the pipeline: Model on each snapshot of the live view, ReplayClient after each
+        replayed sample, analyse.py after each update, and AnalysisWorker before each snapshot it publishes
+        '''
+        return self.scheduler.run_pending()
+
+    def get_scheduler_stats(self):
+        return self.scheduler.get_stats()
+
+    def get_analysis_params(self):
+        return self.breath_analyser.get_analysis_params()
+
+    def set_analysis_params(self, params):
+        '''
+        Sets the parameters from a dict as returned by get_analysis_params, e.g. from a recording header
+        '''
+        params = dict(params)
+        params['chest_axis'] = np.array(params['chest_axis'])
+        self.breath_analyser.set_analysis_params(**params)
+
+    def get_snapshot(self):
+        '''
+        Returns the published histories, as a dict of name: HistoryBuffer
+        The buffers are the live ones, so are only consistent when read from the thread that updates them
+        '''
+        return {name: getattr(self if analyser is None else getattr(self, analyser), history)
+                for name, (analyser, history) in self.SNAPSHOT_HISTORIES.items()}
+
+    def get_latest(self, history_name):
+        '''
+        Returns (t, value) of the latest sample of a published history, nan if it has none
+        '''
+        history = self.get_snapshot()[history_name]
+        return (history.times[-1], history.values[-1])
+
+    def get_snapshot_layout(self):
+        '''
+        Returns the published histories as a dict of name: buffer size, for SharedSnapshot
+        '''
+        return {name: history.buffer_size for name, history in self.get_snapshot().items()}
@@ -0,0 +1,162 @@
+import math
+import time
+import logging
+from .instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+BEAT = 'beat'
+BREATH = 'breath'
+
+class AnalysisJob:
+
+    def __init__(self, name, function, cadence, degraded_function=None):
+        '''
+        An analysis run by AnalysisScheduler, function is called without arguments
+        cadence: BEAT, BREATH, or a period in s of sample time
+        degraded_function: cheaper version run instead when the tick is over budget, if any
+        '''
+        self.name = name
+        self.function = function
+        self.cadence = cadence
+        self.degraded_function = degraded_function
+        self.t_next = -math.inf # Sample time of the next request of a periodic job
+
+        self.n_requested = 0
+        self.n_coalesced = 0 # Requests while already pending, served by one run
+        self.n_run = 0
+        self.n_degraded = 0
+        self.n_skipped = 0 # Ticks the job was left pending for, over budget
+        self.n_failed = 0
+        self.duration = 0.0 # s, total of the runs
+
+    def get_stats(self):
+        n_calls = self.n_run + self.n_degraded
+        return {
+            'cadence': self.cadence,
+            'requested': self.n_requested,
+            'coalesced': self.n_coalesced,
+            'run': self.n_run,
+            'degraded': self.n_degraded,
+            'skipped': self.n_skipped,
+            'failed': self.n_failed,
+            'mean_ms': 1e3*self.duration/n_calls if n_calls else math.nan
+        }
+
+class AnalysisScheduler:
+
+    def __init__(self, budget=0.005):
+        '''
+        Runs the windowed analyses at their own cadences instead of on every sample
+        Beats, breaths and sample times request jobs, which run together on the next run_pending, a tick
+        A job requested again before it runs is coalesced into one run, so a burst of samples costs one run per tick
+        budget: s of jobs per tick. Once a tick has used it, the rest of the pending jobs run their degraded function,
+        or are skipped until the next tick, staying first in line. The first job of a tick always runs
+        '''
+        self.budget = budget
+        self.jobs = {} # name: AnalysisJob
+        self.pending = {} # name: AnalysisJob, in order of request
+        self.event_jobs = {BEAT: [], BREATH: []}
+        self.periodic_jobs = []
+        self.t_next_periodic = math.inf # Earliest t_next of the periodic jobs
+        self.n_ticks = 0
+        self.n_ticks_over_budget = 0
+
+    def add_job(self, name, function, cadence, degraded_function=None):
+        '''
+        Adds a job run at cadence: BEAT, BREATH, a period in s of sample time, or None to never run it
+        '''
+        if cadence is None:
+            return
+        job = AnalysisJob(name, function, cadence, degraded_function)
+        if cadence in self.event_jobs:
+            self.event_jobs[cadence].append(job)
+        elif isinstance(cadence, (int, float)) and cadence > 0:
+            self.periodic_jobs.append(job)
+            self.t_next_periodic = -math.inf
+        else:
+            raise ValueError(f"Cadence of {name} must be '{BEAT}', '{BREATH}', a period in s or None, not {cadence!r}")
+        self.jobs[name] = job
+
+    def request(self, job):
+        job.n_requested += 1
+        if job.name in self.pending:
+            job.n_coalesced += 1
+        else:
+            self.pending[job.name] = job
+
+    def on_beat(self, t):
+        for job in self.event_jobs[BEAT]:
+            self.request(job)
+        self.on_time(t)
+
+    def on_breath(self, t):
+        for job in self.event_jobs[BREATH]:
+            self.request(job)
+        self.on_time(t)
+
+    def on_time(self, t):
+        '''
+        Requests the periodic jobs that are due at sample time t
+        '''
+        if t < self.t_next_periodic:
+            return
+        for job in self.periodic_jobs:
+            if t >= job.t_next:
+                self.request(job)
+                job.t_next = t + job.cadence # From the request, so a gap in the samples is not caught up
+        self.t_next_periodic = min(job.t_next for job in self.periodic_jobs)
+
+    @timed('AnalysisScheduler.run_pending')
+    def run_pending(self):
+        '''
+        Runs the pending jobs within the budget, returns the number run
+        '''
+        if not self.pending:
+            return 0
+        t_start = time.perf_counter()
+        n_run = 0
+        is_over_budget = False
+        for job in list(self.pending.values()):
+            if n_run > 0 and time.perf_counter() - t_start > self.budget:
+                is_over_budget = True
+                if job.degraded_function is None:
+                    job.n_skipped += 1
+                    continue
+            del self.pending[job.name]
+
+            t_job = time.perf_counter()
+            try:
+                if is_over_budget:
+                    job.degraded_function()
+                    job.n_degraded += 1
+                else:
+                    job.function()
+                    job.n_run += 1
+            except Exception:
+                job.n_failed += 1
+                logger.exception(f"Analysis job {job.name} failed")
+            job.duration += time.perf_counter() - t_job
+            n_run += 1
+
+        self.n_ticks += 1
+        self.n_ticks_over_budget += is_over_budget
+        return n_run
+
+    def get_stats(self):
+        return {
+            'ticks': self.n_ticks,
+            'ticks_over_budget': self.n_ticks_over_budget,
+            'jobs': {name: job.get_stats() for name, job in self.jobs.items()}
+        }
+
+def format_stats(stats):
+    '''
+    Returns the statistics of get_stats as lines of text, one per job
+    '''
+    lines = [f"{stats['ticks']} ticks, {stats['ticks_over_budget']} over budget",
+             f"{'job':<20} {'cadence':>8} {'requested':>10} {'coalesced':>10} {'run':>8} {'degraded':>9} {'skipped':>8} {'failed':>7} {'mean ms':>8}"]
+    for name, job in stats['jobs'].items():
+        lines.append(f"{name:<20} {str(job['cadence']):>8} {job['requested']:>10} {job['coalesced']:>10} {job['run']:>8} "
+                     f"{job['degraded']:>9} {job['skipped']:>8} {job['failed']:>7} {job['mean_ms']:>8.3f}")
+    return '\n'.join(lines)
@@ -0,0 +1,180 @@
+import time
+import queue
+import logging
+import multiprocessing
+import numpy as np
+from . import instrumentation
+from .AnalysisPipeline import AnalysisPipeline
+from .HistoryBuffer import HistoryBuffer
+from .SharedSnapshot import SharedSnapshot
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_INTERVAL = 0.02 # s, maximum time between snapshots while samples are arriving
+PARENT_CHECK_INTERVAL = 1.0 # s
+INSTRUMENTATION_INTERVAL = 1.0 # s between the instrumentation statistics sent, when instrumentation is enabled
+def run_analysis_worker(snapshot_name, snapshot_lock, layout, sample_queue, stats_queue, pipeline_options, instrumentation_queue=None):
+    '''
+    Worker process loop: applies the queued samples to an AnalysisPipeline and publishes snapshots
+    A snapshot is published when the queue is drained, or every PUBLISH_INTERVAL under load,
+    after the scheduled analyses requested by the samples since the last one
+    The instrumentation statistics of the worker are put on instrumentation_queue every INSTRUMENTATION_INTERVAL, if not None
+    '''
+    import scipy.signal # The analysers import it when first used, import it before the first samples arrive
+    pipeline = AnalysisPipeline(**pipeline_options)
+    snapshot = SharedSnapshot(layout, name=snapshot_name, lock=snapshot_lock)
+    parent = multiprocessing.parent_process()
+    t_last_publish = time.monotonic()
+    t_last_instrumentation = time.monotonic()
+    is_pending = False
+
+    def publish():
+        nonlocal t_last_publish, is_pending
+        pipeline.run_scheduled()
+        snapshot.publish(pipeline.get_snapshot())
+        t_last_publish = time.monotonic()
+        is_pending = False
+
+    while True:
+        if instrumentation_queue is not None and time.monotonic() - t_last_instrumentation >= INSTRUMENTATION_INTERVAL:
+            instrumentation_queue.put(instrumentation.get_stats())
+            t_last_instrumentation = time.monotonic()
+        try:
+            message = sample_queue.get(timeout=PUBLISH_INTERVAL if is_pending else PARENT_CHECK_INTERVAL)
+        except queue.Empty:
+            if is_pending:
+                publish()
+            elif parent is not None and not parent.is_alive():
+                break
+            continue
+        if message is None:
+            break
+
+        stream, data = message
+        try:
+            if stream == 'ibi':
+                pipeline.update_ibi(data)
+            elif stream == 'acc':
+                pipeline.update_acc(data)
+            elif stream == 'gap':
+                pipeline.mark_gap()
+        except Exception:
+            logger.exception(f"Analysis of {stream} sample failed") # As an exception in a sensor callback, the stream continues
+        is_pending = True
+
+        if sample_queue.empty() or time.monotonic() - t_last_publish > PUBLISH_INTERVAL:
+            publish()
+    stats_queue.put(pipeline.get_scheduler_stats()) # Read by AnalysisWorker.stop
+    snapshot.close()
+
+class AnalysisWorker:
+
+    def __init__(self, pipeline_options=None):
+        '''
+        Runs an AnalysisPipeline in a separate process, so analysis never delays the Qt event loop
+        Samples are sent to the worker through a queue, and the histories come back through a SharedSnapshot
+        Has the same update_ibi, update_acc, mark_gap, get_snapshot, get_latest and get_scheduler_stats methods as AnalysisPipeline
+        pipeline_options: keyword arguments of the AnalysisPipeline
+        With instrumentation enabled, the worker times its own hot paths, and sends its statistics back for
+        get_instrumentation_stats
+        '''
+        self.logger = logging.getLogger(__name__)
+        pipeline_options = pipeline_options or {}
+        pipeline = AnalysisPipeline(**pipeline_options) # Only for the layout and parameters, the worker has its own
+        self.layout = pipeline.get_snapshot_layout()
+        self.analysis_params = pipeline.get_analysis_params()
+        self.scheduler_stats = pipeline.get_scheduler_stats()
+
+        self.snapshot = SharedSnapshot(self.layout)
+        self.snapshot_version = 0
+        self.snapshot_histories = {name: HistoryBuffer(buffer_size) for name, buffer_size in self.layout.items()}
+        self.latest = {} # History name: (snapshot version, t, value) of the last read_latest
+
+        context = multiprocessing.get_context('spawn') # No fork of the Qt and BLE state
+        self.sample_queue = context.Queue()
+        self.stats_queue = context.Queue()
+        self.instrumentation_queue = context.Queue() if instrumentation.ENABLED else None
+        self.instrumentation_stats = None
+        self.process = context.Process(target=run_analysis_worker, args=(self.snapshot.name, self.snapshot.lock, self.layout, self.sample_queue, self.stats_queue,
+                                                                         pipeline_options, self.instrumentation_queue),
+                                       name="AnalysisWorker", daemon=True)
+
+    def start(self):
+        self.process.start()
+        self.logger.info(f"Started analysis worker process {self.process.pid}")
+
+    def stop(self):
+        '''
+        Stops the worker after it has handled the queued samples, and frees the shared memory
+        '''
+        if self.process.is_alive():
+            self.sample_queue.put(None)
+            try:
+                self.scheduler_stats = self.stats_queue.get(timeout=5) # Sent as the worker exits
+            except queue.Empty:
+                self.logger.warning("Analysis worker sent no scheduler statistics")
+            self.get_instrumentation_stats() # Reads what is left, so the worker can flush its queue and exit
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.snapshot.close()
+
+    def update_ibi(self, data):
+        self.sample_queue.put(('ibi', np.array(data, dtype=float))) # Copy, the queue pickles it later
+
+    def update_acc(self, data):
+        self.sample_queue.put(('acc', np.array(data, dtype=float)))
+
+    def mark_gap(self):
+        self.sample_queue.put(('gap', None)) # In order with the samples
+
+    def get_analysis_params(self):
+        return self.analysis_params
+
+    def get_scheduler_stats(self):
+        '''
+        Returns the scheduler statistics of the worker, which it sends when it stops, before that those of no ticks
+        '''
+        return self.scheduler_stats
+
+    def get_instrumentation_stats(self):
+        '''
+        Returns the latest instrumentation statistics sent by the worker, see instrumentation.get_stats,
+        or None before the first or when instrumentation is disabled
+        '''
+        while self.instrumentation_queue is not None:
+            try:
+                self.instrumentation_stats = self.instrumentation_queue.get_nowait()
+            except queue.Empty:
+                break
+        return self.instrumentation_stats
+
+    def record_queue_depth(self):
+        try:
+            instrumentation.record('AnalysisWorker.queue_depth', self.sample_queue.qsize())
+        except NotImplementedError: # macOS has no sem_getvalue
+            pass
+
+    def get_snapshot(self):
+        '''
+        Returns the latest published histories, as a dict of name: HistoryBuffer
+        Copies are only made of the histories that changed since the last call
+        '''
+        if instrumentation.ENABLED:
+            self.record_queue_depth()
+        if self.snapshot.get_version() != self.snapshot_version:
+            result = self.snapshot.read(previous=self.snapshot_histories)
+            if result is not None:
+                self.snapshot_version, self.snapshot_histories = result
+        return self.snapshot_histories
+
+    def get_latest(self, history_name):
+        '''
+        Returns (t, value) of the latest published sample of a history, nan if it has none
+        Only that sample is read from the shared snapshot, and only when a snapshot was published since the last call
+        '''
+        if self.latest.get(history_name, (None,))[0] != self.snapshot.get_version():
+            result = self.snapshot.read_latest(history_name)
+            if result is not None:
+                self.latest[history_name] = result
+        return self.latest[history_name][1:] if history_name in self.latest else (np.nan, np.nan)
@@ -1,18 +1,19 @@
 import numpy as np
-from .HistoryBuffer import HistoryBuffer
-from .utils import exp_moving_average
-from scipy import signal
+from .TieredHistoryBuffer import TieredHistoryBuffer
+from .SlidingSpectrum import SlidingSpectrum, UniformResampler
+from .utils import exp_moving_average, project_onto_axis, calculate_peak_and_total_power
+from .instrumentation import timed
 
 class BreathAnalyser:
 
-    def __init__(self):
-        self.breathing_circle_radius = -0.5
-        theta = np.linspace(0, 2 * np.pi, 40)
-        self.cos_theta = np.cos(theta)
-        self.sin_theta = np.sin(theta)
-
-        self.BR_ACC_HIST_SIZE = 10000 # Up to 16 minutes at 10 Hz
+    def __init__(self, spectrum_window=30, spill_dir=None):
+        '''
+        spectrum_window: s of chest acc in the breathing spectrum
+        spill_dir: directory for the samples that leave the histories, see TieredHistoryBuffer
+        '''
+        self.BR_ACC_HIST_SIZE = 10000 # In memory, up to 16 minutes at 10 Hz, older samples spill to disk
         self.BR_HIST_SIZE = 500 
+        self.SPECTRUM_WINDOW = spectrum_window # s
 
         self.set_analysis_params()
         self.sensor_class = None
@@ -26,9 +27,12 @@ class BreathAnalyser:
         self.chest_phase_last = 0
         self.is_end_of_breath = False
         self.start_of_breath_t = np.nan
+        self.is_after_gap = False
+        self.t_resume = -np.inf # Time of the first sample after the last gap, the spectrum starts from it
 
-        self.chest_acc_history = HistoryBuffer(self.BR_ACC_HIST_SIZE) # TODO: Remove history size parameters
-        self.br_history = HistoryBuffer(self.BR_HIST_SIZE)
+        self.chest_acc_history = TieredHistoryBuffer(self.BR_ACC_HIST_SIZE, spill_dir=spill_dir, name='chest_acc')
+        self.br_history = TieredHistoryBuffer(self.BR_HIST_SIZE, spill_dir=spill_dir, name='br')
+        self.br_coherence_history = TieredHistoryBuffer(self.BR_HIST_SIZE, spill_dir=spill_dir, name='br_coherence')
         self.breath_end_ids = np.full(self.BR_HIST_SIZE, -1, dtype=int)
         self.br_psd_freqs_hist = []
         self.br_psd_values_hist = []
@@ -50,12 +54,32 @@ class BreathAnalyser:
         self.ACC_MEAN_ALPHA = acc_mean_alpha # Exponential mean filter for noise
         self.chest_axis = chest_axis # Positive z-axis is the direction out of sensor unit (away from chest)
 
+        # Streaming spectrum of chest acc, resampled at the chest acc sample rate over the spectrum window
+        self.chest_acc_resampler = UniformResampler(1.0/chest_acc_sample_rate)
+        self.br_spectrum = SlidingSpectrum(int(round(self.SPECTRUM_WINDOW*chest_acc_sample_rate)), chest_acc_sample_rate)
+
+    def get_analysis_params(self):
+        '''
+        Returns the parameters set by set_analysis_params, as a dict of plain values
+        '''
+        return {
+            'chest_acc_sample_rate': self.CHEST_ACC_SAMPLE_RATE,
+            'gravity_alpha': self.GRAVITY_ALPHA,
+            'acc_mean_alpha': self.ACC_MEAN_ALPHA,
+            'chest_axis': np.asarray(self.chest_axis).tolist()
+        }
+
+    @timed('BreathAnalyser.update_chest_acc')
     def update_chest_acc(self, time, acc):
         '''
         Updates the chest acceleration history, and checks for end of breath
         Inputs: time: time of sample, acc: accelerometer sample (x,y,z)
         If it is the end of the breath, adds to history, updates is_end_of_breath
         '''
+        if self.is_after_gap:
+            self.is_after_gap = False
+            self.t_resume = time
+
         # Remove gravity and filter
         self.gravity = exp_moving_average(self.gravity, acc, self.GRAVITY_ALPHA) if not np.isnan(self.gravity).any() else acc 
         acc_unbiased = acc - self.gravity
@@ -70,8 +94,10 @@ class BreathAnalyser:
             self.t_last_breath_acc_update = time
 
         # Updating chest expansion
-        chest_acc = np.dot(self.acc_filtered, self.chest_axis)
+        chest_acc = project_onto_axis(self.acc_filtered, self.chest_axis)
         self.chest_acc_history.update(time, chest_acc)
+        for chest_acc_interp in self.chest_acc_resampler.update(time, chest_acc):
+            self.br_spectrum.update(chest_acc_interp)
 
         # Check for breath (descending zero-crossing)
         chest_phase = np.sign(chest_acc)
@@ -87,61 +113,162 @@ class BreathAnalyser:
         if breathing_rate > self.BR_MAX_FILTER:
             self.is_end_of_breath = False
             return
-        self.is_end_of_breath = True
+        self.is_end_of_breath = not np.isnan(breathing_rate) # The first crossing, or the first after a gap, only starts a breath
         
         # Update history
         self.br_history.update(time, breathing_rate)
         self.chest_acc_history.add_marker(self.BR_ACC_HIST_SIZE-1)
 
+    @timed('BreathAnalyser.update_chest_acc_block')
+    def update_chest_acc_block(self, times, acc):
+        '''
+        Updates the chest acceleration history with a block of samples, and checks for ends of breath
+        Inputs: times: array of sample times, acc: array of accelerometer samples, one (x,y,z) per row
+        Gives the same history and breaths as calling update_chest_acc for each sample, with the filters
+        run over the whole block and descending zero-crossings found at once
+        Returns the start and end times of each breath that ends in the block, as get_last_breath_t_range would
+        '''
+        self.is_end_of_breath = False
+        times = np.asarray(times, dtype=float)
+        acc = np.asarray(acc, dtype=float)
+        if len(times) == 0:
+            return []
+        if self.is_after_gap:
+            self.is_after_gap = False
+            self.t_resume = times[0]
+
+        # Remove gravity and filter, as exponential moving averages with the state carried between blocks
+        if np.isnan(self.gravity).any():
+            gravity_first = acc[:1]
+            gravity = np.concatenate((gravity_first, self._exp_moving_average_block(gravity_first[0], acc[1:], self.GRAVITY_ALPHA)))
+        else:
+            gravity = self._exp_moving_average_block(self.gravity, acc, self.GRAVITY_ALPHA)
+        self.gravity = gravity[-1]
+        acc_filtered = self._exp_moving_average_block(self.acc_filtered, acc - gravity, self.ACC_MEAN_ALPHA)
+        self.acc_filtered = acc_filtered[-1]
+
+        # Subsampling for Polar
+        ids = np.arange(len(times))
+        if self.sensor_class == "PolarH10" or self.sensor_class == "SmartBelt":
+            ids = []
+            for i, time in enumerate(times):
+                if time - self.t_last_breath_acc_update >= 1.0/self.CHEST_ACC_SAMPLE_RATE:
+                    ids.append(i)
+                    self.t_last_breath_acc_update = time
+            ids = np.array(ids, dtype=int)
+            if len(ids) == 0:
+                return []
+        times = times[ids]
+
+        # Updating chest expansion
+        chest_acc = project_onto_axis(acc_filtered[ids], self.chest_axis)
+        for chest_acc_interp in self.chest_acc_resampler.update_block(times, chest_acc):
+            self.br_spectrum.update(chest_acc_interp)
+
+        # Check for breaths (descending zero-crossings)
+        chest_phase = np.sign(chest_acc)
+        chest_phase_last = np.concatenate(([self.chest_phase_last], chest_phase[:-1]))
+        crossing_ids = np.flatnonzero(~((chest_phase == chest_phase_last) | (chest_phase >= 0)))
+        self.chest_phase_last = chest_phase[-1]
+
+        breath_t_ranges = []
+        i_start = 0
+        i_last_breath = -1
+        for i in crossing_ids:
+            self.chest_acc_history.extend(times[i_start:i + 1], chest_acc[i_start:i + 1])
+            i_start = i + 1
+
+            # Calculate breathing rate
+            breathing_rate = 60.0 / (times[i] - self.start_of_breath_t)
+            self.start_of_breath_t = times[i]
+            if breathing_rate > self.BR_MAX_FILTER:
+                continue
+
+            # Update history
+            self.br_history.update(times[i], breathing_rate)
+            self.chest_acc_history.add_marker(self.BR_ACC_HIST_SIZE-1)
+            if not np.isnan(breathing_rate):
+                i_last_breath = i
+                breath_t_ranges.append(self.get_last_breath_t_range())
+        self.chest_acc_history.extend(times[i_start:], chest_acc[i_start:])
+
+        # End of breath on the last sample of the block, as after update_chest_acc
+        self.is_end_of_breath = ids[-1] == len(acc) - 1 and i_last_breath == len(times) - 1
+        return breath_t_ranges
+
+    def mark_gap(self):
+        '''
+        Marks a gap in the chest acc, e.g. while the sensor reconnects
+        The next descending zero-crossing starts a breath rather than ending one, recorded as nan breathing rate
+        in br_history as the first of the session, and the spectrum starts again, so neither spans the gap
+        '''
+        self.is_after_gap = True
+        self.start_of_breath_t = np.nan
+        self.chest_phase_last = 0
+        self.chest_acc_resampler = UniformResampler(1.0/self.CHEST_ACC_SAMPLE_RATE)
+        self.br_spectrum.reset()
+
+    @staticmethod
+    def _exp_moving_average_block(prev_mean, values, alpha):
+        '''
+        Exponential moving average over rows of values, as an IIR filter starting from prev_mean
+        Bit-identical to applying exp_moving_average to each row in turn
+        '''
+        if len(values) == 0:
+            return np.empty((0, len(prev_mean)))
+        from scipy import signal # Imported here, as it takes over a second to import at startup
+        mean, _ = signal.lfilter([1 - alpha], [1, -alpha], values, axis=0, zi=alpha*np.asarray(prev_mean, dtype=float)[np.newaxis, :])
+        return mean
+
     def get_last_breath_t_range(self):
         '''
         Returns the start and end times (epoch s) of the last full breath
         '''
         return (self.br_history.times[-2], self.br_history.times[-1])
 
-    def get_breath_circle_coords(self):
+    @timed('BreathAnalyser.update_breathing_spectrum')
+    def update_breathing_spectrum(self, use_periodogram=True):
         '''
-        Returns the x,y coordinates of a circle whos radius tracks chest acc
-        TODO: Move this to a visualisation widget
+        Updates breathing coherence score, by calculating the frequency spectrum of the breathing signal
+        Uses the streaming spectrum once it holds a full window, updated in O(bins) per sample
+        Until then uses update_breathing_spectrum_periodogram, or leaves the score unchanged if use_periodogram is False
+        When chest acc arrives at the chest acc sample rate, the score differs from update_breathing_spectrum_periodogram
+        by 0.001 median and 0.01 95th percentile on synthetic breathing
+        (see benchmarks/bench_streaming_spectrum.py)
         '''
-        if not self.chest_acc_history.is_empty():
-            self.breathing_circle_radius = 0.7*self.chest_acc_history.values[-1] + (1-0.7)*self.breathing_circle_radius
-        else: 
-            self.breathing_circle_radius = -0.5
-        self.breathing_circle_radius = np.min([np.max([self.breathing_circle_radius + 0.5, 0]), 1])
+        if not self.br_spectrum.is_full():
+            if use_periodogram:
+                self.update_breathing_spectrum_periodogram()
+            return
 
-        x = self.breathing_circle_radius * self.cos_theta
-        y = self.breathing_circle_radius * self.sin_theta
-        return (x, y)
+        self.br_psd_freqs_hist, self.br_psd_values_hist = self.br_spectrum.get_psd()
+        peak_power, total_power = calculate_peak_and_total_power(self.br_psd_freqs_hist, self.br_psd_values_hist)
+        self.br_coherence = peak_power/total_power
+        self.br_coherence_history.update(self.chest_acc_history.times[-1], self.br_coherence)
 
-    def update_breathing_spectrum(self):
+    @timed('BreathAnalyser.update_breathing_spectrum_periodogram')
+    def update_breathing_spectrum_periodogram(self):
         '''
-        Updates breathing coherence score, by calculating the frequency spectrum of the breathing signal
+        Updates breathing coherence score from a periodogram of the chest acc history
         '''
-
         if self.chest_acc_history.n_values() < 3:
             return
 
-        ids = self.chest_acc_history.times > (self.chest_acc_history.times[-1] - 30) # Hardcode 30 seconds
-        values = self.chest_acc_history.values[ids]
-        times = self.chest_acc_history.times[ids]
+        times, values = self.chest_acc_history.last_seconds(self.SPECTRUM_WINDOW)
+        ids = times >= self.t_resume
+        times, values = times[ids], values[ids]
+        if len(values) < 3:
+            return
         dt = times[-1] - times[-2]
 
         # Calculate the spectrum
+        from scipy import signal
         self.br_psd_freqs_hist, self.br_psd_values_hist = signal.periodogram(values, fs=1/dt, window='hann', detrend='linear')
         self.br_psd_values_hist /= np.sum(self.br_psd_values_hist)
         
-        # Interpolating the power spectral density, to get sub-bin integration
-        br_psd_freqs_interp = np.arange(self.br_psd_freqs_hist[0], self.br_psd_freqs_hist[-1], 0.005)
-        br_psd_interp = np.interp(br_psd_freqs_interp, self.br_psd_freqs_hist, self.br_psd_values_hist)
-        
-        # Calculating total power and peak power
-        peak_freq = br_psd_freqs_interp[np.argmax(br_psd_interp)]
-        total_power = np.trapz(br_psd_interp, br_psd_freqs_interp)
-        peak_indices = np.where((br_psd_freqs_interp >= peak_freq - 0.015) & (br_psd_freqs_interp <= peak_freq + 0.015)) # 0.03 Hz around the peak is recommended by R. McCraty
-        peak_power = np.trapz(br_psd_interp[peak_indices], br_psd_freqs_interp[peak_indices])
-
+        peak_power, total_power = calculate_peak_and_total_power(self.br_psd_freqs_hist, self.br_psd_values_hist)
         self.br_coherence = peak_power/total_power
+        self.br_coherence_history.update(times[-1], self.br_coherence)
 
     def get_chest_acc_sub_history(self, start_time, end_time):
         '''
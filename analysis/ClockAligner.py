@@ -0,0 +1,121 @@
+import numpy as np
+
+class ClockAligner:
+
+    def __init__(self, window=120, n_bins=60, max_step=1.0, reset_time=10, max_drift=1e-3):
+        '''
+        Maps sensor timestamps to host time, estimated online from the host arrival times of the samples
+        A sample arrives after it was taken by a delay that varies with the BLE connection and batching of packets,
+        and is never negative, so late samples are the only outliers and the clocks are related by the lower envelope
+        of the delays (Moon, Skelly and Towsley, 1999): the line below the minimum delay of each bin of the last
+        window seconds which is closest to them in total, an edge of their lower convex hull
+
+        window: s of sensor time used for the fit, split into n_bins bins
+        max_step: s, a sample further than this from the fitted offset is a step of the sensor clock, e.g. a lost beat,
+        and restarts the fit, at once if it arrived early, or after reset_time s of samples if late
+        max_drift: limit of the drift between the clocks, against poor fits of the first bins
+        '''
+        self.window = window
+        self.n_bins = n_bins
+        self.bin_width = window/n_bins
+        self.max_step = max_step
+        self.reset_time = reset_time
+        self.max_drift = max_drift
+
+        self.s_ref = None # Sensor time of the first sample, drift is relative to it for precision
+        self.bins = {} # Bin index: (sensor time, delay) of the minimum delay in the bin
+        self.offset = 0.0 # s, host time - sensor time at s_ref
+        self.drift = 0.0 # s per s
+        self.s_late = None # Sensor time of the first of a run of late samples
+        self.t_last = -np.inf # Last aligned time, times are never earlier
+        self.n_resets = 0
+
+    def align(self, sensor_times, t_arrival):
+        '''
+        Returns host times of sensor_times, a sample time or an array of sample times which arrived at host time t_arrival
+        The returned times increase monotonically over calls
+        '''
+        if np.ndim(sensor_times) == 0:
+            self.add_arrival(float(sensor_times), t_arrival)
+            t = max(self.get_host_time(float(sensor_times)), self.t_last)
+            self.t_last = t
+            return t
+
+        sensor_times = np.asarray(sensor_times, dtype=float)
+        if len(sensor_times) == 0:
+            return sensor_times.copy()
+        self.add_arrival(float(sensor_times[-1]), t_arrival)
+        times = np.maximum.accumulate(np.maximum(self.get_host_time(sensor_times), self.t_last))
+        self.t_last = times[-1]
+        return times
+
+    def get_host_time(self, sensor_times):
+        return sensor_times + self.offset + self.drift*(sensor_times - self.s_ref)
+
+    def add_arrival(self, sensor_time, t_arrival):
+        '''
+        Adds a sample taken at sensor_time that arrived at host time t_arrival, and updates the fit if its delay is a new minimum
+        '''
+        delay = t_arrival - sensor_time
+        if self.s_ref is None:
+            self.s_ref = sensor_time
+        elif self.bins:
+            residual = delay - (self.offset + self.drift*(sensor_time - self.s_ref))
+            if residual < -self.max_step:
+                self.reset()
+            elif residual > self.max_step:
+                if self.s_late is None:
+                    self.s_late = sensor_time
+                elif sensor_time - self.s_late > self.reset_time:
+                    self.reset()
+            else:
+                self.s_late = None
+
+        i_bin = int((sensor_time - self.s_ref)//self.bin_width)
+        bin_min = self.bins.get(i_bin)
+        if bin_min is None:
+            for i in [i for i in self.bins if i <= i_bin - self.n_bins]:
+                del self.bins[i]
+        elif delay >= bin_min[1]:
+            return
+        self.bins[i_bin] = (sensor_time, delay)
+        self.fit()
+
+    def fit(self):
+        '''
+        Fits offset and drift to the hull edge of the bin minima above their mean time
+        The total distance of the points above a line under all of them is smallest for this edge
+        '''
+        points = sorted((s - self.s_ref, delay) for s, delay in self.bins.values())
+        hull = []
+        for point in points:
+            while len(hull) > 1 and get_cross_product(hull[-2], hull[-1], point) <= 0:
+                hull.pop()
+            hull.append(point)
+        if len(hull) == 1:
+            self.drift = 0.0
+            self.offset = hull[0][1]
+            return
+
+        s_mean = sum(s for s, _ in points)/len(points)
+        i = 1
+        while i < len(hull) - 1 and hull[i][0] < s_mean:
+            i += 1
+        (s_1, d_1), (s_2, d_2) = hull[i - 1], hull[i]
+        self.drift = min(max((d_2 - d_1)/(s_2 - s_1), -self.max_drift), self.max_drift)
+        self.offset = min(delay - self.drift*s for s, delay in hull) # Stays under every point when the drift is limited
+
+    def reset(self):
+        '''
+        Restarts the fit, after a step of the sensor clock
+        '''
+        self.bins = {}
+        self.drift = 0.0
+        self.s_late = None
+        self.n_resets += 1
+
+def get_cross_product(o, a, b):
+    '''
+    Returns the z component of (a - o) x (b - o), positive when o, a, b turn anticlockwise
+    '''
+    return (a[0] - o[0])*(b[1] - o[1]) - (a[1] - o[1])*(b[0] - o[0])
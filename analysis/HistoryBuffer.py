@@ -1,36 +1,83 @@
-
 import numpy as np
 import time
-from PySide6.QtCore import QPointF
+
 class HistoryBuffer:
 
     def __init__(self, buffer_size):
         '''
         Rolling history buffer of values, times is in epoch seconds
-        '''        
-        self.values = np.full(buffer_size, np.nan)
-        self.times = np.full(buffer_size, np.nan)
-        self.markers = np.full(buffer_size, -1, dtype=int) # To store indices of interest for values/times
+        Stored as a circular buffer, with every sample written twice (at head and head + buffer_size),
+        so the chronological window is always a contiguous view and appending is O(1)
+        '''
+        self.buffer_size = buffer_size
+        self._values = np.full(2*buffer_size, np.nan)
+        self._times = np.full(2*buffer_size, np.nan)
+        self._head = 0 # Position of the next write, and of the oldest value
+        self._n_updates = 0 # Total number of values ever added
+        self._n_nan = buffer_size # Number of nan values in the window
 
-    def update(self, new_time, new_value):
+        self._marker_ids = np.full(2*buffer_size, -1, dtype=np.int64) # Absolute sample numbers of markers
+        self._marker_head = 0
+
+        self.version = 0 # Increases on every change of the contents, so readers can skip unchanged buffers
+
+    @property
+    def values(self):
+        return self._values[self._head:self._head + self.buffer_size]
+
+    @property
+    def times(self):
+        return self._times[self._head:self._head + self.buffer_size]
+
+    @property
+    def markers(self):
         '''
-        Adds a new value and timestamp to the end of the buffer, moving every element one step to the left
-        The marker indic
+        Indices of interest for values/times, -1 where the marker is unset or has left the buffer
         '''
-        self.times = np.roll(self.times, -1)
-        self.times[-1] = new_time
-        self.values = np.roll(self.values, -1)
-        self.values[-1] = new_value
+        marker_ids = self._marker_ids[self._marker_head:self._marker_head + self.buffer_size]
+        markers = marker_ids - (self._n_updates - self.buffer_size)
+        markers[(marker_ids < 0) | (markers < 0)] = -1
+        return markers
 
-        self.markers = self.markers - 1 # Index of marker shifts with the rolling buffers
-        self.markers[self.markers < -1] = -1
+    def update(self, new_time, new_value):
+        '''
+        Adds a new value and timestamp to the end of the buffer, overwriting the oldest value
+        Markers are stored as absolute sample numbers, so they do not need shifting
+        '''
+        i = self._head
+        self._n_nan += int(np.isnan(new_value)) - int(np.isnan(self._values[i]))
+        self._times[i] = self._times[i + self.buffer_size] = new_time
+        self._values[i] = self._values[i + self.buffer_size] = new_value
+        self._head = (i + 1) % self.buffer_size
+        self._n_updates += 1
+        self.version += 1
+
+    def extend(self, new_times, new_values):
+        '''
+        Adds arrays of values and timestamps to the end of the buffer, equivalent to calling update for each
+        '''
+        n_new = len(new_values)
+        new_times = new_times[-self.buffer_size:]
+        new_values = new_values[-self.buffer_size:]
+        n = len(new_values)
+        ids = (self._head + np.arange(n)) % self.buffer_size
+        self._n_nan += np.count_nonzero(np.isnan(new_values)) - np.count_nonzero(np.isnan(self._values[ids]))
+        self._times[ids] = self._times[ids + self.buffer_size] = new_times
+        self._values[ids] = self._values[ids + self.buffer_size] = new_values
+        self._head = (self._head + n) % self.buffer_size
+        self._n_updates += n_new
+        self.version += 1
 
     def add_marker(self, index):
         '''
         Adds a marker to the specified index
         '''
-        self.markers = np.roll(self.markers, -1)
-        self.markers[-1] = index
+        if index < 0:
+            index += self.buffer_size
+        i = self._marker_head
+        self._marker_ids[i] = self._marker_ids[i + self.buffer_size] = self._n_updates - self.buffer_size + index
+        self._marker_head = (i + 1) % self.buffer_size
+        self.version += 1
 
     def get_relative_times(self):
         '''
@@ -38,70 +85,125 @@ class HistoryBuffer:
         '''
         return self.times - time.time_ns()/1.0e9
 
+    def get_series_arrays(self, use_relative_time=True):
+        '''
+        Returns contiguous (x, y) arrays of the non-nan values, for using with series.replaceNp
+        '''
+        times = self.get_relative_times() if use_relative_time else self.times.copy()
+        values = self.values
+        if self._n_nan == 0:
+            return (times, values.copy())
+        ids = ~np.isnan(values)
+        return (times[ids], values[ids])
+
+    def get_marker_arrays(self, use_relative_time=True):
+        '''
+        Returns contiguous (x, y) arrays of the values at the marker indices
+        '''
+        times = self.get_relative_times() if use_relative_time else self.times
+        markers = self.markers
+        markers = markers[markers >= 0]
+        return (times[markers], self.values[markers])
+
     def get_qpoint_list(self, use_relative_time=True):
         '''
         Returns a list of QPointF, for using with Qseries.replace
         '''
-        series = []
-        rel_t = self.get_relative_times()
-        for i, value in enumerate(self.values):
-            if not np.isnan(value):
-                series.append(QPointF(rel_t[i], value))
-        return series
+        from PySide6.QtCore import QPointF
+        return [QPointF(t, value) for t, value in zip(*self.get_series_arrays(use_relative_time))]
 
     def get_qpoint_marker_list(self, use_relative_time=True):
         '''
         Returns a list of QPointF of values at the marker indices
         '''
-        series = []
-        rel_t = self.get_relative_times()
-        for _, marker_id in enumerate(self.markers):
-            if marker_id >= 0:
-                series.append(QPointF(rel_t[marker_id], self.values[marker_id]))
-        return series
+        from PySide6.QtCore import QPointF
+        return [QPointF(t, value) for t, value in zip(*self.get_marker_arrays(use_relative_time))]
+
+    def get_index_range(self, t_start, t_end, include_start=True):
+        '''
+        Returns the start and end indices into times/values of the samples with t_start <= t <= t_end,
+        or t_start < t <= t_end if include_start is False
+        Found by binary search, as times only go forward
+        '''
+        i_filled = self.buffer_size - min(self._n_updates, self.buffer_size) # Unfilled entries are at the start
+        times = self.times[i_filled:]
+        i_start = np.searchsorted(times, t_start, side='left' if include_start else 'right')
+        i_end = np.searchsorted(times, t_end, side='right')
+        return (i_filled + i_start, i_filled + max(i_start, i_end))
+
+    def slice_between(self, t_start, t_end, include_start=True):
+        '''
+        Returns views (times, values) of the samples with t_start <= t <= t_end,
+        or t_start < t <= t_end if include_start is False
+        '''
+        i_start, i_end = self.get_index_range(t_start, t_end, include_start)
+        return (self.times[i_start:i_end], self.values[i_start:i_end])
+
+    def last_seconds(self, seconds):
+        '''
+        Returns views (times, values) of the samples in the last seconds before the latest sample, t > t_latest - seconds
+        '''
+        return self.slice_between(self.times[-1] - seconds, np.inf, include_start=False)
 
     def get_values_range(self, rel_t_range):
         '''
         Returns the range of the values in the specified relative time range
         '''
-        rel_t = self.get_relative_times()
-        ids = (rel_t > rel_t_range[0]) & (rel_t <= rel_t_range[1])
         if not self.is_empty():
-            min = np.floor(np.nanmin(self.values[ids]))
-            max = np.ceil(np.nanmax(self.values[ids]))
-            return (min, max)        
+            t_now = time.time_ns()/1.0e9
+            _, values = self.slice_between(t_now + rel_t_range[0], t_now + rel_t_range[1], include_start=False)
+            min = np.floor(np.nanmin(values))
+            max = np.ceil(np.nanmax(values))
+            return (min, max)
         else:
             return None
 
     def is_empty(self):
-        return np.isnan(self.values).all()
-    
+        return self._n_nan == self.buffer_size
+
     def n_values(self):
-        return np.count_nonzero(~np.isnan(self.values))
+        return self.buffer_size - self._n_nan
 
     def is_full(self):
-        return not np.isnan(self.values).any()
+        return self._n_nan == 0
 
-    def get_sub_buffer(self, t_start, t_end):
+    @classmethod
+    def from_arrays(cls, times, values, markers=None, version=0):
         '''
-        Returns a new HistoryBuffer instance with values and times between t_start and t_end
+        Returns a full buffer holding times and values, oldest first, with nan times for unfilled entries at the start
+        markers are indices into them, as the markers property returns, entries of -1 are ignored
+        version: the version of the buffer the arrays were copied from
+        '''
+        markers = np.empty(0, dtype=np.int64) if markers is None else np.asarray(markers, dtype=np.int64)
+        buffer = cls(len(values))
+        buffer._set_contents(times, values, markers[markers >= 0])
+        buffer.version = version
+        return buffer
+
+    def _set_contents(self, times, values, markers):
+        '''
+        Fills the buffer with times and values of length buffer_size, and markers as indices into them
         '''
-        mask = (self.times >= t_start) & (self.times <= t_end)
-        sub_values = self.values[mask]
-        sub_times = self.times[mask]
+        n = self.buffer_size
+        self._times[:n] = self._times[n:] = times
+        self._values[:n] = self._values[n:] = values
+        self._head = 0
+        self._n_updates = np.count_nonzero(~np.isnan(times)) # Unfilled entries have nan times
+        self._n_nan = np.count_nonzero(np.isnan(values))
 
-        sub_buffer_size = len(sub_values)
-        sub_buffer = HistoryBuffer(sub_buffer_size)
+        n_markers = len(markers)
+        self._marker_ids[:n_markers] = self._marker_ids[n:n + n_markers] = markers + (self._n_updates - n)
+        self._marker_head = n_markers % self.buffer_size if self.buffer_size else 0
 
-        # Add the filtered values and times to the new buffer
-        sub_buffer.values[:sub_buffer_size] = sub_values
-        sub_buffer.times[:sub_buffer_size] = sub_times
+    def get_sub_buffer(self, t_start, t_end):
+        '''
+        Returns a new HistoryBuffer instance with values and times between t_start and t_end
+        '''
+        i_start, i_end = self.get_index_range(t_start, t_end)
 
-        # Handle markers within the specified range
-        sub_buffer.markers = np.full(sub_buffer_size, -1, dtype=int)
-        for i, marker in enumerate(self.markers):
-            if marker >= 0 and self.times[marker] >= t_start and self.times[marker] <= t_end:
-                new_marker_index = np.where(self.times[mask] == self.times[marker])[0][0]
-                sub_buffer.markers[new_marker_index] = new_marker_index
+        # Remap markers within the specified range to indices of the sub buffer
+        markers = self.markers
+        markers = markers[(markers >= i_start) & (markers < i_end)]
+        sub_markers = np.unique(markers - i_start)
 
-        return sub_buffer
\ No newline at end of file
+        return HistoryBuffer.from_arrays(self.times[i_start:i_end], self.values[i_start:i_end], sub_markers)
@@ -1,6 +1,10 @@
-from .HistoryBuffer import HistoryBuffer
+import functools
+from .TieredHistoryBuffer import TieredHistoryBuffer
+from .SlidingSpectrum import SlidingSpectrum, UniformResampler
+from .HrvWindow import HrvWindow
+from .utils import calculate_peak_and_total_power
+from .instrumentation import timed
 import numpy as np
-from scipy import signal
 
 def ibi_to_hr(ibi):
     return 60.0/(ibi/1000.0)
@@ -15,25 +19,34 @@ def calculate_sdnn(ibi):
     return np.std(ibi, ddof=1)
 
 class HrvAnalyser:
-    def __init__(self):
+    def __init__(self, time_domain_window=30, spectrum_window=30, spill_dir=None):
+        '''
+        time_domain_window: s of beats before the latest for the windowed time-domain metrics, nn50 and pnn50
+        spectrum_window: s of beats in the spectrum for coherence
+        spill_dir: directory for the samples that leave the histories, see TieredHistoryBuffer
+        '''
         self.IBI_MIN_FILTER = 300 # ms
         self.IBI_MAX_FILTER = 1600 # ms
         self.HRV_MIN_FILTER = 0.2 # percentage allowable of last two HRV values
+        self.TIME_DOMAIN_WINDOW = time_domain_window # s
+        self.SPECTRUM_WINDOW = spectrum_window # s
 
         self.ibi_latest_phase_duration = 0
         self.ibi_last_phase = 0
         self.ibi_last_extreme = 0
         
-        self.ibi_history = HistoryBuffer(1500)
-        self.hr_history = HistoryBuffer(500)
+        # Sizes are of the samples kept in memory, older ones spill to disk
+        history = functools.partial(TieredHistoryBuffer, spill_dir=spill_dir)
+        self.ibi_history = history(1500, name='ibi')
+        self.hr_history = history(500, name='hr')
 
-        self.hrv_history = HistoryBuffer(500)
-        self.rmssd_history = HistoryBuffer(500)
-        self.maxmin_history = HistoryBuffer(500)
-        self.sdnn_history = HistoryBuffer(500)
-        self.nn50_history = HistoryBuffer(500)
-        self.pnn50_history = HistoryBuffer(500)
-        self.coherence_history = HistoryBuffer(500)
+        self.hrv_history = history(500, name='hrv')
+        self.rmssd_history = history(500, name='rmssd')
+        self.maxmin_history = history(500, name='maxmin')
+        self.sdnn_history = history(500, name='sdnn')
+        self.nn50_history = history(500, name='nn50')
+        self.pnn50_history = history(500, name='pnn50')
+        self.coherence_history = history(500, name='coherence')
 
         self.ibi_values_interp_hist = [] # Interpolated IBI values
         self.ibi_times_interp_hist = [] # Interpolated IBI times
@@ -41,7 +54,20 @@ class HrvAnalyser:
         self.hrv_psd_values_hist = []
 
         self.hr_coherence = np.nan
+        self.is_after_gap = False
+        self.t_resume = -np.inf # Time of the first beat after the last gap, the windowed analyses start from it
+        self.hrv_window = HrvWindow(self.TIME_DOMAIN_WINDOW) # nn50, pnn50, rmssd, sdnn and mean hr of the trailing window
+
+        # Running sums of the beats after breath_t_start, for the metrics of the breath in progress
+        self.breath_t_start = None # None until the first breath ends
+        self.reset_breath_sums(None)
 
+        # Streaming spectrum of ibi, resampled at a fixed interval over the spectrum window
+        self.HRV_SPECTRUM_DT = 60.0/90.0 # Assume a max of 90 bpm, maximum of 0.75 Hz
+        self.ibi_resampler = UniformResampler(self.HRV_SPECTRUM_DT)
+        self.hrv_spectrum = SlidingSpectrum(int(round(self.SPECTRUM_WINDOW/self.HRV_SPECTRUM_DT)), 1/self.HRV_SPECTRUM_DT)
+
+    @timed('HrvAnalyser.update')
     def update(self, t, ibi):
         '''
         Updates the history of inter-beat-interval and heart rate
@@ -53,6 +79,19 @@ class HrvAnalyser:
         hr = ibi_to_hr(ibi)
         self.ibi_history.update(t, ibi) # TODO: Handle multiple points arriving at the same time
         self.hr_history.update(t, hr)
+        if self.is_after_gap:
+            self.t_resume = t
+        self.add_to_breath_sums(t, ibi, None if self.is_after_gap else self.ibi_history.values[-2]) # No difference across a gap
+        self.hrv_window.add(t, ibi)
+        for ibi_interp in self.ibi_resampler.update(t, ibi):
+            self.hrv_spectrum.update(ibi_interp)
+
+        if self.is_after_gap: # The previous beat is before the gap, so the phase starts again from this one
+            self.is_after_gap = False
+            self.ibi_latest_phase_duration = 0
+            self.ibi_last_phase = 0
+            self.ibi_last_extreme = ibi
+            return
 
         # Update duration and determine the current phase
         self.ibi_latest_phase_duration += ibi
@@ -79,72 +118,162 @@ class HrvAnalyser:
         self.ibi_last_extreme = current_ibi_extreme
         self.ibi_last_phase = current_ibi_phase
 
+    def mark_gap(self):
+        '''
+        Marks a gap in the beats, e.g. while the sensor reconnects
+        The next beat starts the phase, successive differences, running breath sums and spectrum again,
+        so none of them spans the gap
+        '''
+        self.is_after_gap = True
+        self.hrv_window.mark_gap()
+        self.reset_breath_sums(None)
+        self.ibi_resampler = UniformResampler(self.HRV_SPECTRUM_DT)
+        self.hrv_spectrum.reset()
+
+    @timed('HrvAnalyser.update_breath_by_breath_metrics')
     def update_breath_by_breath_metrics(self, t_range):
         '''
         Updates the metrics calcuated on each breath, rmssd and maxmin
         t_range is the time_range of the breath
+        Breaths follow each other, so the metrics come from the running sums of the beats since the last breath,
+        and from the ibi history only for the first breath, or a breath that does not start where the last ended
+        A breath without beats, e.g. when the ibi stream resumes after a gap later than acc, has nan metrics,
+        so the histories keep one entry per breath
         ''' 
-        
-        ibi_ids = self.ibi_history.times > t_range[0]
-        ibi_values = self.ibi_history.values[ibi_ids]
-        ibi_values_shifted = np.roll(self.ibi_history.values, 1)[ibi_ids]
-        
-        rmssd = calculate_rmssd(ibi_values, ibi_values_shifted)
-        maxmin = calculate_maxmin(ibi_values)
-        sdnn = calculate_sdnn(ibi_values)
+        if t_range[0] == self.breath_t_start and self.breath_n > 0:
+            rmssd = np.sqrt(self.breath_sum_squared_diff/self.breath_n_diffs) if self.breath_n_diffs > 0 else np.nan
+            maxmin = self.breath_max - self.breath_min
+            sdnn = np.sqrt(self.breath_m2/(self.breath_n - 1)) if self.breath_n > 1 else np.nan
+        else:
+            metrics = self.calculate_breath_by_breath_metrics(t_range[0])
+            rmssd, maxmin, sdnn = (np.nan, np.nan, np.nan) if metrics is None else metrics
 
         self.rmssd_history.update(t_range[1], rmssd)
         self.maxmin_history.update(t_range[1], maxmin)
         self.sdnn_history.update(t_range[1], sdnn)
+        self.reset_breath_sums(t_range[1])
 
-    def update_coherence(self):
+    def calculate_breath_by_breath_metrics(self, t_start):
+        '''
+        Returns rmssd, maxmin and sdnn of the beats after t_start, from the ibi history, or None if there are none
+        '''
+        i_start, _ = self.ibi_history.get_index_range(t_start, np.inf, include_start=False)
+        values = self.ibi_history.values
+        ibi_values = values[i_start:]
+        if len(ibi_values) == 0:
+            return None
+        if i_start > 0 and self.ibi_history.times[i_start - 1] < self.t_resume: # The previous beat is before a gap
+            rmssd = calculate_rmssd(ibi_values[1:], ibi_values[:-1]) if len(ibi_values) > 1 else np.nan
+        else:
+            ibi_values_shifted = values[i_start - 1:-1] if i_start > 0 else np.roll(values, 1) # Previous ibi of each
+            rmssd = calculate_rmssd(ibi_values, ibi_values_shifted)
+        return (rmssd, calculate_maxmin(ibi_values), calculate_sdnn(ibi_values))
+
+    def reset_breath_sums(self, t_start):
+        '''
+        Starts the running sums of a breath from t_start, with the beats already after it
+        '''
+        self.breath_t_start = t_start
+        self.breath_n = 0
+        self.breath_n_diffs = 0 # Fewer than breath_n when the first beat after a gap is in the breath
+        self.breath_sum_squared_diff = 0.0
+        self.breath_mean = 0.0 # Welford mean and sum of squared deviations
+        self.breath_m2 = 0.0
+        self.breath_max = -np.inf # Running extremes, the beats of a breath are only added to
+        self.breath_min = np.inf
+        if t_start is None:
+            return
+
+        times = self.ibi_history.times
+        values = self.ibi_history.values
+        i = len(times)
+        while i > 0 and times[i - 1] > t_start: # Beats ahead of the breath detection, at most a few
+            i -= 1
+        for j in range(i, len(times)):
+            if j > 0 and times[j - 1] < self.t_resume <= times[j]: # The previous beat is before a gap
+                previous_ibi = None
+            else:
+                previous_ibi = values[j - 1] if j > 0 else np.nan
+            self.add_to_breath_sums(times[j], values[j], previous_ibi)
+
+    def add_to_breath_sums(self, t, ibi, previous_ibi):
+        '''
+        Adds a beat to the running sums of the breath in progress
+        previous_ibi is None for the first beat after a gap, which adds no successive difference
+        '''
+        if self.breath_t_start is None or not t > self.breath_t_start:
+            return
+        self.breath_n += 1
+        if previous_ibi is not None:
+            self.breath_n_diffs += 1
+            self.breath_sum_squared_diff += (ibi - previous_ibi)**2
+        delta = ibi - self.breath_mean
+        self.breath_mean += delta/self.breath_n
+        self.breath_m2 += delta*(ibi - self.breath_mean)
+        self.breath_max = max(self.breath_max, ibi)
+        self.breath_min = min(self.breath_min, ibi)
+
+    @timed('HrvAnalyser.update_coherence')
+    def update_coherence(self, use_periodogram=True):
         '''
         Updates the coherence score, calculated based on the frequency spectrum of heart rate
+        Uses the streaming spectrum once it holds a full window, updated in O(bins) per beat
+        Until then uses update_coherence_periodogram, or leaves the score unchanged if use_periodogram is False
+        Both resample onto the same grid and window, so the scores differ by rounding only, under 1e-13 relative
+        on synthetic ibi (see benchmarks/bench_streaming_spectrum.py)
         '''
-        # Taking only last 30 seconds
-        ids = self.ibi_history.times > (self.ibi_history.times[-1] - 30) # Hardcode 30 seconds
-        ids = np.logical_and(ids, ~np.isnan(self.ibi_history.values))
-        
+        if not self.hrv_spectrum.is_full():
+            if use_periodogram:
+                self.update_coherence_periodogram()
+            return
+
+        self.hrv_psd_freqs_hist, self.hrv_psd_values_hist = self.hrv_spectrum.get_psd()
+        peak_power, total_power = calculate_peak_and_total_power(self.hrv_psd_freqs_hist, self.hrv_psd_values_hist)
+        self.hr_coherence = 10*peak_power/(total_power - peak_power)
+
+        self.coherence_history.update(self.ibi_history.times[-1], self.hr_coherence)
+
+    @timed('HrvAnalyser.update_coherence_periodogram')
+    def update_coherence_periodogram(self):
+        '''
+        Updates the coherence score from a periodogram of the ibi history
+        The ibi are interpolated onto the grid of ibi_resampler, which starts at the first beat after the last gap,
+        over its last SPECTRUM_WINDOW s of grid points, the window of the streaming spectrum
+        '''
+        dt = self.HRV_SPECTRUM_DT
+        n_grid = self.ibi_resampler.n_grid
+        if n_grid < 3:
+            return
+
         # Interpolate with fixed interval
-        values = self.ibi_history.values[ids]
-        times = self.ibi_history.times[ids]
-        t_start = times[0] 
-        t_end = times[-1]
-        dt = 60.0/90.0 # Assume a max of 90 bpm, maximum of 0.75 Hz
-        self.ibi_times_interp_hist = np.arange(t_start, t_end+dt, dt)
+        i_grid = np.arange(max(n_grid - self.hrv_spectrum.N, 0), n_grid)
+        self.ibi_times_interp_hist = self.ibi_resampler.t_first + dt*i_grid
+        i_start, i_end = self.ibi_history.get_index_range(self.ibi_times_interp_hist[0], np.inf)
+        if self.ibi_history.times[i_start] > self.ibi_times_interp_hist[0]: # The beat before the grid, to interpolate from
+            i_start -= 1
+        times = self.ibi_history.times[i_start:i_end]
+        values = self.ibi_history.values[i_start:i_end]
         self.ibi_values_interp_hist = np.interp(self.ibi_times_interp_hist, times, values)
         
         # Calculate HRV spectrum
+        from scipy import signal # Imported here, as it takes over a second to import at startup
         self.hrv_psd_freqs_hist, self.hrv_psd_values_hist = signal.periodogram(self.ibi_values_interp_hist, fs=1/dt, window='hann', detrend='linear')
         self.hrv_psd_values_hist /= np.sum(self.hrv_psd_values_hist)
 
-        # Interpolating the power spectral density, to get sub-bin integration
-        hrv_psd_freqs_interp = np.arange(self.hrv_psd_freqs_hist[0], self.hrv_psd_freqs_hist[-1], 0.005)
-        hrv_psd_interp = np.interp(hrv_psd_freqs_interp, self.hrv_psd_freqs_hist, self.hrv_psd_values_hist)
-        
-        # Calculating total power and peak power
-        peak_freq = hrv_psd_freqs_interp[np.argmax(hrv_psd_interp)]
-        peak_indices = np.where((hrv_psd_freqs_interp >= peak_freq - 0.015) & (hrv_psd_freqs_interp <= peak_freq + 0.015)) # 0.03 Hz around the peak is recommended by R. McCraty
-        peak_power = np.trapz(hrv_psd_interp[peak_indices], hrv_psd_freqs_interp[peak_indices])
-        total_power = np.trapz(hrv_psd_interp, hrv_psd_freqs_interp)
-
+        peak_power, total_power = calculate_peak_and_total_power(self.hrv_psd_freqs_hist, self.hrv_psd_values_hist)
         self.hr_coherence = 10*peak_power/(total_power - peak_power)
 
-        self.coherence_history.update(t_end, self.hr_coherence)
+        self.coherence_history.update(self.ibi_history.times[-1], self.hr_coherence)
 
+    @timed('HrvAnalyser.update_nn50_metrics')
     def update_nn50_metrics(self):
-        # Taking only last 30 seconds
-        ids = self.ibi_history.times > (self.ibi_history.times[-1] - 30) # Hardcode 30 seconds
-        ids = np.logical_and(ids, ~np.isnan(self.ibi_history.values))
-
-        ibi_values = self.ibi_history.values[ids]
-        ibi_values_shifted = np.roll(ibi_values, -1)
-
-        nn50 = np.sum(np.abs(ibi_values[:-1] - ibi_values_shifted[:-1]) > 50)
-        pnn50 = (nn50 / len(ibi_values[:-1]))*100
-
-        self.nn50_history.update(self.ibi_history.times[-1], nn50)
-        self.pnn50_history.update(self.ibi_history.times[-1], pnn50)
+        '''
+        Updates the nn50 and pnn50 histories from the trailing window of beats, kept as the beats arrive
+        '''
+        if self.ibi_history.is_empty():
+            return
+        self.nn50_history.update(self.ibi_history.times[-1], self.hrv_window.nn50)
+        self.pnn50_history.update(self.ibi_history.times[-1], self.hrv_window.get_pnn50())
 
     def get_ibi_sub_history(self, start_time, end_time):
         '''
@@ -0,0 +1,107 @@
+import numpy as np
+from collections import deque
+
+class HrvWindow:
+
+    NN50_THRESHOLD = 50 # ms
+    RESYNC_INTERVAL = 1000 # Beats between recalculating the sums from the window, against accumulated rounding
+
+    def __init__(self, window=30):
+        '''
+        Time-domain HRV metrics of the beats in a trailing window of window seconds before the latest beat, t > t_latest - window
+        Beats are added and expired with running sums, so each beat costs O(1) amortised
+        Successive differences are of consecutive beats that are both in the window
+        '''
+        if not window > 0:
+            raise ValueError(f"Window must be a positive number of s, not {window!r}")
+        self.window = window
+        self.beats = deque() # [t, ibi, difference from the previous beat or None]
+        self.ibi_ref = np.nan # Sums of ibi are of ibi - ibi_ref, against cancellation in the variance
+        self.n_added = 0
+        self.is_after_gap = False
+        self._reset_sums()
+
+    def _reset_sums(self):
+        self.sum_ibi = 0.0
+        self.sum_ibi_squared = 0.0
+        self.n_diffs = 0
+        self.sum_diff_squared = 0.0
+        self.nn50 = 0
+
+    def add(self, t, ibi):
+        '''
+        Adds a beat at time t, and expires the beats no longer in the window
+        '''
+        if np.isnan(self.ibi_ref):
+            self.ibi_ref = ibi
+        diff = ibi - self.beats[-1][1] if self.beats and not self.is_after_gap else None
+        self.is_after_gap = False
+        self.beats.append([t, ibi, diff])
+        self._add_ibi(ibi, 1)
+        self._add_diff(diff, 1)
+
+        while self.beats[0][0] <= t - self.window:
+            _, ibi_old, diff_old = self.beats.popleft()
+            self._add_ibi(ibi_old, -1)
+            self._add_diff(diff_old, -1)
+            self._add_diff(self.beats[0][2], -1) # The difference of the next beat was from the expired one
+            self.beats[0][2] = None
+
+        self.n_added += 1
+        if self.n_added % self.RESYNC_INTERVAL == 0:
+            self._resync()
+
+    def mark_gap(self):
+        '''
+        The next beat does not follow the last, so has no successive difference
+        '''
+        self.is_after_gap = True
+
+    def _add_ibi(self, ibi, sign):
+        self.sum_ibi += sign*(ibi - self.ibi_ref)
+        self.sum_ibi_squared += sign*(ibi - self.ibi_ref)**2
+
+    def _add_diff(self, diff, sign):
+        if diff is None:
+            return
+        self.n_diffs += sign
+        self.sum_diff_squared += sign*diff**2
+        self.nn50 += sign*(abs(diff) > self.NN50_THRESHOLD)
+
+    def _resync(self):
+        self._reset_sums()
+        for _, ibi, diff in self.beats:
+            self._add_ibi(ibi, 1)
+            self._add_diff(diff, 1)
+
+    def __len__(self):
+        return len(self.beats)
+
+    def get_pnn50(self):
+        return (self.nn50/self.n_diffs)*100 if self.n_diffs else np.nan
+
+    def get_rmssd(self):
+        return np.sqrt(max(self.sum_diff_squared, 0.0)/self.n_diffs) if self.n_diffs else np.nan
+
+    def get_sdnn(self):
+        n = len(self.beats)
+        if n < 2:
+            return np.nan
+        variance = (self.sum_ibi_squared - self.sum_ibi**2/n)/(n - 1)
+        return np.sqrt(max(variance, 0.0))
+
+    def get_mean_hr(self):
+        '''
+        Returns the heart rate of the mean ibi of the window, in bpm
+        '''
+        n = len(self.beats)
+        return 60000.0/(self.ibi_ref + self.sum_ibi/n) if n else np.nan
+
+    def get_metrics(self):
+        return {
+            'nn50': self.nn50,
+            'pnn50': self.get_pnn50(),
+            'rmssd': self.get_rmssd(),
+            'sdnn': self.get_sdnn(),
+            'mean_hr': self.get_mean_hr()
+        }
@@ -0,0 +1,147 @@
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+from .HistoryBuffer import HistoryBuffer
+
+class SharedSnapshot:
+
+    HEADER_SIZE = 64 # bytes, holds the version counter, followed by the version of each history
+    MAX_READ_ATTEMPTS = 20
+
+    def __init__(self, layout, name=None, lock=None):
+        '''
+        Latest state of a set of HistoryBuffers in shared memory, written by one process and read by others
+        layout is a dict of history name: buffer size, and must be the same for the writer and the readers
+        Creates the shared memory block when name is None, otherwise attaches to the existing block name
+        lock: the lock of the instance that created the block, created with it when None
+
+        Access is a sequence lock, so neither side waits on the other while copying:
+        the writer makes the version odd while it writes and even when done,
+        and a reader retries its copy if the version was odd or changed while copying
+        The version is written holding lock, and read holding it around a copy, as its acquire and release are
+        memory barriers, so a reader never sees a version before the data written ahead of it, even on weakly ordered
+        CPUs as ARM
+        The lock is only held for the access to the version, never for a copy
+        Polling for changes with get_version takes no lock, as an aligned 8 byte load is atomic and a stale
+        version only delays the next read
+        Each history also carries its HistoryBuffer.version, so unchanged histories are neither written nor copied
+        '''
+        self.layout = dict(layout)
+        self.lock = lock or multiprocessing.get_context('spawn').Lock() # Can be passed to spawned processes
+        n_histories = len(self.layout)
+        size = self.HEADER_SIZE + 8*n_histories + sum(3*8*buffer_size for buffer_size in self.layout.values())
+        self.is_owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.is_owner, size=size)
+
+        self.version = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.history_versions = np.ndarray((n_histories,), dtype=np.int64, buffer=self.shm.buf, offset=self.HEADER_SIZE)
+        self.arrays = {}
+        offset = self.HEADER_SIZE + 8*n_histories
+        for history_name, buffer_size in self.layout.items():
+            times = np.ndarray((buffer_size,), dtype=np.float64, buffer=self.shm.buf, offset=offset)
+            values = np.ndarray((buffer_size,), dtype=np.float64, buffer=self.shm.buf, offset=offset + 8*buffer_size)
+            markers = np.ndarray((buffer_size,), dtype=np.int64, buffer=self.shm.buf, offset=offset + 16*buffer_size)
+            self.arrays[history_name] = (times, values, markers)
+            offset += 3*8*buffer_size
+
+        if self.is_owner:
+            for times, values, markers in self.arrays.values():
+                times[:] = np.nan
+                values[:] = np.nan
+                markers[:] = -1
+            self.history_versions[:] = -1
+            self.version[0] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def get_version(self):
+        '''
+        Returns the version of the last complete write, odd while a write is in progress
+        Read without the lock, to poll for changes: it can lag a write, so the data is read with read or read_latest
+        '''
+        return int(self.version[0])
+
+    def get_version_synchronized(self):
+        '''
+        Returns the version as get_version, ordered with the reads of the data around it
+        '''
+        with self.lock:
+            return int(self.version[0])
+
+    def increment_version(self):
+        with self.lock:
+            self.version[0] += 1
+
+    def publish(self, histories):
+        '''
+        Writes histories, a dict of name: HistoryBuffer with the names and sizes of the layout
+        Histories with the same version as the last write are skipped
+        '''
+        self.increment_version()
+        for i, (history_name, (times, values, markers)) in enumerate(self.arrays.items()):
+            history = histories[history_name]
+            if self.history_versions[i] == history.version:
+                continue
+            times[:] = history.times
+            values[:] = history.values
+            markers[:] = history.markers
+            self.history_versions[i] = history.version
+        self.increment_version()
+
+    def read(self, previous=None):
+        '''
+        Returns (version, histories) of a consistent copy, with histories as a dict of name: HistoryBuffer
+        previous: histories of an earlier read, reused for the histories that have not changed since
+        Returns None if every attempt overlapped a write, so callers can keep their previous snapshot
+        '''
+        previous = previous or {}
+        for _ in range(self.MAX_READ_ATTEMPTS):
+            version = self.get_version_synchronized()
+            if version % 2:
+                continue
+            history_versions = self.history_versions.tolist()
+            copies = {}
+            for history_name, history_version in zip(self.arrays, history_versions):
+                if history_name in previous and previous[history_name].version == history_version:
+                    continue
+                copies[history_name] = tuple(array.copy() for array in self.arrays[history_name])
+            if self.get_version_synchronized() == version:
+                histories = {}
+                for history_name, history_version in zip(self.arrays, history_versions):
+                    if history_name in copies:
+                        histories[history_name] = HistoryBuffer.from_arrays(*copies[history_name], version=history_version)
+                    else:
+                        histories[history_name] = previous[history_name]
+                return (version, histories)
+        return None
+
+    def read_latest(self, history_name):
+        '''
+        Returns (version, t, value) of the latest sample of a history, without copying the rest of it
+        Returns None if every attempt overlapped a write
+        '''
+        times, values, _ = self.arrays[history_name]
+        for _ in range(self.MAX_READ_ATTEMPTS):
+            version = self.get_version_synchronized()
+            if version % 2:
+                continue
+            t, value = float(times[-1]), float(values[-1])
+            if self.get_version_synchronized() == version:
+                return (version, t, value)
+        return None
+
+    def close(self):
+        '''
+        Detaches from the shared memory, and frees it if this instance created it
+        Does nothing if already closed, as a window can be closed more than once
+        '''
+        if self.version is None:
+            return
+        self.version = None
+        self.history_versions = None
+        self.arrays = {}
+        self.shm.close()
+        if self.is_owner:
+            self.shm.unlink()
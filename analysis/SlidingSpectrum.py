@@ -0,0 +1,145 @@
+import numpy as np
+
+class UniformResampler:
+
+    def __init__(self, dt):
+        '''
+        Linearly interpolates an irregular stream of samples onto a fixed grid with interval dt
+        The grid starts at the time of the first sample
+        '''
+        self.dt = dt
+        self.t_first = np.nan
+        self.t_last = np.nan
+        self.value_last = np.nan
+        self.n_grid = 0 # Number of grid samples emitted
+
+    def update(self, t, value):
+        '''
+        Adds a sample, returns the values of the grid points in (t_last, t]
+        '''
+        if np.isnan(self.t_first):
+            self.t_first = self.t_last = t
+            self.value_last = value
+            self.n_grid = 1
+            return np.array([value])
+        if not t > self.t_last:
+            return np.empty(0)
+
+        n_new = int(np.floor((t - self.t_first)/self.dt)) + 1 - self.n_grid
+        grid_t = self.t_first + self.dt*np.arange(self.n_grid, self.n_grid + max(n_new, 0))
+        grid_values = self.value_last + (value - self.value_last)*(grid_t - self.t_last)/(t - self.t_last)
+
+        self.n_grid += len(grid_t)
+        self.t_last = t
+        self.value_last = value
+        return grid_values
+
+    def update_block(self, times, values):
+        '''
+        Adds arrays of samples, returns the values of the grid points in (t_last, times[-1]]
+        Equivalent to concatenating the results of update for each sample
+        '''
+        if len(times) == 0:
+            return np.empty(0)
+        if np.isnan(self.t_first):
+            first_value = self.update(times[0], values[0])
+            return np.concatenate((first_value, self.update_block(times[1:], values[1:])))
+
+        keep = times > np.maximum.accumulate(np.concatenate(([self.t_last], times[:-1])))
+        seg_t = np.concatenate(([self.t_last], times[keep]))
+        seg_values = np.concatenate(([self.value_last], values[keep]))
+
+        n_new = int(np.floor((seg_t[-1] - self.t_first)/self.dt)) + 1 - self.n_grid
+        grid_t = self.t_first + self.dt*np.arange(self.n_grid, self.n_grid + max(n_new, 0))
+        ids = np.searchsorted(seg_t, grid_t, side='left') # Segment ending at or after each grid point
+        ids = np.clip(ids, 1, len(seg_t) - 1) # Grid points a rounding error outside the samples, as update extrapolates them
+        t_prev, t_next = seg_t[ids - 1], seg_t[ids]
+        value_prev, value_next = seg_values[ids - 1], seg_values[ids]
+        grid_values = value_prev + (value_next - value_prev)*(grid_t - t_prev)/(t_next - t_prev)
+
+        self.n_grid += len(grid_t)
+        self.t_last = seg_t[-1]
+        self.value_last = seg_values[-1]
+        return grid_values
+
+    def get_last_grid_time(self):
+        return self.t_first + self.dt*(self.n_grid - 1)
+
+class SlidingSpectrum:
+
+    def __init__(self, n_samples, fs):
+        '''
+        Sliding DFT over the last n_samples of a uniformly sampled signal at fs Hz
+        Each update costs O(n_samples/2), and get_psd returns the same one-sided spectrum as
+        signal.periodogram(x, fs, window='hann', detrend='linear') over the window:
+            - The Hann window is applied in the frequency domain, as a 3 tap convolution of the bins
+            - The linear trend is fitted from running sums of x and n*x, and its windowed DFT subtracted
+        The bins are recomputed with an FFT every n_samples updates, to bound floating point drift
+        '''
+        self.N = n_samples
+        self.fs = fs
+        self.freqs = np.arange(n_samples//2 + 1)*fs/n_samples
+        n_bins = len(self.freqs)
+        self.twiddle = np.exp(2j*np.pi*np.arange(n_bins)/n_samples)
+
+        # Windowed DFT of the constant and ramp components of a linear trend
+        n = np.arange(n_samples)
+        window = 0.5 - 0.5*np.cos(2*np.pi*n/n_samples) # Periodic Hann, as scipy's get_window
+        self.window_dft_const = np.fft.rfft(window)
+        self.window_dft_ramp = np.fft.rfft(window*n)
+        self.sum_n = n_samples*(n_samples - 1)/2
+        self.sum_nn = (n_samples - 1)*n_samples*(2*n_samples - 1)/6
+
+        self.reset()
+
+    def reset(self):
+        self.x = np.zeros(self.N) # Circular buffer of the window
+        self.head = 0
+        self.n_updates = 0
+        self.dft = np.zeros(len(self.freqs), dtype=complex)
+        self.sum_x = 0.0 # sum of x[n]
+        self.sum_nx = 0.0 # sum of n*x[n], n=0 is the oldest sample
+
+    def is_full(self):
+        return self.n_updates >= self.N
+
+    def update(self, value):
+        '''
+        Slides the window by one sample
+        '''
+        value_old = self.x[self.head]
+        self.x[self.head] = value
+        self.head = (self.head + 1) % self.N
+        self.n_updates += 1
+
+        if self.head == 0:
+            self._resync()
+            return
+        self.dft = (self.dft - value_old + value)*self.twiddle
+        self.sum_nx += (self.N - 1)*value - self.sum_x + value_old
+        self.sum_x += value - value_old
+
+    def _resync(self):
+        x = np.roll(self.x, -self.head)
+        self.dft = np.fft.rfft(x)
+        self.sum_x = np.sum(x)
+        self.sum_nx = np.dot(np.arange(self.N), x)
+
+    def get_psd(self):
+        '''
+        Returns frequencies and power spectral density of the window, normalised to sum to 1
+        '''
+        # Linear trend x ~ a + b*n
+        slope = (self.N*self.sum_nx - self.sum_n*self.sum_x)/(self.N*self.sum_nn - self.sum_n**2)
+        intercept = (self.sum_x - slope*self.sum_n)/self.N
+
+        # Bins -1 and N/2+1 mirror existing bins, for the window convolution
+        dft_ext = np.concatenate(([np.conj(self.dft[1])], self.dft, [np.conj(self.dft[self.N - len(self.freqs)])]))
+        dft_windowed = 0.5*self.dft - 0.25*(dft_ext[:-2] + dft_ext[2:])
+        dft_windowed -= intercept*self.window_dft_const + slope*self.window_dft_ramp
+
+        psd = np.abs(dft_windowed)**2
+        psd[1:] *= 2 # One sided
+        if self.N % 2 == 0:
+            psd[-1] /= 2 # Nyquist bin is not doubled
+        return (self.freqs, psd/np.sum(psd))
@@ -0,0 +1,186 @@
+import os
+import heapq
+import bisect
+import shutil
+import tempfile
+import weakref
+import numpy as np
+from .HistoryBuffer import HistoryBuffer
+
+class TieredHistoryBuffer(HistoryBuffer):
+
+    CHUNK_SIZE = 4096 # Samples per chunk file, 64 kB
+
+    def __init__(self, buffer_size, spill_dir=None, name='history'):
+        '''
+        HistoryBuffer which keeps every sample of a session: the latest buffer_size in memory as before,
+        and the older ones in chunks of CHUNK_SIZE samples on disk, read back by memory mapping
+        Samples leaving the buffer wait in memory until they fill a chunk, so memory is bounded by buffer_size + CHUNK_SIZE
+        samples, and a few markers per chunk, however long the session
+        Markers are kept by sample number from add_marker, and go with their samples as they leave the buffer,
+        so none is lost to the marker ring of the buffer however many are added
+        The chunks are written to a new directory in spill_dir, or the system temporary directory if None,
+        which is removed when the buffer is garbage collected, or at exit
+        get_id_range, get_range and get_sub_buffer span every sample, the rest of the methods only the buffer
+        '''
+        super().__init__(buffer_size)
+        self.spill_dir = spill_dir
+        self.name = name
+        self._directory = None # Created with the first chunk
+        self._remove_directory = None
+
+        self._spill_times = np.empty(self.CHUNK_SIZE) # Samples that left the buffer, waiting for a chunk
+        self._spill_values = np.empty(self.CHUNK_SIZE)
+        self._n_spilled = 0 # Samples that left the buffer, in chunks and waiting, sample numbers below are not in it
+        self._chunk_paths = []
+        self._chunk_t_last = [] # Time of the last sample of each chunk, for finding chunks by time
+        self._marker_ids_in_memory = [] # Heap of the sample numbers of the markers of the samples in the buffer
+        self._spill_marker_ids = [] # Sample numbers of the markers of the samples waiting for a chunk
+        self._chunk_marker_ids = [] # Sample numbers of the markers of each chunk
+        self._cached_chunk = (None, None) # Index and array of the last chunk read
+
+    def update(self, new_time, new_value):
+        if self._n_updates >= self.buffer_size:
+            i = self._head # The oldest sample, about to be overwritten
+            j = self._n_spilled % self.CHUNK_SIZE
+            self._spill_times[j] = self._times[i]
+            self._spill_values[j] = self._values[i]
+            self._n_spilled += 1
+            self._spill_markers()
+            if j == self.CHUNK_SIZE - 1:
+                self._seal_chunk()
+        super().update(new_time, new_value)
+
+    def extend(self, new_times, new_values):
+        n_new = len(new_values)
+        n_filled = min(self._n_updates, self.buffer_size)
+        n_evicted = max(0, min(n_new, self.buffer_size) - (self.buffer_size - n_filled))
+        i_filled = self.buffer_size - n_filled
+        self._spill(self.times[i_filled:i_filled + n_evicted], self.values[i_filled:i_filled + n_evicted])
+        n_dropped = max(0, n_new - self.buffer_size) # New samples that pass straight through the buffer
+        self._spill(np.asarray(new_times[:n_dropped], dtype=float), np.asarray(new_values[:n_dropped], dtype=float))
+        super().extend(new_times, new_values)
+
+    def _spill(self, times, values):
+        '''
+        Adds samples that left the buffer, oldest first, sealing chunks as they fill
+        '''
+        i = 0
+        while i < len(values):
+            j = self._n_spilled % self.CHUNK_SIZE
+            n = min(len(values) - i, self.CHUNK_SIZE - j)
+            self._spill_times[j:j + n] = times[i:i + n]
+            self._spill_values[j:j + n] = values[i:i + n]
+            self._n_spilled += n
+            i += n
+            self._spill_markers()
+            if j + n == self.CHUNK_SIZE:
+                self._seal_chunk()
+
+    def add_marker(self, index):
+        super().add_marker(index)
+        heapq.heappush(self._marker_ids_in_memory, self._n_updates - self.buffer_size + index % self.buffer_size)
+
+    def _spill_markers(self):
+        '''
+        Moves the markers of the samples that left the buffer to those waiting for a chunk
+        '''
+        while self._marker_ids_in_memory and self._marker_ids_in_memory[0] < self._n_spilled:
+            self._spill_marker_ids.append(heapq.heappop(self._marker_ids_in_memory))
+
+    def _seal_chunk(self):
+        '''
+        Writes the full chunk of spilled samples to disk, with the markers on its samples
+        '''
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix=f"{self.name}-", dir=self.spill_dir)
+            self._remove_directory = weakref.finalize(self, shutil.rmtree, self._directory, ignore_errors=True)
+        path = os.path.join(self._directory, f"{len(self._chunk_paths):06d}.npy")
+        np.save(path, np.column_stack((self._spill_times, self._spill_values)))
+        self._chunk_paths.append(path)
+        self._chunk_t_last.append(self._spill_times[-1])
+
+        self._chunk_marker_ids.append(np.unique(np.array(self._spill_marker_ids, dtype=np.int64)))
+        self._spill_marker_ids = []
+
+    def _read_chunk(self, k):
+        '''
+        Returns chunk k as a memory mapped array of rows (t, value)
+        '''
+        if self._cached_chunk[0] != k:
+            self._cached_chunk = (k, np.load(self._chunk_paths[k], mmap_mode='r'))
+        return self._cached_chunk[1]
+
+    def n_total(self):
+        '''
+        Returns the number of samples ever added, in memory and on disk
+        '''
+        return self._n_updates
+
+    def _count_before(self, t, side):
+        '''
+        Returns the number of samples with times before t, or t and before if side is 'right', as np.searchsorted
+        '''
+        search = bisect.bisect_left if side == 'left' else bisect.bisect_right
+        k = search(self._chunk_t_last, t) # First chunk that may end after t
+        if k < len(self._chunk_paths):
+            return k*self.CHUNK_SIZE + int(np.searchsorted(self._read_chunk(k)[:, 0], t, side))
+
+        n_sealed = len(self._chunk_paths)*self.CHUNK_SIZE
+        n = n_sealed + int(np.searchsorted(self._spill_times[:self._n_spilled - n_sealed], t, side))
+        if n < self._n_spilled:
+            return n
+        i_filled = self.buffer_size - min(self._n_updates, self.buffer_size)
+        return n + int(np.searchsorted(self.times[i_filled:], t, side))
+
+    def get_id_range(self, t_start, t_end, include_start=True):
+        '''
+        Returns the start and end sample numbers, counted from the first sample, of the samples
+        with t_start <= t <= t_end, or t_start < t <= t_end if include_start is False
+        '''
+        id_start = self._count_before(t_start, 'left' if include_start else 'right')
+        return (id_start, max(id_start, self._count_before(t_end, 'right')))
+
+    def get_by_ids(self, id_start, id_end):
+        '''
+        Returns arrays (times, values) of the samples numbered id_start to id_end, from disk and memory
+        '''
+        parts = []
+        n_sealed = len(self._chunk_paths)*self.CHUNK_SIZE
+        i = id_start
+        while i < min(id_end, n_sealed):
+            k = i//self.CHUNK_SIZE
+            i_next = min(id_end, (k + 1)*self.CHUNK_SIZE)
+            parts.append(self._read_chunk(k)[i - k*self.CHUNK_SIZE:i_next - k*self.CHUNK_SIZE])
+            i = i_next
+        if i < min(id_end, self._n_spilled):
+            i_next = min(id_end, self._n_spilled)
+            parts.append(np.column_stack((self._spill_times[i - n_sealed:i_next - n_sealed], self._spill_values[i - n_sealed:i_next - n_sealed])))
+            i = i_next
+        if i < id_end:
+            i_window = i - (self._n_updates - self.buffer_size) # Index into times/values
+            i_window_end = id_end - (self._n_updates - self.buffer_size)
+            parts.append(np.column_stack((self.times[i_window:i_window_end], self.values[i_window:i_window_end])))
+
+        data = np.concatenate(parts) if parts else np.empty((0, 2))
+        return (data[:, 0].copy(), data[:, 1].copy())
+
+    def get_range(self, t_start, t_end, include_start=True):
+        '''
+        Returns arrays (times, values) of the samples with t_start <= t <= t_end,
+        or t_start < t <= t_end if include_start is False, from disk and memory
+        '''
+        return self.get_by_ids(*self.get_id_range(t_start, t_end, include_start))
+
+    def get_sub_buffer(self, t_start, t_end):
+        '''
+        Returns a new HistoryBuffer instance with values and times between t_start and t_end, from disk and memory
+        '''
+        id_start, id_end = self.get_id_range(t_start, t_end)
+        times, values = self.get_by_ids(id_start, id_end)
+
+        marker_ids = np.array(self._spill_marker_ids + self._marker_ids_in_memory, dtype=np.int64)
+        marker_ids = np.unique(np.concatenate(self._chunk_marker_ids + [marker_ids]))
+        sub_markers = marker_ids[(marker_ids >= id_start) & (marker_ids < id_end)] - id_start
+
+        return HistoryBuffer.from_arrays(times, values, sub_markers)
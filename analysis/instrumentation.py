@@ -0,0 +1,156 @@
+'''
+Opt-in timing and latency telemetry of the hot paths
+Enabled by setting the environment variable EBYT_INSTRUMENT=1 before the instrumented modules are imported,
+which EBYT.py --instrument does. When disabled, timed and timer_slot return the functions unchanged,
+and call sites guard record and count with ENABLED, so the cost is one attribute check at most.
+
+Values are kept in log-scale histograms, times in ms. Each process dumps its own statistics to JSON at exit,
+EBYT_INSTRUMENT_OUTPUT (default instrumentation.json), with the process name added for worker processes.
+The analysis worker also sends its statistics to the main process every second, for the overlay of the View.
+Part of the analysis package, which has no Qt, so the analysers can be timed wherever the package is used.
+AnalysisWorker.queue_depth is only recorded with a worker, as without one the samples are not queued.
+'''
+import os
+import math
+import time
+import json
+import atexit
+import functools
+import multiprocessing
+
+ENABLED = os.environ.get('EBYT_INSTRUMENT', '') not in ('', '0')
+OUTPUT_PATH = os.environ.get('EBYT_INSTRUMENT_OUTPUT', 'instrumentation.json')
+TIMER_OVERRUN_FACTOR = 1.5 # A timer tick later than this many periods after the previous one counts as an overrun
+
+class Histogram:
+
+    BUCKETS_PER_OCTAVE = 4 # Bucket edges are 2**(i/4), about 19% apart
+
+    def __init__(self):
+        self.counts = {} # Bucket index: count, values <= 0 are in bucket None
+        self.n = 0
+        self.total = 0.0
+        self.max = -math.inf
+
+    def add(self, value):
+        bucket = math.floor(math.log2(value)*self.BUCKETS_PER_OCTAVE) if value > 0 else None
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.n += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        '''
+        Returns the upper edge of the bucket holding the q-th percentile, at most the maximum value
+        '''
+        if self.n == 0:
+            return math.nan
+        n_below = self.counts.get(None, 0)
+        if n_below >= q/100*self.n:
+            return 0.0
+        for bucket in sorted(key for key in self.counts if key is not None):
+            n_below += self.counts[bucket]
+            if n_below >= q/100*self.n:
+                return min(2**((bucket + 1)/self.BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'n': self.n,
+            'mean': self.total/self.n if self.n else math.nan,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max if self.n else math.nan,
+            'buckets': {('<=0' if bucket is None else f'{2**(bucket/self.BUCKETS_PER_OCTAVE):.4g}'): count
+                        for bucket, count in sorted(self.counts.items(), key=lambda item: -math.inf if item[0] is None else item[0])}
+        }
+
+histograms = {}
+counters = {}
+
+def record(name, value):
+    '''
+    Adds value to the histogram name
+    '''
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.add(value)
+
+def count(name, n=1):
+    counters[name] = counters.get(name, 0) + n
+
+def timed(name):
+    '''
+    Decorator recording the duration of each call of a function in ms, under name
+    '''
+    def decorator(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            t_start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, 1e3*(time.perf_counter() - t_start))
+        return wrapper
+    return decorator
+
+def timer_slot(name, slot, period):
+    '''
+    Returns slot for connecting to a QTimer of period ms, recording the duration of each call under name,
+    and counting overruns, ticks that came more than TIMER_OVERRUN_FACTOR periods after the previous one
+    '''
+    if not ENABLED:
+        return slot
+
+    t_last_call = None
+    slot = timed(name)(slot)
+
+    def wrapper():
+        nonlocal t_last_call
+        t_call = time.perf_counter()
+        if t_last_call is not None and 1e3*(t_call - t_last_call) > TIMER_OVERRUN_FACTOR*period:
+            count(f'{name}.overruns')
+        t_last_call = t_call
+        slot()
+    return wrapper
+
+def get_stats():
+    return {
+        'process': multiprocessing.current_process().name,
+        'histograms': {name: histogram.to_dict() for name, histogram in sorted(histograms.items())},
+        'counters': dict(sorted(counters.items()))
+    }
+
+def format_stats(stats=None):
+    '''
+    Returns the statistics as lines of text, one per histogram and counter
+    '''
+    stats = get_stats() if stats is None else stats
+    width = max([len(name) for name in stats['histograms']] + [len(name) for name in stats['counters']] + [4])
+    lines = [f"{'name':<{width}} {'n':>8} {'p50':>8} {'p99':>8} {'max':>8}"]
+    for name, histogram in stats['histograms'].items():
+        lines.append(f"{name:<{width}} {histogram['n']:>8} {histogram['p50']:>8.3g} {histogram['p99']:>8.3g} {histogram['max']:>8.3g}")
+    for name, value in stats['counters'].items():
+        lines.append(f"{name:<{width}} {value:>8}")
+    return '\n'.join(lines)
+
+def dump(path=None):
+    '''
+    Writes the statistics of this process to path as JSON, by default OUTPUT_PATH with the name of worker processes added
+    '''
+    if path is None:
+        path = OUTPUT_PATH
+        process_name = multiprocessing.current_process().name
+        if process_name != 'MainProcess':
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{process_name}{ext}"
+    with open(path, 'w') as file:
+        json.dump(get_stats(), file, indent=2)
+
+if ENABLED:
+    atexit.register(dump)
@@ -1,4 +1,27 @@
-
+import numpy as np
 
 def exp_moving_average(prev_mean, value, alpha):
-    return alpha*prev_mean + (1-alpha)*value
\ No newline at end of file
+    return alpha*prev_mean + (1-alpha)*value
+
+def project_onto_axis(acc, axis):
+    '''
+    Returns the component of acc (x,y,z) along axis, for a single sample or an array of samples
+    Written element-wise, so single samples and blocks of samples give bit-identical results
+    '''
+    return acc[..., 0]*axis[0] + acc[..., 1]*axis[1] + acc[..., 2]*axis[2]
+
+def calculate_peak_and_total_power(psd_freqs, psd_values):
+    '''
+    Returns the power around the peak of the power spectral density, and the total power
+    '''
+    # Interpolating the power spectral density, to get sub-bin integration
+    psd_freqs_interp = np.arange(psd_freqs[0], psd_freqs[-1], 0.005)
+    psd_interp = np.interp(psd_freqs_interp, psd_freqs, psd_values)
+
+    # Calculating total power and peak power
+    peak_freq = psd_freqs_interp[np.argmax(psd_interp)]
+    peak_indices = np.where((psd_freqs_interp >= peak_freq - 0.015) & (psd_freqs_interp <= peak_freq + 0.015)) # 0.03 Hz around the peak is recommended by R. McCraty
+    peak_power = np.trapz(psd_interp[peak_indices], psd_freqs_interp[peak_indices])
+    total_power = np.trapz(psd_interp, psd_freqs_interp)
+
+    return (peak_power, total_power)
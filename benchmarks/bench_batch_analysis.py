@@ -0,0 +1,87 @@
+'''
+Breath rows of the batch analysis, checked against the beats of each breath
+Records a synthetic session whose ibi stream drops out while the chest acc carries on, so some breaths have no beats,
+and runs it through analyse.py. Compares the rmssd, maxmin and sdnn of each row with calculate_breath_by_breath_metrics
+over the beats of that breath, which are nan for a breath without beats, and reports the analysis time
+
+Run from the repository root:
+    python -m benchmarks.bench_batch_analysis
+'''
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import analyse
+from analysis.HrvAnalyser import HrvAnalyser
+from recording import SessionRecorder
+from synthetic import generate_ibi, generate_chest_acc
+
+BREATH_METRICS = ['rmssd', 'maxmin', 'sdnn']
+
+def record_session(path, duration, dropout):
+    '''
+    Records duration s of synthetic samples in time order, without the beats in dropout (t_start, t_end)
+    '''
+    ibi = generate_ibi(duration)
+    ibi = ibi[(ibi[:, 0] < dropout[0]) | (ibi[:, 0] > dropout[1])]
+    acc = generate_chest_acc(duration)
+    recorder = SessionRecorder(path)
+    acc_splits = np.searchsorted(acc[:, 0], ibi[:, 0], side='right') # Acc samples up to each beat
+    i_acc = 0
+    for row, i_split in zip(ibi, acc_splits):
+        recorder.write_acc(acc[i_acc:i_split])
+        recorder.write_ibi(row)
+        i_acc = i_split
+    recorder.write_acc(acc[i_acc:])
+    recorder.close()
+
+def analyse_with_reference(session_path, output_dir):
+    '''
+    Returns the summary of analyse_session, and the reference metrics of each breath as t_end: (rmssd, maxmin, sdnn)
+    '''
+    reference = {}
+    update_breath_by_breath_metrics = HrvAnalyser.update_breath_by_breath_metrics
+    def record_reference(hrv_analyser, t_range):
+        metrics = hrv_analyser.calculate_breath_by_breath_metrics(t_range[0])
+        reference[t_range[1]] = (np.nan,)*len(BREATH_METRICS) if metrics is None else metrics
+        update_breath_by_breath_metrics(hrv_analyser, t_range)
+    HrvAnalyser.update_breath_by_breath_metrics = record_reference
+    try:
+        summary = analyse.analyse_session(session_path, output_dir)
+    finally:
+        HrvAnalyser.update_breath_by_breath_metrics = update_breath_by_breath_metrics
+    return summary, reference
+
+def main():
+    parser = argparse.ArgumentParser(description="Breath rows of the batch analysis, checked against the beats of each breath")
+    parser.add_argument('--duration', type=float, default=300, help="s of session")
+    parser.add_argument('--dropout', type=float, nargs=2, default=(120, 145), help="s of session without beats, start and end")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        session_path = os.path.join(directory, 'session')
+        record_session(session_path, args.duration, args.dropout)
+        t_start = time.perf_counter()
+        summary, reference = analyse_with_reference(session_path, directory)
+        duration = time.perf_counter() - t_start
+        rows = np.loadtxt(os.path.join(directory, 'session.csv'), delimiter=',', skiprows=1, ndmin=2)
+
+    columns = [analyse.BREATH_COLUMNS.index(metric) for metric in BREATH_METRICS]
+    t_ends = rows[:, analyse.BREATH_COLUMNS.index('t_end')]
+    expected = np.array([reference[t_end] for t_end in t_ends])
+    is_matching = np.all(np.isclose(rows[:, columns], expected, equal_nan=True), axis=1)
+    n_without_beats = np.count_nonzero(np.all(np.isnan(expected), axis=1))
+
+    print(f"{args.duration:.0f} s session, no beats from {args.dropout[0]:.0f} to {args.dropout[1]:.0f} s")
+    print(f"analysed in {duration:.2f} s, {summary['n_breaths']} breaths, {n_without_beats} without beats")
+    print(f"{np.count_nonzero(~is_matching)} rows differing from the beats of their breath")
+    for row in rows[~is_matching]:
+        print(f"  breath ending at {row[1]:.1f} s: {', '.join(f'{metric} {row[i]:.2f}' for metric, i in zip(BREATH_METRICS, columns))}, "
+              f"expected {', '.join(f'{value:.2f}' for value in reference[row[1]])}")
+    assert len(rows) == len(reference), "A breath has no row"
+    assert n_without_beats > 0, "No breath without beats, lengthen the dropout"
+    assert np.all(is_matching), "A row has the metrics of another breath"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+'''
+Frame cost of the pacer and breathing circles
+Times the update of both circles, as View.plot_circles does every 10 ms, followed by a paint of the widget.
+Uses the update_pacer_series and update_breath_series methods, so it runs against any version of CirclesWidget.
+Runs offscreen, so absolute times are for software rendering
+
+Run from the repository root:
+    python -m benchmarks.bench_circles
+'''
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import sys
+import argparse
+import numpy as np
+from PySide6.QtWidgets import QApplication
+from benchmarks.utils import measure
+from styles.colours import GOLD, BLUE, RED
+
+def get_circle_coords(radius, n_points=40):
+    theta = np.linspace(0, 2*np.pi, n_points)
+    return (radius*np.cos(theta), radius*np.sin(theta))
+
+def update_circles(widget, pacer_coords, breath_coords):
+    widget.update_pacer_series(*pacer_coords)
+    widget.update_breath_series(*breath_coords)
+
+def render_frame(widget, pacer_coords, breath_coords):
+    update_circles(widget, pacer_coords, breath_coords)
+    widget.grab()
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame cost of the pacer and breathing circles")
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=200, help="widget side in pixels")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    from views.widgets import CirclesWidget
+    widget = CirclesWidget(*get_circle_coords(0.5), GOLD, BLUE, RED)
+    widget.resize(args.size, args.size)
+    widget.show()
+    app.processEvents()
+
+    phases = 2*np.pi*np.arange(args.frames)/args.frames
+    frames = [(widget, get_circle_coords(0.5 + 0.5*np.sin(phase)), get_circle_coords(0.5 + 0.4*np.cos(phase))) for phase in phases]
+    update = measure(update_circles, frames, warmup=10)
+    frame = measure(render_frame, frames, warmup=10)
+    print(f"{'update p50 us':>14} {'update p90 us':>14} {'frame p50 us':>13} {'frame p90 us':>13}")
+    print(f"{update['p50_us']:>14.1f} {update['p90_us']:>14.1f} {frame['p50_us']:>13.1f} {frame['p90_us']:>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+'''
+Residual timestamp error of the clock alignment against a simulated drifting sensor clock
+Simulates a sensor whose clock runs fast by --drift-ppm, delivering acc frames and ibi notifications over a link
+with random delays and occasional batching of packets. Times are passed through Model.align_acc and Model.align_ibi,
+and compared with the true host times of the samples, as are the times the sensor client gives without alignment:
+acc on the sensor clock from an offset fixed at the first frame, and ibi at the arrival time of their notification
+
+Run from the repository root:
+    python -m benchmarks.bench_clock_alignment
+'''
+import argparse
+import numpy as np
+from Model import Model
+from benchmarks.utils import measure
+
+ACC_RATE = 200 # Hz
+ACC_FRAME_SIZE = 36 # samples per packet
+LATENCY_MIN = 0.015 # s
+LATENCY_MEAN_EXTRA = 0.02 # s, exponential
+BATCH_PROBABILITY = 0.05 # Probability that a packet is held back and delivered with the next one
+
+def get_arrival_times(send_times, rng):
+    '''
+    Returns the arrival times of packets sent at send_times, in order
+    '''
+    arrivals = send_times + LATENCY_MIN + rng.exponential(LATENCY_MEAN_EXTRA, len(send_times))
+    is_held = rng.random(len(send_times)) < BATCH_PROBABILITY
+    for i in range(len(arrivals) - 2, -1, -1):
+        if is_held[i]:
+            arrivals[i] = arrivals[i + 1]
+    return np.maximum.accumulate(arrivals)
+
+def simulate(duration, drift, rng):
+    '''
+    Returns acc and ibi packets, as lists of (arrival time, sensor times, true times)
+    Ibi packets hold the beats since the previous notification, sent once a second as heart rate sensors do
+    '''
+    sensor_offset = 1000.0 # s, the sensor clock starts elsewhere
+    true_acc_times = np.arange(0, duration, 1/ACC_RATE)
+    acc_frames = [true_acc_times[i:i + ACC_FRAME_SIZE] for i in range(0, len(true_acc_times) - ACC_FRAME_SIZE + 1, ACC_FRAME_SIZE)]
+    acc_arrivals = get_arrival_times(np.array([frame[-1] for frame in acc_frames]), rng)
+    acc_packets = [(t_arrival, frame*(1 + drift) + sensor_offset, frame) for t_arrival, frame in zip(acc_arrivals, acc_frames)]
+
+    beat_times = np.cumsum(60/65 + 0.05*rng.standard_normal(int(duration)))
+    beat_times = beat_times[beat_times < duration]
+    notify_times = np.arange(1, duration + 1)
+    ibi_arrivals = get_arrival_times(notify_times.astype(float), rng)
+    ibi_packets = []
+    beat_ids = np.searchsorted(beat_times, notify_times) # Beats before each notification
+    for i in range(1, len(notify_times)):
+        beats = np.arange(max(beat_ids[i - 1], 1), beat_ids[i])
+        if len(beats):
+            ibis = 1000*(beat_times[beats] - beat_times[beats - 1])*(1 + drift) # Measured on the sensor clock
+            ibi_packets.append((ibi_arrivals[i], ibis, beat_times[beats]))
+    return (acc_packets, ibi_packets)
+
+def get_error_stats(errors):
+    errors = 1e3*np.asarray(errors)
+    return {
+        'mean_ms': np.mean(errors),
+        'std_ms': np.std(errors),
+        'p99_abs_ms': np.percentile(np.abs(errors), 99),
+        'max_abs_ms': np.max(np.abs(errors))
+    }
+
+def run(duration, drift, seed):
+    rng = np.random.default_rng(seed)
+    acc_packets, ibi_packets = simulate(duration, drift, rng)
+    model = Model(align_clocks=True)
+    errors = {'acc unaligned': [], 'acc aligned': [], 'ibi unaligned': [], 'ibi aligned': []}
+
+    polar_to_host = acc_packets[0][0] - acc_packets[0][1][-1] # Offset fixed at the first frame, as the sensor client does
+    for t_arrival, sensor_times, true_times in acc_packets:
+        errors['acc unaligned'].extend(sensor_times + polar_to_host - true_times)
+        for t_sensor, t_true in zip(sensor_times, true_times): # The sensor client calls back once per sample
+            errors['acc aligned'].append(model.align_acc((t_sensor, 0, 0, 1), t_arrival)[0] - t_true)
+
+    for t_arrival, ibis, true_times in ibi_packets:
+        for ibi, t_true in zip(ibis, true_times):
+            errors['ibi unaligned'].append(t_arrival - t_true)
+            errors['ibi aligned'].append(model.align_ibi((t_arrival, ibi), t_arrival)[0] - t_true)
+
+    results = {name: get_error_stats(values) for name, values in errors.items()}
+    t_sensor, t_arrival = acc_packets[-1][1][-1], acc_packets[-1][0]
+    results['align acc sample'] = measure(model.align_acc, [((t_sensor + i/ACC_RATE, 0, 0, 1), t_arrival + i/ACC_RATE) for i in range(10000)])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Residual error of clock alignment with a simulated drifting sensor clock")
+    parser.add_argument('--duration', type=float, default=1800, help="s of simulated session")
+    parser.add_argument('--drift-ppm', type=float, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run(args.duration, args.drift_ppm*1e-6, args.seed)
+    print(f"{args.duration:.0f} s session, sensor clock {args.drift_ppm:+.0f} ppm, errors against true sample times:")
+    print(f"{'timestamps':<16} {'mean ms':>9} {'std ms':>9} {'p99 |e| ms':>11} {'max |e| ms':>11}")
+    for name, stats in results.items():
+        if 'mean_ms' in stats:
+            print(f"{name:<16} {stats['mean_ms']:>9.2f} {stats['std_ms']:>9.2f} {stats['p99_abs_ms']:>11.2f} {stats['max_abs_ms']:>11.2f}")
+    print(f"Model.align_acc per sample: p50 {results['align acc sample']['p50_us']:.1f} us")
+
+if __name__ == "__main__":
+    main()
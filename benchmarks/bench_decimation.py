@@ -0,0 +1,73 @@
+'''
+GUI frame time of the breathing chart with and without decimation
+Fills the chest acc history and starts the pacer in the past, then times update_acc_series followed by a full render of the View,
+for each decimation method. Runs offscreen, so absolute times are for software rendering
+
+Run from the repository root:
+    python -m benchmarks.bench_decimation
+'''
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import sys
+import time
+import argparse
+from PySide6.QtWidgets import QApplication
+from Pacer import Pacer
+from synthetic import generate_ibi, generate_chest_acc
+from benchmarks.utils import measure
+
+def fill_view(view, duration):
+    '''
+    Sends duration seconds of beats and chest acc ending now to the analysis, and starts the pacer duration seconds ago
+    The samples skip the clock alignment of the model callbacks, as they all arrive at once
+    '''
+    t_now = time.time()
+    for ibi in generate_ibi(duration, t_start=t_now - duration):
+        view.model.analysis.update_ibi(ibi)
+    acc = generate_chest_acc(duration, t_start=t_now - duration, sample_rate=10)
+    view.model.analysis.update_acc(acc) # One frame, handled by the block path
+    while view.model.get_snapshot()['chest_acc_history'].n_values() < min(len(acc), 10000):
+        time.sleep(0.05)
+
+    view.model.pacer = Pacer()
+    view.model.pacer.breathing_pattern(view.pacer_rate, t_now - duration)
+
+def redraw_acc_series(view):
+    view.drawn_versions.clear() # Unchanged series are otherwise not redrawn
+    view.update_acc_series()
+
+def render_frame(view):
+    redraw_acc_series(view)
+    view.grab() # Paints the whole widget tree
+
+def main():
+    parser = argparse.ArgumentParser(description="GUI frame time with and without decimation")
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--width', type=int, default=1200)
+    parser.add_argument('--height', type=int, default=600)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    from View import View
+    view = View()
+    view.resize(args.width, args.height)
+    view.show()
+    while not view.is_charts_created.is_set(): # The charts are created after the first paint
+        app.processEvents()
+    view.update_acc_series_timer.stop() # Frames are rendered only by the benchmark
+    view.update_series_timer.stop()
+    view.pacer_timer.stop()
+    fill_view(view, 1000)
+
+    print(f"{'decimation':>10} {'acc points':>11} {'pacer points':>13} {'update ms':>10} {'frame p50 ms':>13} {'frame p90 ms':>13}")
+    for method in (None, 'minmax', 'lttb'):
+        view.decimation = method
+        update = measure(redraw_acc_series, [(view,)]*args.frames, warmup=3)
+        frame = measure(render_frame, [(view,)]*args.frames, warmup=3)
+        print(f"{method or 'off':>10} {view.series_breath_acc.count():>11} {view.series_pacer.count():>13} "
+              f"{update['p50_us']/1e3:>10.2f} {frame['p50_us']/1e3:>13.2f} {frame['p90_us']/1e3:>13.2f}")
+    view.model.close()
+
+if __name__ == "__main__":
+    main()
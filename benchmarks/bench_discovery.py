@@ -0,0 +1,102 @@
+'''
+Time to first device when scanning for sensors
+Runs SensorHandler.scan against a fake scanner backend, which delivers scripted advertisements at set times,
+and reports the time from the start of the scan to device_found for the supported device:
+    window: the previous scan, BleakScanner.discover for a whole scan window, then the supported devices
+    streaming: scan, emitting each supported device on its first advertisement
+    cached: scan with the device in the device cache from an earlier connection
+No Bluetooth adapter is used
+
+Run from the repository root:
+    python -m benchmarks.bench_discovery
+'''
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from bleak import BLEDevice
+from blehrm import blehrm
+from sensor import SensorHandler
+
+DISCOVER_TIMEOUT = 5.0 # s, default of BleakScanner.discover
+
+class FakeScanner:
+
+    def __init__(self, detection_callback, advertisements):
+        '''
+        Scanner calling detection_callback(device, None) for each (s after start, BLEDevice) in advertisements
+        '''
+        self.detection_callback = detection_callback
+        self.advertisements = advertisements
+        self.handles = []
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.handles = [loop.call_later(t, self.detection_callback, device, None) for t, device in self.advertisements]
+
+    async def stop(self):
+        for handle in self.handles:
+            handle.cancel()
+
+    async def discover(self, timeout=DISCOVER_TIMEOUT):
+        devices = {}
+        self.detection_callback = lambda device, advertisement_data: devices.setdefault(device.address, device)
+        await self.start()
+        await asyncio.sleep(timeout)
+        await self.stop()
+        return list(devices.values())
+
+def get_advertisements(t_device):
+    '''
+    Returns advertisements of a few unsupported devices, and of a strap first advertising at t_device s
+    '''
+    strap = BLEDevice('A0:9E:1A:00:00:01', 'Polar H10 0000001', None)
+    others = [BLEDevice(f'00:00:00:00:00:0{i}', name, None) for i, name in enumerate(['Phone', 'Watch', None])]
+    return [(0.01 + 0.02*i, device) for i, device in enumerate(others)] + [(t_device, strap), (t_device + 1.0, strap)]
+
+async def time_window_scan(advertisements):
+    '''
+    Returns s to the first supported device with the scan loop before streaming
+    '''
+    t_start = time.perf_counter()
+    while True:
+        ble_devices = await FakeScanner(None, advertisements).discover()
+        if blehrm.get_supported_devices(ble_devices):
+            return time.perf_counter() - t_start
+        await asyncio.sleep(1)
+
+async def time_streaming_scan(advertisements, cache_path):
+    '''
+    Returns s to the first device_found of SensorHandler.scan
+    '''
+    handler = SensorHandler(scanner_factory=lambda callback: FakeScanner(callback, advertisements), cache_path=cache_path)
+    t_found = []
+    handler.device_found.connect(lambda name: t_found.append(time.perf_counter()))
+    handler.device_found.connect(lambda name: handler.stop_scan())
+    t_start = time.perf_counter()
+    await handler.scan()
+    return t_found[0] - t_start, handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first device when scanning for sensors")
+    parser.add_argument('--advertise-at', type=float, default=0.5, help="s from the start of the scan to the first advertisement of the strap")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    advertisements = get_advertisements(args.advertise_at)
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, 'devices.json')
+        results = {'window': asyncio.run(time_window_scan(advertisements))}
+        results['streaming'], handler = asyncio.run(time_streaming_scan(advertisements, cache_path))
+        handler.remember_device(handler.get_valid_device_names()[0]) # As after connecting
+        results['cached'], _ = asyncio.run(time_streaming_scan(advertisements, cache_path))
+
+    print(f"strap advertising {args.advertise_at:.2f} s after the start of the scan")
+    print(f"{'scan':>10} {'first device ms':>16}")
+    for name, t in results.items():
+        print(f"{name:>10} {1e3*t:>16.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+'''
+Load test of GroupModel: ingests synthetic sessions from N simulated sensors concurrently on one asyncio loop,
+as fast as possible, and reports throughput and cost per sample as N grows
+Ingestion scales linearly when the cost per sample stays flat
+
+Run from the repository root:
+    python -m benchmarks.bench_group_model --sensors 1 10 30 50
+'''
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+import warnings
+from GroupModel import GroupModel
+from replay import ReplayClient
+from synthetic import generate_ibi, generate_chest_acc
+
+T_START = 1.7e9 # Epoch s of the simulated sessions
+
+def create_clients(n_sensors, duration, acc_sample_rate):
+    '''
+    Simulated sensors breathing at 6 breaths per minute in phase, with independent noise
+    '''
+    clients = []
+    for i in range(n_sensors):
+        ibi = generate_ibi(duration, t_start=T_START, mean_hr=60 + i % 20, seed=i)
+        acc = generate_chest_acc(duration, t_start=T_START, sample_rate=acc_sample_rate, seed=i)
+        clients.append(ReplayClient(ibi, acc, name=f"Simulated {i}"))
+    return clients
+
+async def run_group(clients):
+    group = GroupModel()
+    t_start = time.perf_counter()
+    await group.add_sensors(clients)
+    await asyncio.gather(*(client.wait_until_done() for client in clients))
+    t_ingest = time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    metrics = group.get_group_metrics()
+    t_metrics = time.perf_counter() - t_start
+    return t_ingest, t_metrics, metrics
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of GroupModel with simulated sensors")
+    parser.add_argument('--sensors', type=int, nargs='+', default=[1, 5, 10, 20, 30, 50], help="group sizes to test")
+    parser.add_argument('--duration', type=float, default=120, help="s of signal per sensor")
+    parser.add_argument('--acc-rate', type=float, default=50, help="Hz, accelerometer sample rate per sensor")
+    args = parser.parse_args()
+
+    print(f"{args.duration:.0f} s per sensor, acc at {args.acc_rate:.0f} Hz")
+    print(f"{'sensors':>8} {'samples':>9} {'ingest s':>9} {'samples/s':>10} {'us/sample':>10} {'x realtime':>11} {'metrics ms':>11} {'coherence':>10} {'synchrony':>10}")
+    for n_sensors in args.sensors:
+        clients = create_clients(n_sensors, args.duration, args.acc_rate)
+        n_samples = sum(len(client.ibi) + len(client.acc) for client in clients)
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()): # HrvAnalyser prints rejected values
+            warnings.simplefilter('ignore', DeprecationWarning)
+            t_ingest, t_metrics, metrics = asyncio.run(run_group(clients))
+
+        realtime_factor = args.duration/t_ingest # Whole group ingested this many times faster than real time
+        print(f"{n_sensors:>8} {n_samples:>9} {t_ingest:>9.2f} {n_samples/t_ingest:>10.0f} {1e6*t_ingest/n_samples:>10.1f} "
+              f"{realtime_factor:>11.1f} {1e3*t_metrics:>11.2f} {metrics['mean_coherence']:>10.2f} {metrics['breathing_synchrony']:>10.3f}")
+
+if __name__ == "__main__":
+    main()
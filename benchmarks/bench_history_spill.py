@@ -0,0 +1,66 @@
+'''
+Memory and cost of keeping whole sessions in TieredHistoryBuffer
+Runs a long synthetic session through AnalysisPipeline, and reports the memory allocated by Python and numpy
+(tracemalloc) as the session grows, with the samples on disk. Then times update against HistoryBuffer,
+and queries of a minute of chest acc from the start of the session, read back from disk
+
+Run from the repository root:
+    python -m benchmarks.bench_history_spill
+'''
+import argparse
+import contextlib
+import io
+import tracemalloc
+import numpy as np
+from analysis.AnalysisPipeline import AnalysisPipeline
+from analysis.HistoryBuffer import HistoryBuffer
+from analysis.TieredHistoryBuffer import TieredHistoryBuffer
+from synthetic import generate_ibi, generate_chest_acc
+from benchmarks.utils import measure
+
+REPORT_INTERVAL = 1800 # s of session between memory reports
+BLOCK_DURATION = 60 # s of samples generated at a time
+
+def run_session(duration, spill_dir):
+    '''
+    Returns the pipeline after duration s of session, and the memory allocated at each REPORT_INTERVAL
+    '''
+    pipeline = AnalysisPipeline(spill_dir=spill_dir)
+    memory = []
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()): # HrvAnalyser prints rejected values
+        for t_start in np.arange(0, duration, BLOCK_DURATION):
+            for row in generate_ibi(BLOCK_DURATION, t_start=t_start, seed=int(t_start)):
+                pipeline.update_ibi(row)
+            pipeline.update_acc_block(generate_chest_acc(BLOCK_DURATION, t_start=t_start, seed=int(t_start)))
+            if (t_start + BLOCK_DURATION) % REPORT_INTERVAL == 0:
+                memory.append((t_start + BLOCK_DURATION, tracemalloc.get_traced_memory()[0]))
+    tracemalloc.stop()
+    return pipeline, memory
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and cost of whole session histories")
+    parser.add_argument('--duration', type=float, default=3*3600, help="s of synthetic session")
+    parser.add_argument('--spill-dir', help="directory for the chunks, the system temporary directory by default")
+    args = parser.parse_args()
+
+    pipeline, memory = run_session(args.duration, args.spill_dir)
+    history = pipeline.breath_analyser.chest_acc_history
+    print(f"{'session min':>11} {'allocated MB':>13}")
+    for t, allocated in memory:
+        print(f"{t/60:>11.0f} {allocated/1e6:>13.2f}")
+    print(f"chest acc: {history.n_total()} samples, {history.buffer_size} in memory, {len(history._chunk_paths)} chunks on disk")
+
+    times = np.arange(20000, dtype=float)
+    for cls in (HistoryBuffer, TieredHistoryBuffer):
+        buffer = cls(10000)
+        stats = measure(buffer.update, [(t, t) for t in times])
+        print(f"{cls.__name__}.update: p50 {stats['p50_us']:.2f} us, p99 {stats['p99_us']:.2f} us")
+
+    t_first = history.get_by_ids(0, 1)[0][0]
+    ranges = [(t_first + t, t_first + t + 60) for t in np.linspace(0, 600, 200)]
+    stats = measure(history.get_range, ranges)
+    print(f"get_range of 60 s from disk: p50 {stats['p50_us']:.0f} us, p99 {stats['p99_us']:.0f} us")
+
+if __name__ == "__main__":
+    main()
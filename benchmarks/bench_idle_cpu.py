@@ -0,0 +1,54 @@
+'''
+CPU use of the View while no new data arrives
+Fills the histories, then runs the Qt event loop with its timers for a few seconds and reports the process CPU time
+as a fraction of wall time. Unchanged series are not redrawn, so what remains is the pacer animation and the
+scrolling of the time axes; --no-pacer stops the pacer timer to measure the charts alone.
+Runs offscreen, so absolute numbers are for software rendering
+
+Run from the repository root:
+    python -m benchmarks.bench_idle_cpu
+'''
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import sys
+import time
+import argparse
+from PySide6.QtCore import QTimer, QEventLoop
+from PySide6.QtWidgets import QApplication
+from benchmarks.bench_decimation import fill_view
+
+def run_event_loop(duration):
+    '''
+    Returns (wall time, process CPU time) of running the Qt event loop for duration seconds
+    '''
+    loop = QEventLoop()
+    QTimer.singleShot(int(duration*1000), loop.quit)
+    t_wall, t_cpu = time.perf_counter(), time.process_time()
+    loop.exec()
+    return (time.perf_counter() - t_wall, time.process_time() - t_cpu)
+
+def main():
+    parser = argparse.ArgumentParser(description="View CPU use without new data")
+    parser.add_argument('--duration', type=float, default=10, help="seconds of event loop to measure")
+    parser.add_argument('--no-pacer', action='store_true', help="stop the pacer animation")
+    parser.add_argument('--width', type=int, default=1200)
+    parser.add_argument('--height', type=int, default=600)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    from View import View
+    view = View()
+    view.resize(args.width, args.height)
+    view.show()
+    fill_view(view, 1000)
+    if args.no_pacer:
+        view.pacer_timer.stop()
+    run_event_loop(1) # Draws the filled histories, then nothing new arrives
+
+    t_wall, t_cpu = run_event_loop(args.duration)
+    print(f"pacer {'off' if args.no_pacer else 'on'}: {t_cpu:.2f} s CPU in {t_wall:.2f} s, {100*t_cpu/t_wall:.1f}% of one core")
+    view.model.close()
+
+if __name__ == "__main__":
+    main()
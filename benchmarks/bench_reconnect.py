@@ -0,0 +1,222 @@
+'''
+Reconnecting a sensor that drops its link mid-session
+Streams a synthetic session in real time from a fake client which drops its link at set times, and refuses
+to connect until it is back, through Model with reconnect on. After the last drop the beats resume well after
+the chest acc, so a breath ends before the first beat. Reports the reconnect latency and gaps measured by Model,
+the breaths around each drop, the breaths whose metrics span a gap, the breaths whose rmssd has a successive
+difference across a gap, and the coherence scores whose window spans a gap, with the gaps marked in the analysis
+and without. With the gaps marked, asserts that every drop has breaths on both sides and that nothing spans a gap
+
+Run from the repository root:
+    python -m benchmarks.bench_reconnect
+'''
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import time
+import numpy as np
+from blehrm.interface import BlehrmClientInterface
+from Model import Model
+from synthetic import generate_ibi, generate_chest_acc
+
+ACC_FRAME_INTERVAL = 0.1 # s of chest acc per callback
+SNAPSHOT_INTERVAL = 0.1 # s between snapshots, which run the scheduled analyses as the view does
+MIN_BREATHS_AROUND_DROP = 3 # Breaths expected between each drop and the next, or the start and end of the session
+BREATHING_RATE = 12 # breaths per minute, so a breath fits between the acc and beats resuming
+
+class FlakyClient(BlehrmClientInterface):
+    '''
+    Sensor client streaming synthetic ibi and acc in real time, whose link is down for each (t_drop, duration, ibi_delay)
+    in drops, s from the first connection. Samples taken while the link is down are lost, and connect fails until it is up
+    After the link is back, the beats resume ibi_delay s after the acc, as a strap takes a while to detect beats
+    '''
+
+    def __init__(self, duration, drops):
+        super().__init__("Flaky")
+        self.ibi = generate_ibi(duration, breathing_rate=BREATHING_RATE)
+        self.acc = generate_chest_acc(duration, breathing_rate=BREATHING_RATE)
+        self.drops = drops
+        self.is_connected = False
+        self.t_start = None
+        self.n_connects = 0
+        self._stream_task = None
+
+    @staticmethod
+    def is_supported(device_name: str) -> bool:
+        return False
+
+    def get_time(self):
+        return time.perf_counter() - self.t_start
+
+    def is_link_up(self, t):
+        return not any(t_drop <= t < t_drop + duration for t_drop, duration, _ in self.drops)
+
+    def get_ibi_delay(self, t):
+        '''
+        Returns the ibi_delay of the last drop to end before t, 0 before the first
+        '''
+        ended = [(t_drop + duration, ibi_delay) for t_drop, duration, ibi_delay in self.drops if t_drop + duration <= t]
+        return max(ended)[1] if ended else 0.0
+
+    async def connect(self) -> None:
+        if self.t_start is None:
+            self.t_start = time.perf_counter()
+        if not self.is_link_up(self.get_time()):
+            raise ConnectionError("Sensor out of range")
+        self.is_connected = True
+        self.n_connects += 1
+
+    async def disconnect(self) -> None:
+        if self._stream_task is not None:
+            self._stream_task.cancel()
+            self._stream_task = None
+        self.is_connected = False
+
+    async def get_device_info(self) -> dict:
+        return {"model_number": "Flaky", "manufacturer_name": "Synthetic", "battery_level": 100}
+
+    async def start_ibi_stream(self, callback) -> None:
+        self.set_ibi_callback(callback)
+
+    async def start_acc_stream(self, callback) -> None:
+        self.set_acc_callback(callback)
+        self._stream_task = asyncio.create_task(self._stream())
+
+    def _ibi_data_processor(self, data: bytearray) -> np.ndarray:
+        ''' Required by the ABC'''
+        return np.array([])
+
+    async def _stream(self):
+        '''
+        Delivers the samples taken since the stream started, as they fall due, until the link drops
+        '''
+        t_resume = self.get_time()
+        i_ibi = np.searchsorted(self.ibi[:, 0], t_resume + self.get_ibi_delay(t_resume))
+        i_acc = np.searchsorted(self.acc[:, 0], t_resume)
+        while i_acc < len(self.acc):
+            await asyncio.sleep(ACC_FRAME_INTERVAL)
+            t = self.get_time()
+            if not self.is_link_up(t):
+                self.is_connected = False
+                return
+            i_ibi_end = max(np.searchsorted(self.ibi[:, 0], t), i_ibi)
+            for row in self.ibi[i_ibi:i_ibi_end]:
+                self._ibi_callback(row)
+            i_acc_end = np.searchsorted(self.acc[:, 0], t)
+            if i_acc_end > i_acc:
+                self._acc_callback(self.acc[i_acc:i_acc_end])
+            i_ibi, i_acc = i_ibi_end, i_acc_end
+
+def is_rmssd_across_gap(hrv_analyser, t_range, drops):
+    '''
+    Returns True if the rmssd of the breath t_range, just added to the history, differs from that of its successive
+    differences without those across a gap. As in HrvAnalyser, the beats of a breath are those after its start
+    up to when it is detected, and the first has a difference to the beat before
+    '''
+    ibi_history = hrv_analyser.ibi_history
+    i_start, i_end = ibi_history.get_index_range(t_range[0], np.inf, include_start=False)
+    if i_start == 0 or np.isnan(ibi_history.times[i_start - 1]): # The first breath has no beat before it
+        return False
+    times = ibi_history.times[i_start - 1:i_end]
+    values = ibi_history.values[i_start - 1:i_end]
+    is_within = [not any(t_previous < t_drop < t for t_drop, _, _ in drops) for t_previous, t in zip(times[:-1], times[1:])]
+    diffs = np.diff(values)[is_within]
+    rmssd = np.sqrt(np.mean(diffs**2)) if len(diffs) else np.nan
+    return not np.isclose(hrv_analyser.rmssd_history.values[-1], rmssd, equal_nan=True)
+
+def get_coherence_window(hrv_analyser):
+    '''
+    Returns the times of the first and last beats in the window of the latest coherence score,
+    the first being the beat the first point of the resampling grid is interpolated from
+    '''
+    resampler = hrv_analyser.ibi_resampler
+    t_grid_start = resampler.t_first + resampler.dt*max(resampler.n_grid - hrv_analyser.hrv_spectrum.N, 0)
+    times = hrv_analyser.ibi_history.times
+    i_start, _ = hrv_analyser.ibi_history.get_index_range(t_grid_start, np.inf)
+    if times[i_start] > t_grid_start:
+        i_start -= 1
+    return (times[i_start], times[-1])
+
+def is_spanning_drop(t_range, drops):
+    return any(t_range[0] < t_drop < t_range[1] for t_drop, _, _ in drops)
+
+async def run_session(duration, drops, is_gap_marked):
+    '''
+    Returns the model after streaming the session, the time ranges of the breaths analysed,
+    those of the breaths whose rmssd has a successive difference across a gap,
+    and the beat time ranges of the coherence windows
+    '''
+    model = Model(reconnect=True)
+    if not is_gap_marked:
+        model.analysis.mark_gap = lambda: None
+    breath_t_ranges = []
+    across_gap_t_ranges = []
+    update_breath_by_breath_metrics = model.hrv_analyser.update_breath_by_breath_metrics
+    def record_breath(t_range):
+        breath_t_ranges.append(t_range)
+        update_breath_by_breath_metrics(t_range)
+        if is_rmssd_across_gap(model.hrv_analyser, t_range, drops):
+            across_gap_t_ranges.append(t_range)
+    model.hrv_analyser.update_breath_by_breath_metrics = record_breath
+
+    coherence_windows = []
+    coherence_job = model.analysis.scheduler.jobs['hrv_coherence']
+    def record_coherence(update_coherence):
+        def update_and_record():
+            version = model.hrv_analyser.coherence_history.version
+            update_coherence()
+            if model.hrv_analyser.coherence_history.version != version:
+                coherence_windows.append(get_coherence_window(model.hrv_analyser))
+        return update_and_record
+    coherence_job.function = record_coherence(coherence_job.function)
+    coherence_job.degraded_function = record_coherence(coherence_job.degraded_function)
+
+    client = FlakyClient(duration, drops)
+    with contextlib.redirect_stdout(io.StringIO()): # HrvAnalyser prints rejected values, the client its device info
+        await model.set_and_connect_sensor(client)
+        while client.get_time() < duration:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            model.get_snapshot()
+    model.close()
+    return model, breath_t_ranges, across_gap_t_ranges, coherence_windows
+
+def count_breaths_between_drops(breath_t_ranges, drops, duration):
+    '''
+    Returns the number of breaths between the start of the session, each drop, and the end of the session
+    '''
+    bounds = [0.0] + [t for t_drop, drop_duration, ibi_delay in drops for t in (t_drop, t_drop + drop_duration)] + [duration]
+    return [sum(t_start >= bounds[i] and t_end <= bounds[i + 1] for t_start, t_end in breath_t_ranges)
+            for i in range(0, len(bounds), 2)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconnecting a sensor that drops its link mid-session")
+    parser.add_argument('--duration', type=float, default=150, help="s of session, streamed in real time")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    drops = [(30.0, 2.0, 0.0), (60.0, 6.0, 0.0), (95.0, 2.0, 12.0)] # (s from the start, s down, s from acc to beats resuming)
+    print(f"{args.duration:.0f} s session, link down for {', '.join(f'{d:.0f} s at {t:.0f} s' for t, d, _ in drops)}, "
+          f"beats resuming {drops[-1][2]:.0f} s after the acc after the last")
+    for is_gap_marked in (True, False):
+        model, breath_t_ranges, across_gap_t_ranges, coherence_windows = asyncio.run(run_session(args.duration, drops, is_gap_marked))
+        stats = model.get_connection_stats()
+        n_breaths_between = count_breaths_between_drops(breath_t_ranges, drops, args.duration)
+        n_spanning = sum(is_spanning_drop(t_range, drops) for t_range in breath_t_ranges)
+        n_coherence_spanning = sum(is_spanning_drop(t_range, drops) for t_range in coherence_windows)
+        print(f"\ngaps {'marked' if is_gap_marked else 'not marked'}: {stats['n_drops']} drops, "
+              f"{stats['n_reconnect_attempts']} attempts to reconnect")
+        print(f"  reconnect s: {', '.join(f'{t:.2f}' for t in stats['reconnect_latencies'])}")
+        print(f"  gap s: {', '.join(f'{t:.2f}' for t in stats['gap_durations'])}, "
+              f"in gap_history: {', '.join(f'{t:.2f}' for t in model.analysis.gap_history.values[-len(drops):])}")
+        print(f"  {len(breath_t_ranges)} breaths analysed, {', '.join(map(str, n_breaths_between))} between the drops, "
+              f"{n_spanning} spanning a gap, {len(across_gap_t_ranges)} with an rmssd difference across a gap")
+        print(f"  {len(coherence_windows)} coherence scores, {n_coherence_spanning} with a window spanning a gap")
+        if is_gap_marked:
+            assert min(n_breaths_between) >= MIN_BREATHS_AROUND_DROP, "Too few breaths around a drop, lengthen the session"
+            assert n_spanning == 0 and not across_gap_t_ranges, "A breath spans a gap"
+            assert n_coherence_spanning == 0, "A coherence window spans a gap"
+
+if __name__ == "__main__":
+    main()
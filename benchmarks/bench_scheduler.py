@@ -0,0 +1,81 @@
+'''
+Cost of the scheduled analyses, with the samples delivered in bursts as after a stalled BLE link
+Runs a synthetic session through AnalysisPipeline twice: with the jobs run after every sample, as a caller
+without a scheduler would, and with run_scheduled once per tick of TICK_INTERVAL s of arrival time,
+as the analysis worker publishes. Reports the time spent in jobs per tick and the scheduler statistics
+
+Run from the repository root:
+    python -m benchmarks.bench_scheduler
+'''
+import argparse
+import contextlib
+import io
+import math
+import time
+import numpy as np
+from analysis.AnalysisPipeline import AnalysisPipeline
+from analysis.AnalysisScheduler import format_stats
+from synthetic import generate_ibi, generate_chest_acc
+from benchmarks.utils import get_latency_stats
+
+TICK_INTERVAL = 0.02 # s, as AnalysisWorker.PUBLISH_INTERVAL
+ACC_PACKET_INTERVAL = 1.0 # s of chest acc per packet
+STALL_PERIOD = 60 # s between stalls of the link
+
+def get_arrivals(duration, stall_duration):
+    '''
+    Returns the samples in order of arrival, as (arrival time, stream, sample)
+    The samples of the first stall_duration s of each STALL_PERIOD are held back and delivered at once
+    '''
+    samples = [(row[0], 'ibi', row) for row in generate_ibi(duration)]
+    samples += [(math.ceil(row[0]/ACC_PACKET_INTERVAL)*ACC_PACKET_INTERVAL, 'acc', row) for row in generate_chest_acc(duration)]
+    arrivals = []
+    for t, stream, row in samples:
+        if t % STALL_PERIOD < stall_duration:
+            t = t - t % STALL_PERIOD + stall_duration
+        arrivals.append((t, stream, row))
+    arrivals.sort(key=lambda arrival: arrival[0])
+    return arrivals
+
+def run(arrivals, budget, is_per_sample):
+    '''
+    Returns the time in jobs of each tick, and the scheduler statistics
+    '''
+    pipeline = AnalysisPipeline(budget=budget)
+    durations = []
+    t_tick = arrivals[0][0]
+    with contextlib.redirect_stdout(io.StringIO()): # HrvAnalyser prints rejected values
+        for t, stream, row in arrivals:
+            if not is_per_sample and t - t_tick >= TICK_INTERVAL:
+                t_start = time.perf_counter()
+                pipeline.run_scheduled()
+                durations.append(time.perf_counter() - t_start)
+                t_tick = t
+            if stream == 'ibi':
+                pipeline.update_ibi(row)
+            else:
+                pipeline.update_acc(row)
+            if is_per_sample:
+                t_start = time.perf_counter()
+                if pipeline.run_scheduled():
+                    durations.append(time.perf_counter() - t_start)
+    return np.array(durations), pipeline.get_scheduler_stats()
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of the scheduled analyses with bursty delivery")
+    parser.add_argument('--duration', type=float, default=600, help="s of synthetic session")
+    parser.add_argument('--stall', type=float, default=10, help=f"s of samples delivered at once, every {STALL_PERIOD} s")
+    parser.add_argument('--budget', type=float, default=AnalysisPipeline.DEFAULT_BUDGET, help="s of scheduled analysis per tick")
+    args = parser.parse_args()
+
+    arrivals = get_arrivals(args.duration, args.stall)
+    print(f"{args.duration:.0f} s session, {len(arrivals)} samples, stalls of {args.stall:.0f} s every {STALL_PERIOD} s")
+    for name, budget, is_per_sample in [("per sample", math.inf, True), ("scheduled", args.budget, False)]:
+        durations, stats = run(arrivals, budget, is_per_sample)
+        latency = get_latency_stats(durations)
+        print(f"\n{name}: {1e3*np.sum(durations):.1f} ms in jobs, per tick with jobs p50 {latency['p50_us']:.0f} us, "
+              f"p99 {latency['p99_us']:.0f} us, max {latency['max_us']:.0f} us")
+        print(format_stats(stats))
+
+if __name__ == "__main__":
+    main()
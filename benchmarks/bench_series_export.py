@@ -0,0 +1,66 @@
+'''
+Microbenchmark of exporting a HistoryBuffer to a chart series
+Compares the per-point QPointF list path with the bulk replaceNp path
+
+Run from the repository root:
+    python -m benchmarks.bench_series_export
+'''
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen') # No display needed
+
+import time
+import numpy as np
+from PySide6.QtCore import QPointF
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCharts import QLineSeries
+from analysis.HistoryBuffer import HistoryBuffer
+from views.charts import replace_series_np
+
+N_POINTS = [500, 1500, 10000]
+N_REPEATS = 50
+
+def legacy_qpoint_list(buffer):
+    '''
+    The per-point export used before replaceNp, kept here as the baseline
+    '''
+    series = []
+    rel_t = buffer.get_relative_times()
+    for i, value in enumerate(buffer.values):
+        if not np.isnan(value):
+            series.append(QPointF(rel_t[i], value))
+    return series
+
+def make_buffer(n_points):
+    '''
+    Returns a buffer of n_points slots, with 10% left empty as at the start of a session
+    '''
+    buffer = HistoryBuffer(n_points)
+    t0 = time.time() - n_points/10.0
+    for i in range(int(0.9*n_points)):
+        buffer.update(t0 + i/10.0, np.sin(2*np.pi*0.1*i/10.0))
+    return buffer
+
+def time_export(export, n_repeats=N_REPEATS):
+    '''
+    Returns the median duration in ms of export()
+    '''
+    durations = []
+    for _ in range(n_repeats):
+        t_start = time.perf_counter()
+        export()
+        durations.append(time.perf_counter() - t_start)
+    return 1000*np.median(durations)
+
+def main():
+    app = QApplication.instance() or QApplication([])
+    series = QLineSeries()
+
+    print(f"{'points':>8} {'qpoint list (ms)':>18} {'replaceNp (ms)':>16} {'speedup':>8}")
+    for n_points in N_POINTS:
+        buffer = make_buffer(n_points)
+        legacy_ms = time_export(lambda: series.replace(legacy_qpoint_list(buffer)))
+        bulk_ms = time_export(lambda: replace_series_np(series, *buffer.get_series_arrays()))
+        print(f"{n_points:>8} {legacy_ms:>18.3f} {bulk_ms:>16.3f} {legacy_ms/bulk_ms:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+'''
+Load and soak test of the analysis with a simulated sensor
+Streams SimulatedClient through Model at each speed for a while of real time, reading snapshots as the View does,
+and reports whether the analysis keeps up: the samples analysed, the lag of the event loop,
+the scheduled analyses degraded or skipped, and the peak memory of the process
+For a soak test, run at speed 1 for hours with --duration, or run the app with EBYT.py --simulate
+
+Run from the repository root:
+    python -m benchmarks.bench_simulated
+'''
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import resource
+import time
+import numpy as np
+from Model import Model
+from simulated import SimulatedClient
+from benchmarks.utils import get_latency_stats
+
+SNAPSHOT_INTERVAL = 0.05 # s, as View.UPDATE_SERIES_PERIOD
+LAG_INTERVAL = 0.01 # s between checks of the event loop lag
+
+async def run_session(speed, duration, use_worker):
+    '''
+    Returns the model, the client and the event loop lags in s, after streaming for duration s of real time
+    '''
+    model = Model(use_worker=use_worker)
+    client = SimulatedClient(speed=speed)
+    lags = []
+    with contextlib.redirect_stdout(io.StringIO()): # HrvAnalyser prints rejected values, the client its device info
+        await model.set_and_connect_sensor(client)
+        t_end = time.perf_counter() + duration
+        t_next_snapshot = 0
+        while time.perf_counter() < t_end:
+            t_start = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            lags.append(time.perf_counter() - t_start - LAG_INTERVAL)
+            if time.perf_counter() >= t_next_snapshot:
+                model.get_snapshot()
+                t_next_snapshot = time.perf_counter() + SNAPSHOT_INTERVAL
+        await client.disconnect()
+    return model, client, np.array(lags)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and soak test with a simulated sensor")
+    parser.add_argument('--speeds', type=float, nargs='+', default=[1, 10, 100], help="times real time")
+    parser.add_argument('--duration', type=float, default=10, help="s of real time at each speed")
+    parser.add_argument('--worker', action='store_true', help="run the analysis in the worker process, as the app does")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    print(f"{args.duration:.0f} s at each speed, analysis {'in the worker' if args.worker else 'in process'}")
+    print(f"{'speed':>6} {'beats':>7} {'acc':>8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'degraded':>9} {'skipped':>8} {'max RSS MB':>11}")
+    for speed in args.speeds:
+        model, client, lags = asyncio.run(run_session(speed, args.duration, args.worker))
+        model.close()
+        stats = model.get_scheduler_stats()
+        n_degraded = sum(job['degraded'] for job in stats['jobs'].values())
+        n_skipped = sum(job['skipped'] for job in stats['jobs'].values())
+        lag = get_latency_stats(lags)
+        print(f"{speed:>6.0f} {client.signals.n_beats:>7} {client.signals.n_acc:>8} {lag['p50_us']/1e3:>11.2f} {lag['p99_us']/1e3:>11.2f} "
+              f"{n_degraded:>9} {n_skipped:>8} {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024:>11.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+'''
+Cold start time of the app
+Runs EBYT.py --profile-startup --quit-after-startup in new processes, and reports the median time
+of each startup milestone and of the slowest imports over the runs
+Scanning for sensors starts after the charts are created, so it is not timed
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+REPORT_IMPORTS = 8
+
+def run_startup(path):
+    '''
+    Returns the startup statistics of one run of the app
+    '''
+    environment = dict(os.environ)
+    environment.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    subprocess.run([sys.executable, 'EBYT.py', '--profile-startup', path, '--quit-after-startup'],
+                   env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120)
+    with open(path) as file:
+        return json.load(file)
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start time of the app")
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        runs = [run_startup(os.path.join(directory, f"startup{i}.json")) for i in range(args.runs)]
+
+    print(f"median of {args.runs} runs, ms since start:")
+    for name in runs[0]['milestones_ms']:
+        print(f"  {name:<24} {np.median([run['milestones_ms'][name] for run in runs]):>8.1f}")
+    print("slowest imports, ms including the modules they import:")
+    imports = {name: np.median([run['imports_ms'].get(name, {'total': 0})['total'] for run in runs])
+               for name, times in runs[0]['imports_ms'].items() if times['depth'] == 0}
+    for name, t in sorted(imports.items(), key=lambda item: -item[1])[:REPORT_IMPORTS]:
+        print(f"  {name:<24} {t:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+'''
+Compares the streaming coherence scores with the periodogram scores, in accuracy and cost
+Uses synthetic ibi with respiratory sinus arrhythmia, and synthetic chest acceleration at 10 Hz
+
+Run from the repository root:
+    python -m benchmarks.bench_streaming_spectrum
+'''
+import contextlib
+import io
+import time
+import numpy as np
+from analysis.HrvAnalyser import HrvAnalyser
+from analysis.BreathAnalyser import BreathAnalyser
+
+N_SESSIONS = 20
+
+def time_call(method):
+    t_start = time.perf_counter()
+    method()
+    return time.perf_counter() - t_start
+
+def compare_hrv(rng):
+    differences, durations_streaming, durations_periodogram = [], [], []
+    for _ in range(N_SESSIONS):
+        hrv_analyser = HrvAnalyser()
+        t = 0.0
+        breathing_rate = rng.uniform(4, 15)
+        amplitude = rng.uniform(20, 200)
+        noise = rng.uniform(5, 60)
+        for _ in range(400):
+            ibi = 900 + amplitude*np.sin(2*np.pi*breathing_rate/60*t) + noise*rng.normal()
+            t += ibi/1000
+            hrv_analyser.update(t, ibi)
+            if not hrv_analyser.hrv_spectrum.is_full():
+                continue
+            durations_streaming.append(time_call(hrv_analyser.update_coherence))
+            coherence_streaming = hrv_analyser.hr_coherence
+            durations_periodogram.append(time_call(hrv_analyser.update_coherence_periodogram))
+            differences.append(abs(coherence_streaming - hrv_analyser.hr_coherence)/hrv_analyser.hr_coherence)
+    return differences, durations_streaming, durations_periodogram
+
+def compare_breath(rng):
+    differences, durations_streaming, durations_periodogram = [], [], []
+    for _ in range(N_SESSIONS):
+        breath_analyser = BreathAnalyser()
+        t = 0.0
+        breathing_rate = rng.uniform(4, 15)
+        noise = rng.uniform(0.01, 0.3)
+        for i in range(3000):
+            t += 0.1
+            acc = np.array([0, 0, 9.81 + np.sin(2*np.pi*breathing_rate/60*t)]) + noise*rng.normal(size=3)
+            breath_analyser.update_chest_acc(t, acc)
+            if not breath_analyser.br_spectrum.is_full() or i % 10:
+                continue
+            durations_streaming.append(time_call(breath_analyser.update_breathing_spectrum))
+            coherence_streaming = breath_analyser.br_coherence
+            durations_periodogram.append(time_call(breath_analyser.update_breathing_spectrum_periodogram))
+            differences.append(abs(coherence_streaming - breath_analyser.br_coherence))
+    return differences, durations_streaming, durations_periodogram
+
+def report(name, differences, durations_streaming, durations_periodogram):
+    print(f"{name}: difference median {np.median(differences):.2g}, 95th percentile {np.percentile(differences, 95):.2g}, max {np.max(differences):.2g}")
+    print(f"{name}: median time streaming {1e6*np.median(durations_streaming):.0f} us, periodogram {1e6*np.median(durations_periodogram):.0f} us")
+
+def main():
+    rng = np.random.default_rng(0)
+    with contextlib.redirect_stdout(io.StringIO()): # HrvAnalyser prints rejected values
+        hrv_results = compare_hrv(rng)
+    report("HRV coherence (relative)", *hrv_results)
+    report("Breathing coherence (absolute)", *compare_breath(rng))
+
+if __name__ == "__main__":
+    main()
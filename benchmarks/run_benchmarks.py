@@ -0,0 +1,131 @@
+'''
+Benchmarks of the hot paths of HistoryBuffer, BreathAnalyser, HrvAnalyser and Pacer
+Runs without a sensor or display, on deterministic synthetic signals
+
+Run from the repository root:
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --compare results.json
+'''
+import time
+import argparse
+import contextlib
+import io
+import warnings
+import numpy as np
+from analysis.HistoryBuffer import HistoryBuffer
+from analysis.BreathAnalyser import BreathAnalyser
+from analysis.HrvAnalyser import HrvAnalyser
+from Pacer import Pacer
+from synthetic import generate_ibi, generate_chest_acc
+from benchmarks.utils import measure, get_latency_stats, get_run_info, save_results, load_results
+
+ACC_SAMPLE_RATES = [25, 50, 100, 200] # Hz
+BREATH_PERIOD = 10 # s, of the breaths closed in the breath-by-breath benchmark
+PREFILL_DURATION = 600 # s of signal before measuring, so the histories are in steady state
+
+def bench_history_buffer(scale):
+    results = {}
+    buffer = HistoryBuffer(10000)
+    samples = generate_chest_acc(PREFILL_DURATION + 100*scale, sample_rate=10)[:, [0, 3]]
+    for t, value in samples[:-1000*scale]:
+        buffer.update(t, value)
+    results['HistoryBuffer.update'] = measure(buffer.update, samples[-1000*scale:])
+
+    results['HistoryBuffer.get_qpoint_list'] = measure(buffer.get_qpoint_list, [()]*20*scale, warmup=2)
+    results['HistoryBuffer.get_series_arrays'] = measure(buffer.get_series_arrays, [()]*20*scale, warmup=2)
+
+    t_end = buffer.times[-1]
+    ranges = [(t_end - 60 - i, t_end - 30 - i) for i in range(100*scale)]
+    results['HistoryBuffer.get_sub_buffer'] = measure(buffer.get_sub_buffer, ranges)
+    return results
+
+def bench_breath_analyser(scale):
+    results = {}
+    for sample_rate in ACC_SAMPLE_RATES:
+        breath_analyser = BreathAnalyser()
+        acc = generate_chest_acc(PREFILL_DURATION + 10*scale, sample_rate=sample_rate)
+        n_measured = 10*scale*sample_rate
+        for row in acc[:-n_measured]:
+            breath_analyser.update_chest_acc(row[0], row[1:])
+        result = measure(breath_analyser.update_chest_acc, [(row[0], row[1:]) for row in acc[-n_measured:]])
+        result['sample_rate_hz'] = sample_rate
+        result['realtime_factor'] = result['throughput_per_s']/sample_rate
+        results[f'BreathAnalyser.update_chest_acc@{sample_rate}Hz'] = result
+
+    breath_analyser = BreathAnalyser()
+    for row in generate_chest_acc(PREFILL_DURATION, sample_rate=10):
+        breath_analyser.update_chest_acc(row[0], row[1:])
+    results['BreathAnalyser.update_breathing_spectrum'] = measure(breath_analyser.update_breathing_spectrum, [()]*50*scale)
+    results['BreathAnalyser.update_breathing_spectrum_periodogram'] = measure(breath_analyser.update_breathing_spectrum_periodogram, [()]*50*scale)
+    return results
+
+def bench_hrv_analyser(scale):
+    results = {}
+    hrv_analyser = HrvAnalyser()
+    ibi = generate_ibi(PREFILL_DURATION + 100*scale)
+    n_measured = np.count_nonzero(ibi[:, 0] > PREFILL_DURATION)
+    with contextlib.redirect_stdout(io.StringIO()): # HrvAnalyser prints rejected values
+        for t, value in ibi[:-n_measured]:
+            hrv_analyser.update(t, value)
+        results['HrvAnalyser.update'] = measure(hrv_analyser.update, ibi[-n_measured:])
+    results['HrvAnalyser.update_coherence'] = measure(hrv_analyser.update_coherence, [()]*50*scale)
+    results['HrvAnalyser.update_coherence_periodogram'] = measure(hrv_analyser.update_coherence_periodogram, [()]*50*scale)
+    results['HrvAnalyser.update_nn50_metrics'] = measure(hrv_analyser.update_nn50_metrics, [()]*50*scale)
+
+    results['HrvAnalyser.update_breath_by_breath_metrics'] = bench_breath_by_breath_metrics(ibi)
+    return results
+
+def bench_breath_by_breath_metrics(ibi):
+    '''
+    Times the end of each breath, with the beats of the breath added before it untimed, as in a session
+    '''
+    hrv_analyser = HrvAnalyser()
+    breath_ends = np.arange(ibi[0, 0] + BREATH_PERIOD, ibi[-1, 0], BREATH_PERIOD)
+    beat_splits = np.searchsorted(ibi[:, 0], breath_ends, side='right')
+    durations = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i, (t_end, i_end) in enumerate(zip(breath_ends, beat_splits)):
+            for t, value in ibi[beat_splits[i - 1] if i > 0 else 0:i_end]:
+                hrv_analyser.update(t, value)
+            t_start = time.perf_counter()
+            hrv_analyser.update_breath_by_breath_metrics((t_end - BREATH_PERIOD, t_end))
+            if t_end > PREFILL_DURATION:
+                durations.append(time.perf_counter() - t_start)
+    return get_latency_stats(np.array(durations))
+
+def bench_pacer(scale):
+    pacer = Pacer()
+    rates = [(6 + (i // 1000)*0.5,) for i in range(1000*scale)] # Rate change every 1000 calls
+    return {'Pacer.update': measure(pacer.update, rates)}
+
+def print_results(results, baseline=None):
+    header = f"{'benchmark':<56} {'p50 us':>10} {'p99 us':>10} {'calls/s':>12}"
+    if baseline:
+        header += f" {'p50 vs baseline':>16}"
+    print(header)
+    for name, result in results.items():
+        line = f"{name:<56} {result['p50_us']:>10.2f} {result['p99_us']:>10.2f} {result['throughput_per_s']:>12.0f}"
+        if baseline and name in baseline:
+            line += f" {result['p50_us']/baseline[name]['p50_us']:>15.2f}x"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the analysis hot paths")
+    parser.add_argument('--output', help="save the results as JSON to this path")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--scale', type=int, default=5, help="multiplier for the number of calls measured")
+    args = parser.parse_args()
+
+    results = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        for bench in (bench_history_buffer, bench_breath_analyser, bench_hrv_analyser, bench_pacer):
+            results.update(bench(args.scale))
+
+    baseline = load_results(args.compare)['results'] if args.compare else None
+    print_results(results, baseline)
+    if args.output:
+        save_results({'run': get_run_info(), 'results': results}, args.output)
+
+if __name__ == "__main__":
+    main()
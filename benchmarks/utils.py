@@ -0,0 +1,60 @@
+import json
+import time
+import platform
+import subprocess
+import numpy as np
+
+def measure(call, args_list, warmup=10):
+    '''
+    Calls call(*args) for each args in args_list, returns latency percentiles (us) and throughput (calls/s)
+    '''
+    for args in args_list[:warmup]:
+        call(*args)
+
+    durations = np.empty(len(args_list))
+    t_total = time.perf_counter()
+    for i, args in enumerate(args_list):
+        t_start = time.perf_counter()
+        call(*args)
+        durations[i] = time.perf_counter() - t_start
+    t_total = time.perf_counter() - t_total
+    return get_latency_stats(durations, t_total)
+
+def get_latency_stats(durations, t_total=None):
+    '''
+    Returns latency percentiles (us) and throughput (calls/s) of calls lasting durations (s), in t_total s if given
+    '''
+    t_total = np.sum(durations) if t_total is None else t_total
+    return {
+        'n_calls': len(durations),
+        'p50_us': 1e6*np.percentile(durations, 50),
+        'p90_us': 1e6*np.percentile(durations, 90),
+        'p99_us': 1e6*np.percentile(durations, 99),
+        'max_us': 1e6*np.max(durations),
+        'throughput_per_s': len(durations)/t_total
+    }
+
+def get_run_info():
+    '''
+    Returns the environment of a benchmark run, so saved results can be compared
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor()
+    }
+
+def save_results(results, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+def load_results(path):
+    with open(path) as file:
+        return json.load(file)
@@ -0,0 +1,242 @@
+'''
+Session recordings are a directory with one append-only file per stream, ibi.bin, acc.bin and gap.bin
+Each file has a small header followed by fixed size little-endian records:
+    8 bytes magic, 4 bytes header length, JSON header padded to HEADER_ALIGN bytes, records
+seq is an arrival number shared by the streams, so the interleaving of the streams can be replayed exactly
+A gap record marks where the sensor link dropped, with the time of the last sample before it
+Recordings made before gaps were recorded have no gap.bin, and are read as having no gaps
+'''
+import os
+import json
+import time
+import queue
+import logging
+import threading
+import numpy as np
+
+MAGIC = b'EBYTREC1'
+HEADER_ALIGN = 64
+IBI_DTYPE = np.dtype([('seq', '<u8'), ('t', '<f8'), ('ibi', '<f8')])
+ACC_DTYPE = np.dtype([('seq', '<u8'), ('t', '<f8'), ('x', '<f8'), ('y', '<f8'), ('z', '<f8')])
+GAP_DTYPE = np.dtype([('seq', '<u8'), ('t', '<f8')])
+STREAM_DTYPES = {'ibi': IBI_DTYPE, 'acc': ACC_DTYPE, 'gap': GAP_DTYPE}
+SAMPLE_STREAMS = ('ibi', 'acc')
+
+def write_stream_header(file, header):
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_size = len(MAGIC) + 4 + len(header_bytes)
+    header_bytes += b' '*(-header_size % HEADER_ALIGN)
+    file.write(MAGIC)
+    file.write(len(header_bytes).to_bytes(4, 'little'))
+    file.write(header_bytes)
+
+def read_stream_header(file):
+    '''
+    Returns the header dict, and the offset of the first record
+    '''
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{file.name} is not a session recording")
+    header_length = int.from_bytes(file.read(4), 'little')
+    header = json.loads(file.read(header_length).decode('utf-8'))
+    return header, len(MAGIC) + 4 + header_length
+
+class SessionRecorder:
+
+    BATCH_SIZE = 1024 # Records per write
+    FLUSH_INTERVAL = 1.0 # s, maximum time records wait in memory
+
+    def __init__(self, path, header=None):
+        '''
+        Records the ibi and acc streams, and the gaps in them, to the session directory path
+        header is a dict of session information (sensor class, analysis parameters) stored with each stream
+        Records are collected in memory and written in batches by a background thread, so writes never block on disk
+        '''
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        header = dict(header or {})
+        header['created'] = time.time()
+        self.files = {}
+        self.pending = {}
+        self.n_pending = {}
+        for stream, dtype in STREAM_DTYPES.items():
+            self.files[stream] = open(os.path.join(path, f"{stream}.bin"), 'wb')
+            write_stream_header(self.files[stream], dict(header, stream=stream, dtype=dtype.descr))
+            self.pending[stream] = np.zeros(self.BATCH_SIZE, dtype=dtype)
+            self.n_pending[stream] = 0
+        self.seq = 0
+        self.t_last = np.nan # Time of the last sample recorded
+        self.t_last_flush = time.monotonic()
+
+        self.write_queue = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self._write_batches, name="SessionRecorder", daemon=True)
+        self.writer.start()
+
+    def write_ibi(self, data):
+        '''
+        Records an ibi sample (t, ibi)
+        '''
+        self._write('ibi', np.reshape(data, (-1, 2)))
+
+    def write_acc(self, data):
+        '''
+        Records an acc sample (t, x, y, z), or a frame with one sample per row
+        '''
+        self._write('acc', np.reshape(data, (-1, 4)))
+
+    def write_gap(self):
+        '''
+        Records a gap after the samples recorded so far, e.g. when the sensor link drops
+        '''
+        self._write('gap', np.array([[self.t_last]]))
+
+    def _write(self, stream, rows):
+        fields = STREAM_DTYPES[stream].names[1:]
+        if stream in SAMPLE_STREAMS and len(rows):
+            self.t_last = rows[-1, 0]
+        while len(rows):
+            pending = self.pending[stream]
+            n = self.n_pending[stream]
+            n_new = min(len(rows), self.BATCH_SIZE - n)
+            pending['seq'][n:n + n_new] = np.arange(self.seq, self.seq + n_new)
+            for i, field in enumerate(fields):
+                pending[field][n:n + n_new] = rows[:n_new, i]
+            self.seq += n_new
+            self.n_pending[stream] += n_new
+            rows = rows[n_new:]
+            if self.n_pending[stream] == self.BATCH_SIZE:
+                self._submit(stream)
+
+        if time.monotonic() - self.t_last_flush > self.FLUSH_INTERVAL:
+            self.flush()
+
+    def _submit(self, stream):
+        n = self.n_pending[stream]
+        if n == 0:
+            return
+        self.write_queue.put((stream, self.pending[stream][:n]))
+        self.pending[stream] = np.zeros(self.BATCH_SIZE, dtype=STREAM_DTYPES[stream])
+        self.n_pending[stream] = 0
+
+    def flush(self):
+        '''
+        Hands every pending record to the writer thread
+        '''
+        for stream in STREAM_DTYPES:
+            self._submit(stream)
+        self.t_last_flush = time.monotonic()
+
+    def _write_batches(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            stream, records = item
+            self.files[stream].write(records.tobytes())
+            self.files[stream].flush()
+
+    def close(self):
+        '''
+        Writes the pending records, and waits for the writer thread to finish
+        '''
+        self.flush()
+        self.write_queue.put(None)
+        self.writer.join()
+        for file in self.files.values():
+            file.close()
+        self.logger.info(f"Recorded {self.seq} samples to {self.path}")
+
+class SessionRecording:
+
+    def __init__(self, path):
+        '''
+        Reads a session directory written by SessionRecorder
+        The streams are memory mapped, so opening is instant and only the slices used are read from disk
+        '''
+        self.path = path
+        self.header = {}
+        self.streams = {}
+        for stream, dtype in STREAM_DTYPES.items():
+            file_path = os.path.join(path, f"{stream}.bin")
+            if stream not in SAMPLE_STREAMS and not os.path.isfile(file_path): # Recorded before the stream existed
+                self.streams[stream] = np.zeros(0, dtype=dtype)
+                continue
+            with open(file_path, 'rb') as file:
+                header, offset = read_stream_header(file)
+            self.header = {key: value for key, value in header.items() if key not in ('stream', 'dtype')}
+            n_records = (os.path.getsize(file_path) - offset) // dtype.itemsize # Ignores a partly written last record
+            if n_records == 0:
+                self.streams[stream] = np.zeros(0, dtype=dtype)
+            else:
+                self.streams[stream] = np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=(n_records,))
+
+    @property
+    def ibi(self):
+        return self.streams['ibi']
+
+    @property
+    def acc(self):
+        return self.streams['acc']
+
+    @property
+    def gap(self):
+        return self.streams['gap']
+
+    def get_time_range(self):
+        '''
+        Returns the first and last sample times of the session in epoch seconds
+        '''
+        times = [self.streams[stream]['t'][[0, -1]] for stream in SAMPLE_STREAMS if len(self.streams[stream])]
+        if not times:
+            return (np.nan, np.nan)
+        return (min(t[0] for t in times), max(t[1] for t in times))
+
+    def _between(self, stream, t_start, t_end):
+        '''
+        Returns the records with t_start <= t <= t_end, as a view of the memory map
+        Samples are assumed to be in time order
+        '''
+        records = self.streams[stream]
+        i_start = np.searchsorted(records['t'], t_start, side='left')
+        i_end = np.searchsorted(records['t'], t_end, side='right')
+        return records[i_start:i_end]
+
+    def ibi_between(self, t_start=-np.inf, t_end=np.inf):
+        return self._between('ibi', t_start, t_end)
+
+    def acc_between(self, t_start=-np.inf, t_end=np.inf):
+        return self._between('acc', t_start, t_end)
+
+    def gap_between(self, t_start=-np.inf, t_end=np.inf):
+        return self._between('gap', t_start, t_end)
+
+    @staticmethod
+    def to_array(records):
+        '''
+        Returns records as a float array of rows, (t, ibi) or (t, x, y, z), as the sensor callbacks receive them
+        '''
+        return np.column_stack([records[field] for field in records.dtype.names[1:]]).astype(float)
+
+    def iter_sample_blocks(self):
+        '''
+        Yields the samples in their recorded arrival order, as ('ibi', (t, ibi)) for each ibi sample,
+        ('acc', rows) for each run of acc samples that arrived between two ibi samples or gaps,
+        and ('gap', None) for each gap, see AnalysisPipeline.mark_gap
+        '''
+        ibi_rows = self.to_array(self.ibi) if len(self.ibi) else np.empty((0, 2))
+        acc_rows = self.to_array(self.acc) if len(self.acc) else np.empty((0, 4))
+        event_seq = np.concatenate((self.ibi['seq'], self.gap['seq']))
+        order = np.argsort(event_seq, kind='stable') # Indices below len(ibi_rows) are ibi samples, the others gaps
+        acc_splits = np.searchsorted(self.acc['seq'], event_seq[order]) # Number of acc samples before each event
+        i_acc = 0
+        for i_event, i_split in zip(order, acc_splits):
+            if i_split > i_acc:
+                yield ('acc', acc_rows[i_acc:i_split])
+                i_acc = i_split
+            if i_event < len(ibi_rows):
+                yield ('ibi', ibi_rows[i_event])
+            else:
+                yield ('gap', None)
+        if i_acc < len(acc_rows):
+            yield ('acc', acc_rows[i_acc:])
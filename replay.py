@@ -0,0 +1,181 @@
+import asyncio
+import time
+import logging
+import numpy as np
+from blehrm.interface import BlehrmClientInterface
+from Model import Model
+
+class ReplayClient(BlehrmClientInterface):
+    '''
+    Sensor client that replays recorded ibi and acc streams into the stream callbacks, in place of a BLE sensor
+    ibi: array with rows of (t, ibi), acc: array with rows of (t, x, y, z), times in epoch seconds
+    speed: 1 replays in real time, N at N times real time, None as fast as possible
+    acc_frame_size: number of acc samples per callback, 1 passes single samples as a live sensor does
+    ibi_seq, acc_seq: optional arrival numbers of the samples, to replay in arrival order instead of time order
+    gaps: optional times of the last sample before each gap in the streams, passed to the gap callback
+    after the samples up to them, and gap_seq their arrival numbers
+    '''
+    YIELD_EVERY = 1000 # Callbacks between yielding to the event loop, when replaying as fast as possible
+
+    def __init__(self, ibi, acc, speed=None, acc_frame_size=1, ibi_seq=None, acc_seq=None, gaps=None, gap_seq=None, name="Replay"):
+        super().__init__(name)
+        self.logger = logging.getLogger(__name__)
+        self.ibi = np.asarray(ibi, dtype=float).reshape(-1, 2)
+        self.acc = np.asarray(acc, dtype=float).reshape(-1, 4)
+        self.speed = speed
+        self.acc_frame_size = acc_frame_size
+        self.ibi_seq = ibi_seq
+        self.acc_seq = acc_seq
+        self.gaps = np.asarray(gaps if gaps is not None else [], dtype=float)
+        self.gap_seq = gap_seq
+        self._gap_callback = None
+        self._tick_callback = None
+        self.is_connected = False
+        self._replay_task = None
+
+    @classmethod
+    def from_recording(cls, recording, t_start=-np.inf, t_end=np.inf, speed=None, acc_frame_size=1):
+        '''
+        Replays the samples and gaps of a SessionRecording between t_start and t_end, in their recorded arrival order
+        '''
+        ibi = recording.ibi_between(t_start, t_end)
+        acc = recording.acc_between(t_start, t_end)
+        gap = recording.gap_between(t_start, t_end)
+        return cls(recording.to_array(ibi), recording.to_array(acc), speed=speed, acc_frame_size=acc_frame_size,
+                   ibi_seq=np.asarray(ibi['seq']), acc_seq=np.asarray(acc['seq']),
+                   gaps=np.asarray(gap['t']), gap_seq=np.asarray(gap['seq']))
+
+    @staticmethod
+    def is_supported(device_name: str) -> bool:
+        return False # Never created from a BLE scan
+
+    async def connect(self) -> None:
+        self.is_connected = True
+
+    async def disconnect(self) -> None:
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+        self.is_connected = False
+
+    async def get_device_info(self) -> dict:
+        return {
+            "model_number": "Replay",
+            "manufacturer_name": "Recorded session",
+            "battery_level": 100
+        }
+
+    async def start_ibi_stream(self, callback) -> None:
+        self.set_ibi_callback(callback)
+        self._start_replay()
+
+    async def stop_ibi_stream(self) -> None:
+        self._ibi_callback = None
+
+    async def start_acc_stream(self, callback) -> None:
+        self.set_acc_callback(callback)
+        self._start_replay()
+
+    async def stop_acc_stream(self) -> None:
+        self._acc_callback = None
+
+    def set_gap_callback(self, callback):
+        '''
+        Sets the function called without arguments at each gap, e.g. Model.mark_gap
+        '''
+        self._gap_callback = callback
+
+    def set_tick_callback(self, callback):
+        '''
+        Sets the function called without arguments after each replayed event, e.g. Model.run_scheduled
+        '''
+        self._tick_callback = callback
+
+    def _ibi_data_processor(self, data: bytearray) -> np.ndarray:
+        ''' Required by the ABC'''
+        return np.array([])
+
+    def _start_replay(self):
+        '''
+        Starts replaying once, after the streams started in the same step of the event loop are registered
+        '''
+        if self._replay_task is None:
+            self._replay_task = asyncio.create_task(self._replay())
+
+    def get_events(self):
+        '''
+        Returns the replay order, as a list of (t, stream, rows) sorted by time, or by arrival if known
+        stream is 'ibi', 'acc' or 'gap', with rows None for a gap
+        An acc frame is delivered at the time of its last sample, ibi before acc before gaps at equal times
+        '''
+        frame_starts = np.arange(0, len(self.acc), self.acc_frame_size)
+        frame_ends = np.minimum(frame_starts + self.acc_frame_size, len(self.acc))
+        if self.acc_frame_size == 1:
+            acc_rows = list(self.acc)
+        else:
+            acc_rows = [self.acc[start:end] for start, end in zip(frame_starts, frame_ends)]
+
+        event_times = np.concatenate((self.ibi[:, 0], self.acc[frame_ends - 1, 0], self.gaps))
+        event_rows = list(self.ibi) + acc_rows + [None]*len(self.gaps)
+        event_streams = ['ibi']*len(self.ibi) + ['acc']*len(acc_rows) + ['gap']*len(self.gaps)
+        if self.ibi_seq is not None and self.acc_seq is not None and (self.gap_seq is not None or len(self.gaps) == 0):
+            gap_seq = self.gap_seq if self.gap_seq is not None else []
+            order = np.argsort(np.concatenate((self.ibi_seq, self.acc_seq[frame_ends - 1], gap_seq)), kind='stable')
+        else:
+            order = np.argsort(event_times, kind='stable')
+        return [(event_times[i], event_streams[i], event_rows[i]) for i in order]
+
+    async def _replay(self):
+        events = self.get_events()
+        if not events:
+            return
+        self.logger.info(f"Replaying {len(self.ibi)} ibi and {len(self.acc)} acc samples at speed {self.speed or 'max'}")
+
+        t_start_data = events[0][0]
+        t_start_replay = time.perf_counter()
+        for n, (t, stream, rows) in enumerate(events):
+            if self.speed:
+                delay = (t - t_start_data)/self.speed - (time.perf_counter() - t_start_replay)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif n % self.YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+            if stream == 'gap':
+                if self._gap_callback is not None:
+                    self._gap_callback()
+                continue
+            callback = self._acc_callback if stream == 'acc' else self._ibi_callback
+            if callback is not None:
+                callback(rows)
+            if self._tick_callback is not None:
+                self._tick_callback()
+
+        self.logger.info(f"Replay finished in {time.perf_counter() - t_start_replay:.2f} s")
+
+    async def wait_until_done(self):
+        '''
+        Waits until every sample has been replayed
+        '''
+        if self._replay_task is not None:
+            await self._replay_task
+
+async def replay_session(client, model=None):
+    '''
+    Replays a ReplayClient through a Model, without a sensor or a Qt event loop
+    Gaps in the replay are marked in the model, as when the sensor reconnects,
+    and the scheduled analyses run after every sample, as often as their cadences ask for
+    Returns the model, with the analysers holding the results
+    '''
+    if model is None:
+        model = Model()
+    client.set_gap_callback(model.mark_gap)
+    client.set_tick_callback(model.run_scheduled)
+    await model.set_and_connect_sensor(client)
+    await client.wait_until_done()
+    return model
+
+def run_replay(client, model=None):
+    '''
+    Blocking version of replay_session, runs its own asyncio event loop
+    '''
+    return asyncio.run(replay_session(client, model=model))
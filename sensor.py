@@ -1,40 +1,169 @@
-from blehrm import blehrm
-from bleak import BleakScanner, BLEDevice
+import os
+import json
+import time
 import asyncio
-from typing import Dict
+from typing import Dict, Union, TYPE_CHECKING
 import logging
 from PySide6.QtCore import QObject, Signal
+if TYPE_CHECKING:
+    from bleak import BLEDevice
+# blehrm and bleak are imported when first used, as they take a while to import and are not needed to show the window
+
+def create_bleak_scanner(detection_callback):
+    '''
+    Returns a BleakScanner calling detection_callback(device, advertisement_data) for each advertisement
+    '''
+    from bleak import BleakScanner
+    return BleakScanner(detection_callback=detection_callback)
+
+class DeviceCache:
+
+    def __init__(self, path):
+        '''
+        Devices connected to before, as {name: {'address', 'device_type', 'last_connected'}} in a JSON file at path
+        Not saved if path is None
+        '''
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self.devices = self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring the device cache {self.path}: {e}")
+            return {}
+
+    def add(self, name, address, device_type):
+        self.devices[name] = {'address': address, 'device_type': device_type, 'last_connected': time.time()}
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path + '.tmp', 'w') as file:
+                json.dump(self.devices, file, indent=2)
+            os.replace(self.path + '.tmp', self.path) # Never leaves a partly written cache
+        except OSError as e:
+            self.logger.warning(f"Failed to save the device cache {self.path}: {e}")
+
+    def get_devices(self):
+        '''
+        Returns the cached devices, most recently connected first
+        '''
+        return dict(sorted(self.devices.items(), key=lambda item: -item[1]['last_connected']))
+
 class SensorHandler(QObject):
-    
+
+    device_found = Signal(str) # Name of a supported device, as soon as it is known
     scan_complete = Signal()
 
-    def __init__(self):
+    CACHE_PATH = os.path.join(os.path.expanduser('~'), '.ebyt', 'devices.json')
+    SCAN_DURATION = 5.0 # s of scanning for more devices after the first supported device advertises
+    SCAN_POLL_INTERVAL = 0.1 # s
+    SIMULATED_NAME = "Simulated sensor"
+    SIMULATED = 'Simulated' # Device type of the simulated sensor, not a blehrm one
+
+    def __init__(self, scanner_factory=create_bleak_scanner, cache_path=CACHE_PATH, simulated_options=None):
+        '''
+        Finds supported sensors. Devices connected to before are listed from the device cache at once,
+        with their address, so they can be connected to without waiting for a scan
+        scanner_factory(detection_callback) returns an object with async start and stop, as BleakScanner
+        simulated_options: keyword arguments of SimulatedClient, listed first as SIMULATED_NAME if not None
+        '''
         super().__init__()
-        self.valid_devices: Dict[str, BLEDevice] = {} 
+        self.scanner_factory = scanner_factory
+        self.simulated_options = simulated_options
+        self.device_cache = DeviceCache(cache_path)
+        self.valid_devices: Dict[str, Union['BLEDevice', str]] = {} # name: BLEDevice, or address of a cached device
+        self.device_types: Dict[str, str] = {} # name: blehrm device type
+        self._scan_id = 0 # Incremented to stop the running scan
         self.logger = logging.getLogger(__name__)
 
     def get_valid_device_names(self):
         return list(self.valid_devices.keys())
 
+    def _add_device(self, name, device, device_type):
+        is_new = name not in self.valid_devices
+        self.valid_devices[name] = device
+        self.device_types[name] = device_type
+        if is_new:
+            self.device_found.emit(name)
+
     async def scan(self):
         '''
         Scans for compatible BLE heart rate monitor devices
-        Emits the list of devices to devices_found
-        valid_devices is a list of strings, with the name of all valid sensors found
+        Emits device_found with the name of each cached device at once, and of each supported device as its
+        first advertisement arrives, then scan_complete SCAN_DURATION s after the first supported advertisement,
+        or when stop_scan is called
+        valid_devices maps the names of all valid sensors found to their BLEDevice, or address if only cached
         '''
         self.logger.info('Scanning for devices...')
+        from blehrm import BlehrmRegistry
 
+        self._scan_id += 1
+        scan_id = self._scan_id
         self.valid_devices = {}
-        while len(self.valid_devices) == 0: # Loop until supported device is found
-            ble_devices = await BleakScanner.discover()
+        self.device_types = {}
+        if self.simulated_options is not None:
+            self._add_device(self.SIMULATED_NAME, self.SIMULATED_NAME, self.SIMULATED)
+        for name, known in self.device_cache.get_devices().items():
+            if known['device_type'] in BlehrmRegistry.get_registered_sensors():
+                self._add_device(name, known['address'], known['device_type'])
+
+        t_first_advertised = None
+        advertised = set() # Names of the supported devices advertising
+
+        def on_advertisement(device, advertisement_data):
+            nonlocal t_first_advertised
+            if scan_id != self._scan_id or device.name in advertised:
+                return
+            device_type = BlehrmRegistry.device_support(device)
+            if device_type is None:
+                return
+            advertised.add(device.name)
+            t_first_advertised = t_first_advertised or time.monotonic()
+            self._add_device(device.name, device, device_type) # Replaces the address of a cached device
 
-            supported_devices = blehrm.get_supported_devices(ble_devices)
-            
-            self.valid_devices = {device.name: device for device, device_type in supported_devices}
-            self.logger.info(f"Found {len(ble_devices)} BLE devices, {len(self.valid_devices)} of which were valid")
-            await asyncio.sleep(1)
+        scanner = self.scanner_factory(on_advertisement)
+        try:
+            await scanner.start()
+        except Exception as e: # No Bluetooth adapter, which leaves the cached and simulated devices
+            self.logger.error(f"Failed to start scanning: {e}")
+            self.scan_complete.emit()
+            return
+        try:
+            while scan_id == self._scan_id:
+                if t_first_advertised is not None and time.monotonic() - t_first_advertised >= self.SCAN_DURATION:
+                    break
+                await asyncio.sleep(self.SCAN_POLL_INTERVAL)
+        finally:
+            await scanner.stop()
 
+        self.logger.info(f"Found {len(advertised)} supported devices advertising, {len(self.valid_devices)} valid devices")
         self.scan_complete.emit()
 
+    def stop_scan(self):
+        self._scan_id += 1
+
     def create_sensor_client(self, device_name):
-        return blehrm.create_client(self.valid_devices[device_name])
+        '''
+        Returns a client for a valid device, created by address for a cached device that has not advertised
+        '''
+        if self.device_types[device_name] == self.SIMULATED:
+            from simulated import SimulatedClient
+            return SimulatedClient(device_name, **self.simulated_options)
+        from blehrm import BlehrmRegistry
+        device_class = BlehrmRegistry.get_device_class(self.device_types[device_name])
+        return device_class(self.valid_devices[device_name])
+
+    def remember_device(self, device_name):
+        '''
+        Adds a valid device to the device cache, after connecting to it
+        '''
+        if device_name not in self.valid_devices or self.device_types[device_name] == self.SIMULATED: # Scanned again while connecting
+            return
+        device = self.valid_devices[device_name]
+        self.device_cache.add(device_name, getattr(device, 'address', device), self.device_types[device_name])
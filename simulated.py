@@ -0,0 +1,104 @@
+import asyncio
+import time
+import logging
+import numpy as np
+from blehrm.interface import BlehrmClientInterface
+from synthetic import SyntheticSignals
+
+class SimulatedClient(BlehrmClientInterface):
+    '''
+    Sensor client that streams synthetic ibi and chest acc into the stream callbacks, in place of a BLE sensor,
+    for running the app without hardware, soak tests and load tests
+    speed: 1 streams in real time with epoch sample times, N at N times real time, with sample times running ahead
+    signal_options: keyword arguments of SyntheticSignals, e.g. breathing_rate, mean_hr, ectopic_rate, acc_sample_rate
+    The session continues across a disconnect, without the samples of the time in between
+    '''
+    TICK_INTERVAL = 0.05 # s of real time between deliveries, each of the samples due
+
+    def __init__(self, name="Simulated sensor", speed=1.0, seed=0, **signal_options):
+        super().__init__(name)
+        self.logger = logging.getLogger(__name__)
+        self.speed = speed
+        self.seed = seed
+        self.signal_options = signal_options
+        self.signals = None # Created on the first connection
+        self.t_start_real = None
+        self.is_connected = False
+        self._stream_task = None
+
+    @staticmethod
+    def is_supported(device_name: str) -> bool:
+        return False # Never created from a BLE scan
+
+    async def connect(self) -> None:
+        if self.signals is None:
+            self.signals = SyntheticSignals(t_start=time.time(), seed=self.seed, **self.signal_options)
+            self.t_start_real = time.perf_counter()
+        self.is_connected = True
+
+    async def disconnect(self) -> None:
+        if self._stream_task is not None:
+            self._stream_task.cancel()
+            self._stream_task = None
+        self.is_connected = False
+
+    async def get_device_info(self) -> dict:
+        return {
+            "model_number": "Simulated",
+            "manufacturer_name": "Synthetic signals",
+            "battery_level": 100
+        }
+
+    async def start_ibi_stream(self, callback) -> None:
+        self.set_ibi_callback(callback)
+        self._start_stream()
+
+    async def stop_ibi_stream(self) -> None:
+        self._ibi_callback = None
+
+    async def start_acc_stream(self, callback) -> None:
+        self.set_acc_callback(callback)
+        self._start_stream()
+
+    async def stop_acc_stream(self) -> None:
+        self._acc_callback = None
+
+    def _ibi_data_processor(self, data: bytearray) -> np.ndarray:
+        ''' Required by the ABC'''
+        return np.array([])
+
+    def get_time(self):
+        '''
+        Returns the sample time of now in the simulated session
+        '''
+        return self.signals.t_start + self.speed*(time.perf_counter() - self.t_start_real)
+
+    def set_breathing_rate(self, breathing_rate):
+        '''
+        Changes the simulated breathing rate from now, in breaths per minute
+        '''
+        self.signals.set_breathing_rate(breathing_rate, self.get_time())
+
+    def _start_stream(self):
+        '''
+        Starts streaming once, after the streams started in the same step of the event loop are registered
+        Samples due while not streaming are dropped, as a sensor out of range would
+        '''
+        if self._stream_task is None:
+            t = self.get_time()
+            self.signals.get_ibi_until(t)
+            self.signals.get_acc_until(t)
+            self._stream_task = asyncio.create_task(self._stream())
+
+    async def _stream(self):
+        self.logger.info(f"Streaming simulated ibi and acc at speed {self.speed}")
+        while True:
+            await asyncio.sleep(self.TICK_INTERVAL)
+            t = self.get_time()
+            ibi = self.signals.get_ibi_until(t)
+            acc = self.signals.get_acc_until(t)
+            if self._ibi_callback is not None:
+                for row in ibi:
+                    self._ibi_callback(row)
+            if self._acc_callback is not None and len(acc):
+                self._acc_callback(acc) # As a frame, one sample per row
@@ -0,0 +1,80 @@
+'''
+Startup time measurement, for EBYT.py --profile-startup
+Times are from the import of this module, the first thing EBYT.py does.
+install_import_timer times the first import of each module from then on, including the modules it imports,
+by wrapping builtins.__import__, and mark records milestones such as the first paint of the window.
+report logs them, and writes them to JSON.
+'''
+import sys
+import json
+import time
+import logging
+import builtins
+import importlib.util
+
+T_START = time.perf_counter()
+REPORT_IMPORTS = 20 # Slowest imports reported in the log, all are in the JSON
+
+logger = logging.getLogger(__name__)
+
+import_times = {} # Module name: [s including the modules it imports, s of its own, nesting depth]
+milestones = {} # Name: s since T_START, in order
+
+def install_import_timer():
+    '''
+    Times the first import of each module from now on
+    '''
+    original_import = builtins.__import__
+    child_times = [] # Time of the timed imports nested in each import in progress
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        module_name = importlib.util.resolve_name('.'*level + name, (globals or {}).get('__package__')) if level else name
+        # Modules imported by this statement, either the module or submodules in fromlist, which 'from package import module' loads
+        new_names = [module_name] if module_name not in sys.modules else \
+                    [f"{module_name}.{item}" for item in fromlist or () if f"{module_name}.{item}" not in sys.modules]
+        if not new_names:
+            return original_import(name, globals, locals, fromlist, level)
+
+        child_times.append(0.0)
+        t_start = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            duration = time.perf_counter() - t_start
+            duration_children = child_times.pop()
+            if child_times:
+                child_times[-1] += duration
+            for new_name in new_names:
+                if new_name in sys.modules and new_name not in import_times:
+                    import_times[new_name] = [duration, duration - duration_children, len(child_times)]
+
+    builtins.__import__ = timed_import
+
+def mark(name):
+    '''
+    Records the time of a milestone, the first time it is reached
+    '''
+    milestones.setdefault(name, time.perf_counter() - T_START)
+
+def get_stats():
+    return {
+        'milestones_ms': {name: 1e3*t for name, t in milestones.items()},
+        'imports_ms': {name: {'total': 1e3*total, 'self': 1e3*own, 'depth': depth}
+                       for name, (total, own, depth) in sorted(import_times.items(), key=lambda item: -item[1][0])}
+    }
+
+def report(path=None):
+    '''
+    Logs the milestones and the slowest imports, and writes every time to path as JSON if given
+    '''
+    stats = get_stats()
+    lines = ["Startup, ms since start:"]
+    lines += [f"  {name:<24} {t:>8.1f}" for name, t in stats['milestones_ms'].items()]
+    if stats['imports_ms']:
+        lines.append(f"Slowest imports, ms including / excluding the modules they import:")
+        lines += [f"  {'  '*times['depth']}{name:<{40 - 2*times['depth']}} {times['total']:>8.1f} {times['self']:>8.1f}"
+                  for name, times in list(stats['imports_ms'].items())[:REPORT_IMPORTS]]
+    logger.info('\n'.join(lines))
+    if path is not None:
+        with open(path, 'w') as file:
+            json.dump(stats, file, indent=2)
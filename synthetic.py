@@ -0,0 +1,113 @@
+'''
+Deterministic synthetic sensor signals, for benchmarks and simulated sessions
+Rows have the layout of the sensor callbacks: ibi rows are (t, ibi ms), acc rows are (t, x, y, z)
+'''
+import numpy as np
+
+def generate_ibi(duration, t_start=0.0, breathing_rate=6, mean_hr=65, rsa_amplitude=8, noise=10, seed=0):
+    '''
+    Returns inter-beat intervals, with heart rate modulated by breathing (respiratory sinus arrhythmia)
+    breathing_rate in breaths per minute, mean_hr and rsa_amplitude in beats per minute, noise in ms
+    '''
+    rng = np.random.default_rng(seed)
+    n_beats = int(duration*(mean_hr + rsa_amplitude)/60) + 1
+    ibi = np.empty(n_beats)
+    times = np.empty(n_beats)
+    t = t_start
+    for i in range(n_beats):
+        hr = mean_hr + rsa_amplitude*np.sin(2*np.pi*breathing_rate/60*(t - t_start))
+        ibi[i] = 60000.0/hr + noise*rng.normal()
+        t += ibi[i]/1000
+        times[i] = t # Beat is reported when it ends
+    ids = times <= t_start + duration
+    return np.column_stack((times[ids], ibi[ids]))
+
+def generate_chest_acc(duration, t_start=0.0, sample_rate=10, breathing_rate=6, amplitude=0.3, noise=0.02, seed=0):
+    '''
+    Returns 3-axis chest acceleration in m/s2, gravity along z plus chest expansion at breathing_rate
+    '''
+    rng = np.random.default_rng(seed)
+    times = t_start + np.arange(int(duration*sample_rate))/sample_rate
+    breathing = amplitude*np.sin(2*np.pi*breathing_rate/60*(times - t_start))
+    acc = np.column_stack((
+        0.1*breathing + noise*rng.normal(size=len(times)),
+        0.1*breathing + noise*rng.normal(size=len(times)),
+        9.81 + breathing + noise*rng.normal(size=len(times))
+    ))
+    return np.column_stack((times, acc))
+
+class SyntheticSignals:
+
+    ECTOPIC_PREMATURITY = 0.3 # Fraction of the ibi by which an ectopic beat is early, and the compensatory pause late
+
+    def __init__(self, t_start=0.0, breathing_rate=6, mean_hr=65, rsa_amplitude=8, noise=10, ectopic_rate=0.01,
+                 acc_sample_rate=10, acc_amplitude=0.3, acc_noise=0.02, seed=0):
+        '''
+        Continuous ibi and chest acc of a session, generated up to a time on each call, for streaming sessions of any length
+        The signals are as generate_ibi and generate_chest_acc, with the breathing phase kept across calls
+        and changes of breathing rate, plus ectopic beats: a fraction ectopic_rate of the beats come early
+        and are followed by a compensatory pause, so the pair lasts as long as two normal beats
+        '''
+        self.t_start = t_start
+        self.breathing_rate = breathing_rate
+        self.mean_hr = mean_hr
+        self.rsa_amplitude = rsa_amplitude
+        self.noise = noise
+        self.ectopic_rate = ectopic_rate
+        self.acc_sample_rate = acc_sample_rate
+        self.acc_amplitude = acc_amplitude
+        self.acc_noise = acc_noise
+        self.rng = np.random.default_rng(seed)
+
+        self.breathing_phase = 0.0 # rad at t_phase, the last change of breathing rate
+        self.t_phase = t_start
+        self.compensatory_ibi = None # ms, of the beat after an ectopic beat
+        self.next_beat = self._generate_beat(t_start) # (t, ibi) of the next beat, generated ahead
+        self.n_beats = 0 # Beats generated
+        self.n_acc = 0 # Acc samples generated
+
+    def get_breathing_phase(self, t):
+        return self.breathing_phase + 2*np.pi*self.breathing_rate/60*(np.asarray(t) - self.t_phase)
+
+    def set_breathing_rate(self, breathing_rate, t):
+        '''
+        Changes the breathing rate from time t, after the samples generated so far
+        '''
+        self.breathing_phase = self.get_breathing_phase(t)
+        self.t_phase = t
+        self.breathing_rate = breathing_rate
+
+    def _generate_beat(self, t_last):
+        '''
+        Returns (t, ibi) of the beat after the beat ending at t_last
+        '''
+        hr = self.mean_hr + self.rsa_amplitude*np.sin(self.get_breathing_phase(t_last))
+        ibi = 60000.0/hr + self.noise*self.rng.normal()
+        if self.compensatory_ibi is not None:
+            ibi, self.compensatory_ibi = self.compensatory_ibi, None
+        elif self.rng.random() < self.ectopic_rate:
+            ibi, self.compensatory_ibi = (1 - self.ECTOPIC_PREMATURITY)*ibi, (1 + self.ECTOPIC_PREMATURITY)*ibi
+        return (t_last + ibi/1000, ibi) # Beat is reported when it ends
+
+    def get_ibi_until(self, t):
+        '''
+        Returns the beats ending after the last call, up to t, as rows (t, ibi ms)
+        '''
+        rows = []
+        while self.next_beat[0] <= t:
+            rows.append(self.next_beat)
+            self.next_beat = self._generate_beat(self.next_beat[0])
+        self.n_beats += len(rows)
+        return np.array(rows).reshape(-1, 2)
+
+    def get_acc_until(self, t):
+        '''
+        Returns the acc samples after the last call, up to t, as rows (t, x, y, z) in m/s2
+        '''
+        n_end = max(self.n_acc, int(np.floor((t - self.t_start)*self.acc_sample_rate)) + 1)
+        times = self.t_start + np.arange(self.n_acc, n_end)/self.acc_sample_rate
+        self.n_acc = n_end
+        breathing = self.acc_amplitude*np.sin(self.get_breathing_phase(times))
+        noise = self.acc_noise*self.rng.normal(size=(len(times), 3))
+        acc = np.column_stack((0.1*breathing, 0.1*breathing, 9.81 + breathing)) + noise
+        return np.column_stack((times, acc))
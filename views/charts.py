@@ -1,6 +1,7 @@
 
 from PySide6.QtCharts import QChart, QLineSeries, QValueAxis, QScatterSeries, QSplineSeries
 from PySide6.QtGui import QPen, QFont
+import numpy as np
 from styles.colours import GRAY
 
 def create_chart(title=None, showTitle=False, showLegend=False, margins=None):
@@ -62,4 +63,11 @@ def create_axis(title=None, color=None, tickCount=None, rangeMin=None, rangeMax=
         axis.setLabelsFont(font)
     if flip:
         axis.setReverse(True)
-    return axis
\ No newline at end of file
+    return axis
+
+def replace_series_np(series, x, y):
+    '''
+    Replaces all points of a QXYSeries in bulk from x and y arrays
+    replaceNp requires contiguous float64 arrays, anything else is silently dropped (or crashes)
+    '''
+    series.replaceNp(np.ascontiguousarray(x, dtype=np.float64), np.ascontiguousarray(y, dtype=np.float64))
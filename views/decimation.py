@@ -0,0 +1,94 @@
+'''
+Decimation of chart series to the resolution of the screen
+A chart n pixels wide can show at most n distinct x positions, so points beyond a few per pixel only cost
+layout and paint time. Functions take x in increasing order, as HistoryBuffer.get_series_arrays returns,
+and return indices of the points to draw.
+'''
+import numpy as np
+
+DECIMATION_METHODS = ('minmax', 'lttb')
+MIN_POINTS_PER_PIXEL = 4 # Series with fewer points per pixel than this are drawn in full
+
+def get_visible_ids(x, x_min, x_max):
+    '''
+    Returns the start and end indices of the points in [x_min, x_max], plus one point beyond each edge
+    so lines reach the edges of the chart
+    '''
+    i_start = max(np.searchsorted(x, x_min, side='left') - 1, 0)
+    i_end = min(np.searchsorted(x, x_max, side='right') + 1, len(x))
+    return (i_start, i_end)
+
+def minmax_ids(x, y, x_min, x_max, n_buckets):
+    '''
+    Returns indices of the minimum and maximum point of each of n_buckets equal x intervals, with the first and last points
+    Keeps every peak and trough, so the drawn line covers the same pixels as the full series
+    '''
+    buckets = np.clip(((x - x_min)*(n_buckets/(x_max - x_min))).astype(np.int64), 0, n_buckets - 1)
+    bucket_starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+    counts = np.diff(bucket_starts, append=len(x))
+
+    ids = [np.array([0, len(x) - 1])]
+    for reduce in (np.minimum, np.maximum):
+        extremes = np.repeat(reduce.reduceat(y, bucket_starts), counts)
+        extreme_ids = np.flatnonzero(y == extremes)
+        is_first = np.diff(buckets[extreme_ids], prepend=-1) != 0 # First extreme of each bucket
+        ids.append(extreme_ids[is_first])
+    return np.unique(np.concatenate(ids))
+
+def lttb_ids(x, y, n_out):
+    '''
+    Returns indices of n_out points chosen by Largest-Triangle-Three-Buckets (Steinarsson, 2013)
+    Each bucket keeps the point forming the largest triangle with the point kept from the previous bucket
+    and the average of the next bucket, which preserves the visual shape of the series
+    '''
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    bucket_edges = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64)
+    next_x = np.add.reduceat(x[1:n - 1], bucket_edges[:-1] - 1)
+    next_y = np.add.reduceat(y[1:n - 1], bucket_edges[:-1] - 1)
+    bucket_sizes = np.diff(bucket_edges)
+    next_x = np.append(next_x/bucket_sizes, x[-1])[1:] # Average of the following bucket, the last point after the last bucket
+    next_y = np.append(next_y/bucket_sizes, y[-1])[1:]
+
+    # The buckets are a few points each, where plain Python floats are several times faster than numpy calls
+    x, y, next_x, next_y, bucket_edges = x.tolist(), y.tolist(), next_x.tolist(), next_y.tolist(), bucket_edges.tolist()
+    ids = [0]
+    i_prev = 0
+    for i in range(n_out - 2):
+        x_prev, y_prev = x[i_prev], y[i_prev]
+        dx_next, dy_next = next_x[i] - x_prev, next_y[i] - y_prev
+        area_max = -1.0
+        for j in range(bucket_edges[i], bucket_edges[i + 1]):
+            area = abs(dx_next*(y[j] - y_prev) - (x[j] - x_prev)*dy_next) # Twice the triangle area
+            if area > area_max:
+                area_max = area
+                i_prev = j
+        ids.append(i_prev)
+    ids.append(n - 1)
+    return np.array(ids)
+
+def decimate(x, y, x_min, x_max, n_pixels, method='minmax', keep_x=None):
+    '''
+    Returns (x, y) of the points to draw in a chart n_pixels wide showing x_min to x_max
+    Points outside the range are dropped, and the rest decimated by method, 'minmax' (2 points per pixel)
+    or 'lttb' (2 points per pixel, chosen by shape)
+    keep_x: x values of points that are always kept, e.g. markers drawn on the series
+    '''
+    i_start, i_end = get_visible_ids(x, x_min, x_max)
+    x = x[i_start:i_end]
+    y = y[i_start:i_end]
+    if n_pixels <= 0 or len(x) <= MIN_POINTS_PER_PIXEL*n_pixels:
+        return (x, y)
+
+    if method == 'minmax':
+        ids = minmax_ids(x, y, x_min, x_max, n_pixels)
+    elif method == 'lttb':
+        ids = lttb_ids(x, y, 2*n_pixels)
+    else:
+        raise ValueError(f"Decimation method must be one of {DECIMATION_METHODS}")
+
+    if keep_x is not None and len(keep_x):
+        keep_ids = np.searchsorted(x, keep_x)
+        ids = np.union1d(ids, keep_ids[keep_ids < len(x)])
+    return (x[ids], y[ids])
@@ -1,11 +1,15 @@
 
-from PySide6.QtCore import Qt,QMargins, QSize
-from PySide6.QtWidgets import QSizePolicy, QWidget
-from PySide6.QtCharts import QChart, QChartView,QValueAxis, QSplineSeries, QAreaSeries
-from PySide6.QtGui import QPen
+import numpy as np
+from PySide6.QtCore import Qt, QSize, QPointF
+from PySide6.QtWidgets import QSizePolicy, QWidget, QLabel
+from PySide6.QtGui import QPen, QPainter, QColor, QFontDatabase
 
-class CirclesWidget(QChartView):
+class CirclesWidget(QWidget):
     def __init__(self, x_values=None, y_values=None, pacer_color=None, breathing_color=None, hr_color=None):
+        '''
+        Pacer disc and breathing ring, painted directly rather than as chart series
+        Radii are in the units of the circle coordinates, 1 is the edge of the widget
+        '''
         super().__init__()
 
         self.setSizePolicy(
@@ -14,60 +18,49 @@ class CirclesWidget(QChartView):
                 QSizePolicy.Preferred,
             )
         )
-        
-        self.scene().setBackgroundBrush(Qt.white)
-        self.setAlignment(Qt.AlignCenter)
-
-        self.plot = QChart()
-        self.plot.legend().setVisible(False)
-        self.plot.setBackgroundRoundness(0)
-        self.plot.setMargins(QMargins(0, 0, 0, 0))
-
-        # Pacer disc
-        self.pacer_circumference_coord = QSplineSeries()
-        self.disk = QAreaSeries(self.pacer_circumference_coord)
-        self.disk.setColor(pacer_color)
-        self.plot.addSeries(self.disk)
-
-        # Breathing disc
-        self.breath_circumference_coord = QSplineSeries()
-        pen = QPen(breathing_color)
-        pen.setWidth(2)
-        self.breath_circumference_coord.setPen(pen)
-        self.plot.addSeries(self.breath_circumference_coord)   
 
-        if x_values is not None and y_values is not None:
-            self._instantiate_series(x_values, y_values)
-
-        # Axes
-        self.x_axis = QValueAxis()
-        self.x_axis.setRange(-1, 1)
-        self.x_axis.setVisible(False)
-        self.plot.addAxis(self.x_axis, Qt.AlignBottom)
-        self.disk.attachAxis(self.x_axis)
-        self.breath_circumference_coord.attachAxis(self.x_axis)
-
-        self.y_axis = QValueAxis()
-        self.y_axis.setRange(-1, 1)
-        self.y_axis.setVisible(False)
-        self.plot.addAxis(self.y_axis, Qt.AlignLeft)
-        self.disk.attachAxis(self.y_axis)
-        self.breath_circumference_coord.attachAxis(self.y_axis)
-        
-        self.setChart(self.plot)
+        self.pacer_color = QColor(pacer_color)
+        self.breath_pen = QPen(QColor(breathing_color))
+        self.breath_pen.setWidth(2)
 
-    def _instantiate_series(self, x_values, y_values):
-        for x, y in zip(x_values, y_values):
-            self.pacer_circumference_coord.append(x, y)
-            self.breath_circumference_coord.append(0, 0)
+        self.pacer_radius = 0
+        self.breath_radius = 0
+        if x_values is not None and y_values is not None:
+            self.update_pacer_series(x_values, y_values)
 
     def update_pacer_series(self, x_values, y_values):
-        for i, (x, y) in enumerate(zip(x_values, y_values)):
-            self.pacer_circumference_coord.replace(i, x, y)
+        self.set_pacer_radius(np.hypot(x_values[0], y_values[0]))
 
     def update_breath_series(self, x_values, y_values):
-        for i, (x, y) in enumerate(zip(x_values, y_values)):
-            self.breath_circumference_coord.replace(i, x, y)
+        self.set_breath_radius(np.hypot(x_values[0], y_values[0]))
+
+    def set_pacer_radius(self, radius):
+        if self._to_pixels(radius) != self._to_pixels(self.pacer_radius):
+            self.update() # Repaint only when the disc changes by a pixel
+        self.pacer_radius = radius
+
+    def set_breath_radius(self, radius):
+        if self._to_pixels(radius) != self._to_pixels(self.breath_radius):
+            self.update()
+        self.breath_radius = radius
+
+    def _to_pixels(self, radius):
+        return round(radius*min(self.width(), self.height())/2)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.fillRect(self.rect(), Qt.white)
+        painter.translate(self.width()/2, self.height()/2)
+        scale = min(self.width(), self.height())/2
+
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(self.pacer_color)
+        painter.drawEllipse(QPointF(0, 0), self.pacer_radius*scale, self.pacer_radius*scale)
+
+        painter.setPen(self.breath_pen)
+        painter.setBrush(Qt.NoBrush)
+        painter.drawEllipse(QPointF(0, 0), self.breath_radius*scale, self.breath_radius*scale)
 
     def sizeHint(self):
         height = self.size().height()
@@ -94,3 +87,19 @@ class SquareWidget(QWidget):
         else:
             self.setMaximumWidth(side)
             self.setMaximumHeight(side)
+
+class StatsOverlay(QLabel):
+    def __init__(self, parent):
+        '''
+        Text overlay in the top left corner of parent, for the instrumentation statistics
+        '''
+        super().__init__(parent)
+        self.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.setStyleSheet("QLabel {background-color: rgba(255, 255, 255, 200); color: black; padding: 4px}")
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.move(0, 0)
+
+    def set_stats(self, text):
+        self.setText(text)
+        self.adjustSize()
+        self.raise_()